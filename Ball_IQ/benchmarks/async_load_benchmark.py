@@ -0,0 +1,117 @@
+"""
+Load test of many conversations served at once, by a pool of worker threads calling
+`process_user_input` and by a single event loop awaiting `aprocess_user_input`.
+
+The model is a stub that takes `--model-ms` to answer, awaited on the async path as a call
+to the OpenAI API would be. The intents are picked from the message by a stub router and
+the chains read the real `balliq.db`, nothing is written. Run from the `Ball_IQ` folder:
+    python -m benchmarks.async_load_benchmark --model-ms 500 --conversations 1 10 100 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import StubRouteChoice, make_stub_llm, make_stub_resources
+from chatbot.registry import ChatbotRegistry
+
+ANSWER = "Your lineup looks solid for this gameweek, keep an eye on the fixtures of your defenders."
+# Messages that only read the database, with the intent the stub router gives them
+MESSAGES = {
+    "hello, how are you doing?": "chit_chat",
+    "optimize my lineup": "optimize_lineup",
+    "show me the stats of Saka": "view_players_stats",
+    "when does Arsenal play next?": "check_upcoming_fixtures",
+}
+# Users of balliq.db the conversations are spread over
+USER_IDS = range(1, 12)
+
+
+class MessageRouter:
+    """Intent service stand-in that routes the messages of the load test."""
+
+    def retrieve_multiple_routes(self, text):
+        return [StubRouteChoice(MESSAGES[text], 1.0)]
+
+
+class NoFastPath:
+    """Fast path router stand-in that leaves every message to the intent service."""
+
+    def classify(self, text):
+        return None
+
+
+def conversation_messages(index, count):
+    texts = list(MESSAGES)
+    return [texts[(index + number) % len(texts)] for number in range(count)]
+
+
+def run_threads(registry, conversations, messages, threads):
+    """Serve every conversation from a pool of threads, returning the latency of each message."""
+
+    def conversation(index):
+        bot = registry.get_chatbot(USER_IDS[index % len(USER_IDS)], f"load-{index}")
+        latencies = []
+        for text in conversation_messages(index, messages):
+            start = time.perf_counter()
+            bot.process_user_input({"customer_input": text})
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return [latency for latencies in pool.map(conversation, range(conversations)) for latency in latencies]
+
+
+async def run_event_loop(registry, conversations, messages):
+    """Serve every conversation from one event loop, returning the latency of each message."""
+
+    async def conversation(index):
+        bot = registry.get_chatbot(USER_IDS[index % len(USER_IDS)], f"load-{index}")
+        latencies = []
+        for text in conversation_messages(index, messages):
+            start = time.perf_counter()
+            await bot.aprocess_user_input({"customer_input": text})
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    results = await asyncio.gather(*(conversation(index) for index in range(conversations)))
+    return [latency for latencies in results for latency in latencies]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model-ms", type=float, default=500, help="Time the stub model takes to answer.")
+    parser.add_argument("--conversations", type=int, nargs="+", default=[1, 10, 100, 500], help="Concurrent conversations.")
+    parser.add_argument("--messages", type=int, default=2, help="Messages sent one after the other in each conversation.")
+    parser.add_argument("--threads", type=int, default=8, help="Worker threads of the threaded server.")
+    parser.add_argument("--max-threaded", type=int, default=100, help="Most conversations run on the threads, more would take minutes.")
+    args = parser.parse_args()
+
+    llm = make_stub_llm([ANSWER], chars_per_second=len(ANSWER) / (args.model_ms / 1000))
+    resources = make_stub_resources(llm=llm, intent_service=MessageRouter(), fast_router=NoFastPath())
+    # Chains and player tables are built outside of the measurements
+    warm = ChatbotRegistry(resources).get_chatbot(USER_IDS[0], "warm-up")
+    for text in MESSAGES:
+        asyncio.run(warm.aprocess_user_input({"customer_input": text}))
+
+    print(f"model answering in {args.model_ms:.0f} ms, {args.messages} messages per conversation")
+    print(f"{'conversations':>13}  {'server':<22}{'messages/s':>12}{'latency ms p50':>16}{'p95':>8}")
+    for conversations in args.conversations:
+        modes = [("event loop", lambda registry: asyncio.run(run_event_loop(registry, conversations, args.messages)))]
+        if conversations <= args.max_threaded:
+            modes.insert(0, (f"{args.threads} threads", lambda registry: run_threads(registry, conversations, args.messages, args.threads)))
+        for label, run in modes:
+            registry = ChatbotRegistry(resources)
+            start = time.perf_counter()
+            latencies = sorted(run(registry))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{conversations:>13}  {label:<22}{len(latencies) / elapsed:>12.1f}"
+                f"{statistics.median(latencies) * 1000:>16.0f}{latencies[int(0.95 * (len(latencies) - 1))] * 1000:>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
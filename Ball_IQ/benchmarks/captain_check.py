@@ -0,0 +1,105 @@
+"""
+Check that benching the captain clears the armband, with the local lineup commands and
+with the tool the model's extraction calls, and that a captain named in the same message
+must still be starting. A lineup saved by the optimizer without the captain passes the
+armband to its best starter.
+
+Runs on a copy of `balliq.db` in a temporary folder, with a simulated user whose first
+starting forward is the captain. The exit code is 1 when a case fails. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.captain_check
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.gameweek_benchmark import add_users
+from chatbot.chains.PuttingPlayerInStarting11Chain import PuttingPlayerInStarting11
+from chatbot.chains.lineup_commands import LineupCommand
+from data.connection import get_pool
+from data.lineup_optimizer import load_squads, optimize_lineup, save_lineups
+from data.loader import get_sqlite_database_path
+
+
+def command(action, *players):
+    """A lineup command on (player_id, name) pairs."""
+    return LineupCommand(action, tuple(p[0] for p in players), tuple(p[1] for p in players))
+
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        pool = get_pool(db_path)
+        tool = PuttingPlayerInStarting11(db_path=db_path)
+
+        def lineup(user_id):
+            """The captain and the starters and bench players of a user, as (player_id, name) pairs."""
+            rows = pool.fetch_all(
+                """SELECT ut.player_id, p.name, ut.starting_eleven, ut.captain FROM user_team ut
+                JOIN players_fantasy p ON p.player_id = ut.player_id
+                WHERE ut.user_id = ? AND ut.on_team = 1 ORDER BY ut.player_id""",
+                (user_id,),
+            )
+            captain = next((row[:2] for row in rows if row[3]), None)
+            return captain, [row[:2] for row in rows if row[2]], [row[:2] for row in rows if not row[2]]
+
+        def case(label, user_id, apply, codes, captain_after):
+            nonlocal failures
+            outcomes = apply()
+            got = [outcome.code for outcome in ([outcomes] if hasattr(outcomes, "code") else outcomes)]
+            captain = lineup(user_id)[0]
+            ok = got == codes and (captain and captain[0]) == captain_after
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {label}: {got}, captain {captain}")
+
+        user_ids = add_users(db_path, 5)
+        captain, starters, bench = lineup(user_ids[0])
+        case(
+            "bench the captain, start a substitute", user_ids[0],
+            lambda: tool.apply_commands(user_ids[0], [command("remove", captain), command("add", bench[0])]),
+            ["lineup.removed", "lineup.added", "lineup.captain_cleared"], None,
+        )
+        captain, starters, bench = lineup(user_ids[1])
+        case(
+            "captain a substitute", user_ids[1],
+            lambda: tool.apply_commands(user_ids[1], [command("captain", bench[0])]),
+            ["lineup.captain_not_starting", "lineup.unchanged"], captain[0],
+        )
+        other = next(player for player in starters if player != captain)
+        case(
+            "captain a starter, then bench him", user_ids[1],
+            lambda: tool.apply_commands(user_ids[1], [command("captain", other), command("remove", other)]),
+            ["lineup.captain_not_starting", "lineup.unchanged"], captain[0],
+        )
+        captain, starters, bench = lineup(user_ids[2])
+        case(
+            "tool removes the captain", user_ids[2],
+            lambda: tool._run(user_id=user_ids[2], player_name=captain[1], action="remove"),
+            ["lineup.removed", "lineup.captain_cleared"], None,
+        )
+        captain, starters, bench = lineup(user_ids[3])
+        other = next(player for player in starters if player != captain)
+        case(
+            "tool removes another starter", user_ids[3],
+            lambda: tool._run(user_id=user_ids[3], player_name=other[1], action="remove"),
+            ["lineup.removed"], captain[0],
+        )
+        captain, starters, bench = lineup(user_ids[4])
+        squad = load_squads(db_path, [user_ids[4]])[user_ids[4]]
+        optimized = optimize_lineup([player for player in squad if player.player_id != captain[0]])
+        best = max(optimized.starters, key=lambda player: player.expected_points).player_id
+        case(
+            "optimizer benches the captain", user_ids[4],
+            lambda: save_lineups({user_ids[4]: optimized}, db_path) or [],
+            [], best,
+        )
+        pool.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Run simulated users doing transfers, lineup edits and squad reads in parallel threads,
+once with a new default connection per call and once through the shared connection pool.
+
+Each mode works on its own copy of `balliq.db` in a temporary folder, with one simulated
+user per thread. Run from the `Ball_IQ` folder:
+    python -m benchmarks.concurrency_benchmark --users 16 --operations 200
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from data.connection import ConnectionPool, is_busy_error
+from data.loader import get_sqlite_database_path
+
+# Players of each position in a full fantasy squad
+SQUAD_SHAPE = {"Goalkeeper": 2, "Defender": 5, "Midfielder": 5, "Forward": 3}
+# Share of each kind of operation
+MIX = (("transfer", 0.3), ("lineup", 0.4), ("read", 0.3))
+
+
+def add_users(db_path, count, seed=0):
+    """
+    Add simulated users with full squads to a database.
+
+    Args:
+        db_path (str): Path to the copy of the database.
+        count (int): Number of users.
+        seed (int): Seed of the squads.
+
+    Returns:
+        list: Ids of the new users.
+    """
+    rng = random.Random(seed)
+    with closing(sqlite3.connect(db_path)) as db:
+        players = db.execute("SELECT player_id, position FROM players_fantasy").fetchall()
+        by_position = {position: [p for p, pos in players if pos == position] for position in SQUAD_SHAPE}
+        user_ids = []
+        with db:
+            for number in range(count):
+                cursor = db.execute(
+                    """INSERT INTO users (username, email, password, team_name, budget, points)
+                    VALUES (?, ?, 'x', 'Simulated FC', 20, 0)""",
+                    (f"sim{number}", f"sim{number}@balliq.test"),
+                )
+                squad = [p for position, size in SQUAD_SHAPE.items() for p in rng.sample(by_position[position], size)]
+                db.executemany(
+                    "INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, 0)",
+                    [(cursor.lastrowid, player_id) for player_id in squad],
+                )
+                user_ids.append(cursor.lastrowid)
+    return user_ids
+
+
+def transfer(db, user_id, rng):
+    """Swap a random squad player for a random player of the same position, if the budget allows."""
+    player_out, position, price_out = rng.choice(db.execute(
+        """SELECT p.player_id, p.position, p.price FROM user_team ut
+        JOIN players_fantasy p ON p.player_id = ut.player_id
+        WHERE ut.user_id = ? AND ut.on_team = 1""",
+        (user_id,),
+    ).fetchall())
+    player_in, price_in = rng.choice(db.execute(
+        """SELECT player_id, price FROM players_fantasy WHERE position = ?
+        AND player_id NOT IN (SELECT player_id FROM user_team WHERE user_id = ? AND on_team = 1)""",
+        (position, user_id),
+    ).fetchall())
+    budget = db.execute("SELECT budget FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    budget_after = round(budget + price_out - price_in, 1)
+    # The users table keeps budgets between 0 and 100
+    if not 0 <= budget_after <= 100:
+        return
+    db.execute(
+        "UPDATE user_team SET on_team = 0, starting_eleven = 0 WHERE user_id = ? AND player_id = ?",
+        (user_id, player_out),
+    )
+    db.execute(
+        """INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, 0)
+        ON CONFLICT(user_id, player_id) DO UPDATE SET on_team = 1""",
+        (user_id, player_in),
+    )
+    db.execute("UPDATE users SET budget = ? WHERE user_id = ?", (budget_after, user_id))
+
+
+def lineup(db, user_id, rng):
+    """Move a random squad player in or out of the starting eleven."""
+    squad = db.execute(
+        "SELECT player_id, starting_eleven FROM user_team WHERE user_id = ? AND on_team = 1", (user_id,)
+    ).fetchall()
+    player_id, starting = rng.choice(squad)
+    if not starting and sum(row[1] for row in squad) >= 11:
+        return
+    db.execute(
+        "UPDATE user_team SET starting_eleven = ? WHERE user_id = ? AND player_id = ?",
+        (1 - starting, user_id, player_id),
+    )
+
+
+def read(db, user_id, rng):
+    """Read the squad, as the chains do before calling the model."""
+    db.execute(
+        """SELECT p.name, p.team, p.position, p.expected_points_next_game FROM players_fantasy p
+        JOIN user_team ut ON p.player_id = ut.player_id WHERE ut.user_id = ? AND ut.on_team = 1""",
+        (user_id,),
+    ).fetchall()
+
+
+OPERATIONS = {"transfer": transfer, "lineup": lineup, "read": read}
+
+
+def run_per_call(db_path, operation, user_id, rng):
+    """The pattern of the tools before the pool: a new connection for every call."""
+    with closing(sqlite3.connect(db_path)) as db:
+        with db:
+            OPERATIONS[operation](db, user_id, rng)
+
+
+def simulate(db_path, user_ids, operations, run):
+    """
+    Run every user in its own thread.
+
+    Returns:
+        tuple: Latencies in ms by operation, number of failed operations and elapsed seconds.
+    """
+    latencies = {name: [] for name in OPERATIONS}
+    failures = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(len(user_ids))
+
+    def user(user_id):
+        rng = random.Random(user_id)
+        names, weights = zip(*MIX)
+        start_barrier.wait()
+        for _ in range(operations):
+            operation = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                run(db_path, operation, user_id, rng)
+            except sqlite3.OperationalError as error:
+                if not is_busy_error(error):
+                    raise
+                with lock:
+                    failures.append(operation)
+                continue
+            with lock:
+                latencies[operation].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=user, args=(user_id,)) for user_id in user_ids]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(failures), time.perf_counter() - start
+
+
+def check_consistency(db_path, user_ids):
+    """Count the users whose squad or starting eleven break the game rules."""
+    with closing(sqlite3.connect(db_path)) as db:
+        rows = db.execute(
+            f"""SELECT user_id, SUM(on_team), SUM(starting_eleven) FROM user_team
+            WHERE user_id IN ({','.join('?' * len(user_ids))}) GROUP BY user_id""",
+            user_ids,
+        ).fetchall()
+    return sum(on_team != 15 or starting > 11 for _, on_team, starting in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=16, help="Simulated users, one thread each.")
+    parser.add_argument("--operations", type=int, default=200, help="Operations of each user.")
+    parser.add_argument("--max-connections", type=int, default=8, help="Bound of the pool.")
+    parser.add_argument("--busy-timeout", type=float, default=5.0, help="Seconds SQLite waits for a lock.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{args.users} users x {args.operations} operations")
+        print(f"{'mode':<14}{'ops/s':>9}{'failed':>8}{'broken':>8}" + "".join(f"{name + ' p50/p99 ms':>24}" for name in OPERATIONS))
+        for mode in ("per call", "pool"):
+            db_path = os.path.join(folder, f"{mode.replace(' ', '_')}.db")
+            shutil.copy(get_sqlite_database_path(), db_path)
+            user_ids = add_users(db_path, args.users)
+
+            if mode == "per call":
+                run = run_per_call
+            else:
+                pool = ConnectionPool(db_path, max_connections=args.max_connections, busy_timeout=args.busy_timeout)
+
+                def run(db_path, operation, user_id, rng):
+                    # Reads don't need the write lock
+                    pool.run(lambda db: OPERATIONS[operation](db, user_id, rng), immediate=operation != "read")
+
+            latencies, failures, elapsed = simulate(db_path, user_ids, args.operations, run)
+            done = sum(len(values) for values in latencies.values())
+            columns = "".join(
+                f"{statistics.median(values):>12.2f}/{statistics.quantiles(values, n=100)[98]:<11.2f}"
+                if len(values) > 1 else f"{'-':>24}"
+                for values in latencies.values()
+            )
+            print(f"{mode:<14}{done / elapsed:>9.0f}{failures:>8}{check_consistency(db_path, user_ids):>8}{columns}")
+            if mode == "pool":
+                pool.close()
+    print("failed: operations that gave up on a locked database; broken: users left with an invalid squad.")
+
+
+if __name__ == "__main__":
+    main()
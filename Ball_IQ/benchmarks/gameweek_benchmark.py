@@ -0,0 +1,133 @@
+"""
+Time the gameweek rollover on many simulated users and check it against scoring them one
+at a time, as UpdatePointsTool does.
+
+Both run on their own copy of `balliq.db` in a temporary folder, with the same simulated
+users: a squad of 15 players each, 11 of them in the starting eleven. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.gameweek_benchmark --users 100000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from benchmarks.concurrency_benchmark import SQUAD_SHAPE
+from data.connection import get_pool
+from data.gameweek import read_feed, rollover
+from data.loader import get_sqlite_database_path
+
+# Starters of each position in the lineup of the simulated users, a 4-4-2
+STARTERS = {"Goalkeeper": 1, "Defender": 4, "Midfielder": 4, "Forward": 2}
+
+
+def add_users(db_path, count, seed=0):
+    """
+    Add simulated users with a full squad, a starting eleven and a captain, in bulk.
+
+    Returns:
+        list: Ids of the new users.
+    """
+    rng = random.Random(seed)
+    with closing(sqlite3.connect(db_path)) as db, db:
+        players = db.execute("SELECT player_id, position FROM players_fantasy").fetchall()
+        by_position = {position: [p for p, pos in players if pos == position] for position in SQUAD_SHAPE}
+        first = (db.execute("SELECT MAX(user_id) FROM users").fetchone()[0] or 0) + 1
+        user_ids = list(range(first, first + count))
+        db.executemany(
+            """INSERT INTO users (user_id, username, email, password, team_name, budget, points)
+            VALUES (?, ?, ?, 'x', 'Simulated FC', 20, 0)""",
+            [(user_id, f"sim{user_id}", f"sim{user_id}@balliq.test") for user_id in user_ids],
+        )
+        rows = []
+        for user_id in user_ids:
+            for position, size in SQUAD_SHAPE.items():
+                for number, player_id in enumerate(rng.sample(by_position[position], size)):
+                    rows.append((user_id, player_id, int(number < STARTERS[position])))
+        db.executemany(
+            "INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, ?)", rows
+        )
+        # The first forward of each starting eleven wears the armband
+        db.executemany(
+            """UPDATE user_team SET captain = 1 WHERE user_id = ? AND player_id = (
+                SELECT ut.player_id FROM user_team ut JOIN players_fantasy p ON p.player_id = ut.player_id
+                WHERE ut.user_id = ? AND ut.starting_eleven = 1 AND p.position = 'Forward'
+                ORDER BY ut.player_id LIMIT 1
+            )""",
+            [(user_id, user_id) for user_id in user_ids],
+        )
+    return user_ids
+
+
+def score_one_at_a_time(db_path, points, user_ids):
+    """Score each user with its own read and UPDATE, the way of the points tool."""
+    pool = get_pool(db_path)
+    for user_id in user_ids:
+        starters = pool.fetch_all(
+            "SELECT player_id, captain FROM user_team WHERE user_id = ? AND on_team = 1 AND starting_eleven = 1",
+            (user_id,),
+        )
+        gained = sum(points.get(player_id, 0) * (1 + captain) for player_id, captain in starters)
+        if gained:
+            pool.run(
+                lambda db: db.execute(
+                    "UPDATE users SET points = MAX(points + ?, 0) WHERE user_id = ?", (gained, user_id)
+                )
+            )
+
+
+def user_points(db_path):
+    with closing(sqlite3.connect(db_path)) as db:
+        return dict(db.execute("SELECT user_id, points FROM users"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100000, help="Simulated users.")
+    parser.add_argument("--sample", type=int, default=5000, help="Users scored one at a time, to extrapolate.")
+    args = parser.parse_args()
+
+    feed = read_feed(os.path.join(os.path.dirname(get_sqlite_database_path()), "players.csv"))
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {mode: os.path.join(folder, f"{mode}.db") for mode in ("batch", "one_at_a_time")}
+        start = time.perf_counter()
+        shutil.copy(get_sqlite_database_path(), paths["batch"])
+        # Migrated before timing, and before the users are given a captain
+        get_pool(paths["batch"]).close()
+        user_ids = add_users(paths["batch"], args.users)
+        shutil.copy(paths["batch"], paths["one_at_a_time"])
+        print(f"added {args.users} users to each copy in {time.perf_counter() - start:.1f} s")
+
+        report = rollover(
+            feed,
+            db_path=paths["batch"],
+            progress=lambda done, total: print(f"  scored {done}/{total} users"),
+        )
+        print(
+            f"batch rollover: {report.users_scored} users scored, {report.prices_changed} prices changed "
+            f"in {report.seconds:.2f} s ({report.users_scored / report.seconds:.0f} users/s)"
+        )
+
+        sample = user_ids[: args.sample]
+        start = time.perf_counter()
+        score_one_at_a_time(paths["one_at_a_time"], feed.points, sample)
+        elapsed = time.perf_counter() - start
+        print(
+            f"one at a time: {len(sample)} users in {elapsed:.2f} s ({len(sample) / elapsed:.0f} users/s), "
+            f"{elapsed * len(user_ids) / len(sample):.1f} s extrapolated to {len(user_ids)} users"
+        )
+
+        batch, single = user_points(paths["batch"]), user_points(paths["one_at_a_time"])
+        differences = sum(batch[user_id] != single[user_id] for user_id in sample)
+        print(f"users of the sample scored differently: {differences}")
+        for path in paths.values():
+            get_pool(path).close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Count the prompt tokens sent to the model on each turn of a long conversation, with the
+whole chat history given twice as the chains did before, and with the history compacted
+to the last turns and a rolling summary.
+
+The chit chat chain answers from a stub model and the summaries are written by another
+one, whose prompts are counted as well. The summaries are written in the background after
+each reply and waited for before the next message. Runs on a copy of `balliq.db` in a
+temporary folder. Run from the `Ball_IQ` folder:
+    python -m benchmarks.history_tokens_benchmark --turns 40 --max-tokens 1000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from benchmarks.stubs import make_stub_llm, make_stub_resources
+from chatbot.bot import MainChatbot
+from chatbot.chains.base import PromptTemplate, generate_prompt_templates
+from chatbot.chains.chictchat import Chitchat
+from chatbot.memory import HistoryCompactor, MemoryManager, SQLiteHistoryBackend, _encoding, count_tokens
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+
+ANSWER = (
+    "Good shout! Saka has been in great form lately with two goals and an assist in his last three games, "
+    "and Arsenal have a kind run of fixtures coming up. If you have the budget I'd keep him and look at "
+    "a cheap defender to free up funds for a premium midfielder. Anything else about your team?"
+)
+SUMMARY = (
+    "The user manages a fantasy team and asked about Saka, Salah, Haaland and their captain choice. "
+    "The bot suggested keeping Saka, captaining Salah and finding a cheap defender to free up budget."
+)
+MESSAGES = [
+    "should I keep Saka for the next gameweek?",
+    "what about Salah as captain?",
+    "is Haaland worth the price?",
+    "who is a good cheap defender?",
+    "do you think Arsenal will keep a clean sheet?",
+]
+
+
+class PromptTokens(BaseCallbackHandler):
+    """Count the tokens of each prompt sent to a chat model."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.prompts.append(count_tokens(messages[0]))
+
+
+def old_chitchat(llm):
+    """The chit chat chain with the chat history also written in its system prompt, as before."""
+    chain = Chitchat(llm=llm)
+    prompt_template = PromptTemplate(
+        system_template=chain.prompt.messages[0].prompt.template + "\n    Chat History:\n    {chat_history}\n",
+        human_template="Customer Query: {customer_input}",
+    )
+    chain.chain = generate_prompt_templates(prompt_template, memory=True) | llm | chain.output_parser
+    return chain
+
+
+def run_conversation(db_path, turns, chain_builder, compactor=None):
+    """Send the messages of a conversation, returning the prompt tokens of each turn."""
+    counter = PromptTokens()
+    llm = make_stub_llm([ANSWER]).with_config(callbacks=[counter])
+    memory = MemoryManager(SQLiteHistoryBackend(db_path), compactor=compactor)
+    bot = MainChatbot(1, "history-tokens", resources=make_stub_resources(llm=llm, memory=memory))
+    bot.user_login(1, f"history-tokens-{compactor is not None}")
+    chain = bot.add_memory_to_runnable(chain_builder(llm))
+    for turn in range(turns):
+        chain.invoke({"customer_input": MESSAGES[turn % len(MESSAGES)]}, config=bot.memory_config)
+        if compactor is not None:
+            # The summary is written in the background while the user reads the reply
+            compactor.wait()
+    return counter.prompts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=40, help="Messages sent in the conversation.")
+    parser.add_argument("--max-tokens", type=int, default=1000, help="Token budget of the turns kept word for word.")
+    parser.add_argument("--max-turns", type=int, default=6, help="Most turns kept word for word.")
+    parser.add_argument("--fold-turns", type=int, default=2, help="Turns out of the window it takes to write the summary again.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+
+        before = run_conversation(db_path, args.turns, old_chitchat)
+        summaries = PromptTokens()
+        compactor = HistoryCompactor(
+            make_stub_llm([SUMMARY]).with_config(callbacks=[summaries]),
+            max_tokens=args.max_tokens,
+            max_turns=args.max_turns,
+            fold_turns=args.fold_turns,
+        )
+        after = run_conversation(db_path, args.turns, lambda llm: Chitchat(llm=llm), compactor)
+        get_pool(db_path).close()
+
+    print(f"tokens counted with {'tiktoken' if _encoding() else 'an estimate of 4 characters a token'}")
+    print(f"window of at most {args.max_turns} turns and {args.max_tokens} tokens, summary written every {args.fold_turns} turns")
+    print(f"{'turn':>5}{'before':>9}{'after':>8}")
+    shown = sorted({1, 2, 5, 10, 20, 30, args.turns} & set(range(1, args.turns + 1)))
+    for turn in shown:
+        print(f"{turn:>5}{before[turn - 1]:>9}{after[turn - 1]:>8}")
+    print(f"total prompt tokens: before {sum(before)}, after {sum(after)} + {sum(summaries.prompts)} "
+          f"in {len(summaries.prompts)} summaries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Time the incremental ingestion of the documents of the RAG chains against embedding the
+whole corpus again, as `data/Pinecone.ipynb` did: a first run, a rerun with nothing
+changed, a new document, an edited document and a removed one. The incremental index
+starts as `data/Pinecone.ipynb` left Pinecone, filled with the ids "0" to "N" and without
+a manifest.
+
+The documents are made up text files about the fantasy rules, split like the PDFs, and
+are embedded by a hashing stand-in for the MiniLM encoder taking `--encode-ms` per chunk.
+After every step the index is checked against one built from scratch. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.ingest_benchmark --documents 30 --encode-ms 5
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.stubs import HashingEncoder
+from chatbot.document_index import EncoderEmbeddings, LocalVectorStore, ingest_documents, split_pages
+
+SUBJECTS = ["a goalkeeper", "a defender", "a midfielder", "a forward", "the captain", "the vice captain", "a substitute"]
+ACTIONS = [
+    "scores a goal", "gets an assist", "keeps a clean sheet", "saves a penalty", "misses a penalty",
+    "gets a yellow card", "gets a red card", "scores an own goal", "plays 60 minutes", "makes three saves",
+]
+
+
+class CountingEncoder(HashingEncoder):
+    """Hashing encoder that counts the texts it embeds and takes a fixed time for each one."""
+
+    def __init__(self, seconds_per_text):
+        super().__init__()
+        self.seconds_per_text = seconds_per_text
+        self.texts = 0
+
+    def __call__(self, texts):
+        self.texts += len(texts)
+        time.sleep(self.seconds_per_text * len(texts))
+        return super().__call__(texts)
+
+
+def write_document(path, rng, paragraphs=40):
+    """Write a made up document of the rules, one paragraph a line."""
+    lines = [
+        " ".join(
+            f"When {rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} he earns {rng.randint(1, 6)} points."
+            for _ in range(rng.randint(3, 6))
+        )
+        for _ in range(paragraphs)
+    ]
+    with open(path, "w") as file:
+        file.write("\n".join(lines))
+
+
+def load_text_chunks(path):
+    """Read a text document and split it like the pages of a PDF."""
+    with open(path, "r") as file:
+        return split_pages([Document(page_content=file.read(), metadata={"source": path, "page": 0})])
+
+
+def ingest(folder, encoder, name, full=False):
+    """Ingest the documents of a folder into the index called `name`, returning the store, report and seconds."""
+    paths = sorted(os.path.join(folder, "docs", file) for file in os.listdir(os.path.join(folder, "docs")))
+    index_path, metadata_path = (os.path.join(folder, f"{name}{extension}") for extension in (".npy", ".json"))
+    embeddings = EncoderEmbeddings(encoder)
+    start = time.perf_counter()
+    store = None if full else LocalVectorStore.load(embeddings, index_path, metadata_path)
+    if store is None:
+        store, full = LocalVectorStore.empty(embeddings), True
+    report = ingest_documents(
+        store,
+        "hashing",
+        paths,
+        manifest_path=os.path.join(folder, f"{name}_manifest.json"),
+        load_chunks=load_text_chunks,
+        save=lambda: store.save(index_path, metadata_path),
+        force=full,
+        count=lambda: len(store.ids),
+    )
+    return store, report, time.perf_counter() - start
+
+
+def check(store, rebuilt):
+    """Check that an index holds the same chunks and embeddings as one built from scratch."""
+    assert sorted(store.ids) == sorted(rebuilt.ids), "the chunks differ from a rebuild"
+    rows = {chunk_id: row for row, chunk_id in enumerate(rebuilt.ids)}
+    order = [rows[chunk_id] for chunk_id in store.ids]
+    assert np.allclose(np.asarray(store.matrix), np.asarray(rebuilt.matrix)[order]), "the embeddings differ from a rebuild"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=30, help="Documents in the corpus.")
+    parser.add_argument("--encode-ms", type=float, default=5, help="Time the encoder takes per chunk.")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as folder:
+        docs = os.path.join(folder, "docs")
+        os.makedirs(docs)
+        for number in range(args.documents):
+            write_document(os.path.join(docs, f"rules_{number:03}.txt"), rng)
+
+        # Uploaded like the notebook did, with the position of each chunk as its id
+        notebook_chunks = [
+            chunk for file in sorted(os.listdir(docs)) for chunk in load_text_chunks(os.path.join(docs, file))
+        ]
+        LocalVectorStore.from_texts(
+            [chunk.page_content for chunk in notebook_chunks],
+            EncoderEmbeddings(HashingEncoder()),
+            ids=[str(number) for number in range(len(notebook_chunks))],
+        ).save(os.path.join(folder, "incremental.npy"), os.path.join(folder, "incremental.json"))
+
+        def edit():
+            path = os.path.join(docs, "rules_005.txt")
+            with open(path, "r") as file:
+                lines = file.read().split("\n")
+            lines[len(lines) // 2] = "A player sent off for a second yellow card loses 3 points."
+            with open(path, "w") as file:
+                file.write("\n".join(lines))
+
+        steps = [
+            ("first run, notebook ids", lambda: None),
+            ("rerun, nothing changed", lambda: None),
+            ("new document", lambda: write_document(os.path.join(docs, "rules_new.txt"), rng)),
+            ("edited paragraph", edit),
+            ("removed document", lambda: os.remove(os.path.join(docs, "rules_010.txt"))),
+        ]
+        print(f"{args.documents} documents, encoder taking {args.encode_ms:.0f} ms per chunk")
+        print(f"{'step':<24}{'incremental s':>14}{'embedded':>10}{'deleted':>9}{'rebuild s':>11}{'embedded':>10}")
+        for label, change in steps:
+            change()
+            encoder = CountingEncoder(args.encode_ms / 1000)
+            store, report, seconds = ingest(folder, encoder, "incremental")
+            rebuild_encoder = CountingEncoder(args.encode_ms / 1000)
+            rebuilt, _, rebuild_seconds = ingest(folder, rebuild_encoder, "rebuild", full=True)
+            check(store, rebuilt)
+            assert encoder.texts == report.added
+            assert not any(chunk_id.isdigit() for chunk_id in store.ids), "the ids of the notebook were kept"
+            print(f"{label:<24}{seconds:>14.2f}{report.added:>10}{report.deleted:>9}"
+                  f"{rebuild_seconds:>11.2f}{rebuild_encoder.texts:>10}")
+
+
+if __name__ == "__main__":
+    main()
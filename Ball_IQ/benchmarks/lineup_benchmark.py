@@ -0,0 +1,95 @@
+"""
+Time the lineup optimizer on the real squads and on simulated full squads, and check its
+lineups against a brute force search over every possible eleven.
+
+Run from the `Ball_IQ` folder:
+    python -m benchmarks.lineup_benchmark --squads 100000
+"""
+
+import argparse
+import itertools
+import random
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+
+from data.lineup_optimizer import FORMATIONS, SquadPlayer, load_squads, optimize_all_lineups, optimize_lineup
+from data.loader import get_sqlite_database_path
+
+# Players of each position in a full fantasy squad
+SQUAD_SHAPE = {"Goalkeeper": 2, "Defender": 5, "Midfielder": 5, "Forward": 3}
+
+
+def simulate_squads(count, seed=0):
+    """
+    Draw random full squads of 15 players from players_fantasy.
+
+    Args:
+        count (int): Number of squads.
+        seed (int): Seed of the draw.
+
+    Returns:
+        dict: Squads by simulated user id.
+    """
+    with closing(sqlite3.connect(get_sqlite_database_path())) as db:
+        rows = db.execute(
+            "SELECT player_id, name, team, position, expected_points_next_game FROM players_fantasy"
+        ).fetchall()
+    by_position = {position: [SquadPlayer(*row) for row in rows if row[3] == position] for position in SQUAD_SHAPE}
+
+    rng = random.Random(seed)
+    return {
+        user_id: [
+            player
+            for position, size in SQUAD_SHAPE.items()
+            for player in rng.sample(by_position[position], size)
+        ]
+        for user_id in range(count)
+    }
+
+
+def brute_force_points(squad):
+    """Most expected points of any valid eleven, trying every subset of the squad."""
+    valid = {(1, *formation) for formation in FORMATIONS}
+    best = 0.0
+    for eleven in itertools.combinations(squad, 11):
+        counts = tuple(sum(player.position == position for player in eleven) for position in SQUAD_SHAPE)
+        if counts in valid:
+            best = max(best, sum(player.expected_points for player in eleven))
+    return round(best, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--squads", type=int, default=100000, help="Simulated squads in the batch run.")
+    parser.add_argument("--check", type=int, default=200, help="Simulated squads checked by brute force.")
+    args = parser.parse_args()
+
+    real = load_squads()
+    durations = []
+    for squad in real.values():
+        for _ in range(100):
+            start = time.perf_counter()
+            optimize_lineup(squad)
+            durations.append((time.perf_counter() - start) * 1e6)
+    print(f"real squads ({len(real)}): median {statistics.median(durations):.1f} us per squad")
+
+    simulated = simulate_squads(args.squads)
+    start = time.perf_counter()
+    lineups = optimize_all_lineups(simulated)
+    elapsed = time.perf_counter() - start
+    print(
+        f"batch of {len(lineups)} simulated squads: {elapsed:.2f} s, "
+        f"{elapsed / len(lineups) * 1e6:.1f} us per squad"
+    )
+
+    mismatches = sum(
+        lineups[user_id].total_points != brute_force_points(simulated[user_id])
+        for user_id in list(simulated)[: args.check]
+    )
+    print(f"brute force check: {mismatches} of {min(args.check, len(simulated))} lineups not optimal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Count the extraction calls to the model that the local parser of starting eleven commands
+avoids, and time the parser.
+
+Uses the putting_players_in_starting11 messages of `chatbot/router/synthetic_intetions.json`
+three ways: as written, whose names are mostly of players outside the user's squad; with
+each name replaced by the short name of a player of the squad; and as multi-player commands
+built from the squad. Only the parsing runs, nothing is written. Run from the `Ball_IQ`
+folder:
+    python -m benchmarks.lineup_commands_benchmark --user-id 11
+"""
+
+import argparse
+import re
+import statistics
+import time
+
+from benchmarks.stubs import make_stub_llm
+from chatbot.chains.PuttingPlayerInStarting11Chain import PlayerInStarting11ChainExecutor
+from chatbot.router.evaluate_fast_path import SYNTHETIC_PATH, read_messages
+from data.snapshot import PlayerDataSnapshot
+from data.squad_summary import get_summary
+
+# A capitalized word after the first one, the name in the synthetic messages
+NAME_PATTERN = re.compile(r"(?<=\s)(?!I\b)[A-Z][\w'-]+")
+MULTI_PLAYER_TEMPLATES = [
+    "start {0} and {1}, bench {2}",
+    "bench {0} for {1}",
+    "put {0}, {1} and {2} in my starting eleven",
+    "swap {0} and {1}",
+    "make {0} captain",
+    "drop {0} then start {1} and make {1} captain",
+    "{0} in for {1}",
+    "take out {0} and {1} from my lineup",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user-id", type=int, default=11, help="User whose squad the names are matched against.")
+    args = parser.parse_args()
+
+    snapshot = PlayerDataSnapshot()
+    chain = PlayerInStarting11ChainExecutor(llm=make_stub_llm(), user_id=args.user_id, snapshot=snapshot)
+    squad = [snapshot.player_index.players[player_id]["web_name"] for player_id in get_summary(args.user_id).squad]
+    written = [text for text, intention in read_messages(SYNTHETIC_PATH) if intention == "putting_players_in_starting11"]
+
+    counter = iter(range(10 ** 6))
+    renamed = [NAME_PATTERN.sub(lambda match: squad[next(counter) % len(squad)], text) for text in written]
+    multi = [
+        template.format(*(squad[(number * 3 + offset) % len(squad)] for offset in range(3)))
+        for number in range(len(squad))
+        for template in MULTI_PLAYER_TEMPLATES
+    ]
+
+    snapshot.player_index  # Built outside of the measurements
+    print(f"user {args.user_id}, squad of {len(squad)}")
+    print(f"{'messages':<22}{'count':>7}{'parsed locally':>16}{'model calls avoided':>21}{'parse ms p50':>14}")
+    for label, texts in (("as written", written), ("squad names", renamed), ("multi-player", multi)):
+        local, times = 0, []
+        for text in texts:
+            start = time.perf_counter()
+            commands = chain.parse_locally(text)
+            times.append((time.perf_counter() - start) * 1000)
+            local += commands is not None
+        print(f"{label:<22}{len(texts):>7}{local:>16}{local / len(texts):>20.0%}{statistics.median(times):>14.2f}")
+    print("Each message parsed locally skips the extraction call and the squad list in its prompt.")
+
+
+if __name__ == "__main__":
+    main()
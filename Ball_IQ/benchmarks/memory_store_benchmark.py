@@ -0,0 +1,93 @@
+"""
+Measure the memory held by the session histories as sessions pile up, with the old dict of
+in-memory histories and with the MemoryManager backed by SQLite, and time its reads and
+writes.
+
+Runs on a copy of `balliq.db` in a temporary folder. Each session has `--turns` exchanges
+of a message and a reply, added as RunnableWithMessageHistory adds them. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.memory_store_benchmark --sessions 10000 --turns 3
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chatbot.memory import InMemoryHistory, MemoryManager, SQLiteHistoryBackend
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+
+REPLY = "Salah has the best fixtures of the next three gameweeks, he is worth the captaincy this week. " * 2
+
+
+def fill(get_history, sessions, turns, checkpoints):
+    """Add the turns of every session, returning the memory traced at each checkpoint in MiB."""
+    traced = {}
+    for session in range(sessions):
+        for turn in range(turns):
+            get_history(session % 11 + 1, f"conversation-{session}").add_messages(
+                [HumanMessage(content=f"who should I captain in gameweek {turn}?"), AIMessage(content=REPLY)]
+            )
+        if session + 1 in checkpoints:
+            traced[session + 1] = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    return traced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=10000, help="Sessions created.")
+    parser.add_argument("--turns", type=int, default=3, help="Message and reply pairs per session.")
+    parser.add_argument("--max-sessions", type=int, default=1024, help="Sessions the MemoryManager keeps in memory.")
+    args = parser.parse_args()
+    checkpoints = sorted({args.sessions // 10, args.sessions // 2, args.sessions})
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        get_pool(db_path)
+
+        store = {}
+        tracemalloc.start()
+        old = fill(lambda user, conversation: store.setdefault((user, conversation), InMemoryHistory()), args.sessions, args.turns, checkpoints)
+        tracemalloc.stop()
+        store.clear()
+
+        memory = MemoryManager(SQLiteHistoryBackend(db_path), max_sessions=args.max_sessions)
+        tracemalloc.start()
+        start = time.perf_counter()
+        new = fill(memory.get_session_history, args.sessions, args.turns, checkpoints)
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+
+        print(f"{args.turns} turns per session, at most {args.max_sessions} sessions in memory")
+        print(f"{'sessions':>9}{'dict MiB':>11}{'bounded MiB':>14}")
+        for checkpoint in checkpoints:
+            print(f"{checkpoint:>9}{old[checkpoint]:>11.1f}{new[checkpoint]:>14.1f}")
+
+        messages = args.sessions * args.turns * 2
+        print(f"messages appended: {messages} at {elapsed / messages * 1e6:.0f} µs each, {len(memory.store)} sessions in memory")
+
+        # The first session was dropped from memory long ago and comes back from SQLite
+        start = time.perf_counter()
+        history = memory.get_session_history(1, "conversation-0")
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        memory.get_session_history(1, "conversation-0")
+        hot = time.perf_counter() - start
+        print(f"evicted session read back in {cold * 1e6:.0f} µs, then {hot * 1e6:.1f} µs from memory")
+
+        stored = get_pool(db_path).fetch_one("SELECT COUNT(*) FROM chat_messages")[0]
+        ok = len(history.messages) == args.turns * 2 and stored == messages
+        print(f"rows stored: {stored}, messages of the evicted session: {len(history.messages)}, {'ok' if ok else 'MISMATCH'}")
+        get_pool(db_path).close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure the player context the chains put in their prompts, with the whole tables as
+before and with only the candidates of the player name index.
+
+Uses the messages of `chatbot/router/synthetic_intetions.json` for the intents whose
+chains resolve player names. Run from the `Ball_IQ` folder:
+    python -m benchmarks.name_index_benchmark
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.stubs import make_stub_llm
+from benchmarks.tokens import count_tokens
+from chatbot.chains.CheckUpcomingFixturesChain import CheckUpcomingFixtures
+from chatbot.chains.TransferPlayerChain import TransferPlayerChain
+from chatbot.chains.ViewPlayerStatsandPriceChange import ViewPlayerStats
+from chatbot.router.evaluate_fast_path import SYNTHETIC_PATH, read_messages
+from data.snapshot import PlayerDataSnapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user-id", type=int, default=1, help="User of the transfer chain.")
+    args = parser.parse_args()
+
+    snapshot = PlayerDataSnapshot()
+    llm = make_stub_llm()
+    transfer = TransferPlayerChain(llm=llm, user_id=args.user_id, snapshot=snapshot)
+    fixtures = CheckUpcomingFixtures(llm=llm, snapshot=snapshot)
+    stats = ViewPlayerStats(llm=llm, snapshot=snapshot)
+
+    # Context each chain sent before the index, and how it gets it now
+    chains = {
+        "transfer_players": (
+            str(snapshot.names),
+            lambda text: str(transfer.get_candidates(text)),
+        ),
+        "check_upcoming_fixtures": (
+            str(snapshot.names_and_teams) + str(snapshot.fixtures),
+            lambda text: "".join(map(str, fixtures.get_candidates(text))),
+        ),
+        "view_players_stats": (
+            str(snapshot.stats),
+            lambda text: str(stats.get_candidates(text)),
+        ),
+    }
+
+    snapshot.player_index  # Build the index outside of the measurements
+    messages = read_messages(SYNTHETIC_PATH)
+    print(f"{'intent':<26}{'messages':>9}{'full':>9}{'index':>9}{'ratio':>8}{'no match':>10}")
+    latencies = []
+    for intent, (full_context, get_context) in chains.items():
+        texts = [text for text, intention in messages if intention == intent]
+        full_tokens = count_tokens(full_context)
+        sizes, fallbacks = [], 0
+        for text in texts:
+            start = time.perf_counter()
+            matches = snapshot.player_index.search(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+            context = get_context(text)
+            fallbacks += context == full_context or not matches
+            sizes.append(count_tokens(context))
+        mean = statistics.mean(sizes)
+        print(
+            f"{intent:<26}{len(texts):>9}{full_tokens:>9}{mean:>9.0f}"
+            f"{full_tokens / mean:>7.0f}x{fallbacks:>10}"
+        )
+
+    latencies.sort()
+    print(
+        f"\nname lookup: median {statistics.median(latencies):.3f} ms, "
+        f"p99 {latencies[int(0.99 * (len(latencies) - 1))]:.3f} ms"
+    )
+    print("Token counts are mean prompt tokens of the player context of each message.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Fail when a query run on every request does a full table scan.
+
+The statements of the transfer engine, the name lookups and the candidate query are
+captured while running them on a migrated copy of `balliq.db`; the inline queries of the
+chains and tools are listed below. Each one is checked with EXPLAIN QUERY PLAN.
+
+Run from the `Ball_IQ` folder, the exit code is 1 when a scan is found:
+    python -m benchmarks.query_plan_check --verbose
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import closing
+
+from chatbot.chains.recommend_filter import extract_constraints, query_candidates
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.squad_summary import SUMMARY_COLUMNS
+from data.transfers import Transfer, TransferError, execute_transfers, resolve_player_ids
+
+# Queries written inline in the chains and tools, with example parameters
+INLINE_QUERIES = {
+    "squad of a user": (
+        """SELECT p.name, p.team, p.position, p.expected_points_next_game
+        FROM players_fantasy p
+        JOIN user_team ut ON p.player_id = ut.player_id
+        WHERE ut.user_id = ? AND ut.on_team = 1
+        ORDER BY p.expected_points_next_game DESC""",
+        (1,),
+    ),
+    "squad ids": ("SELECT player_id FROM user_team WHERE user_id = ? AND on_team = 1", (1,)),
+    "budget": ("SELECT budget FROM users WHERE user_id = ?", (1,)),
+    "points": ("SELECT points FROM users WHERE user_id = ?", (1,)),
+    "update points": ("UPDATE users SET points = ? WHERE user_id = ?", (3, 1)),
+    "starting eleven row": (
+        "SELECT on_team, starting_eleven FROM user_team WHERE user_id = ? AND player_id = ?",
+        (1, 32),
+    ),
+    "starting eleven size": ("SELECT COUNT(*) FROM user_team WHERE user_id = ? AND starting_eleven = 1", (1,)),
+    "squad summary": (f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM user_squad_summary WHERE user_id = ?", (1,)),
+    "squad from summary": (
+        """SELECT p.name FROM user_squad_summary s, json_each(s.squad) j
+        JOIN players_fantasy p ON p.player_id = j.value
+        WHERE s.user_id = ?""",
+        (1,),
+    ),
+    "conversation messages": (
+        """SELECT role, content FROM chat_messages
+        WHERE user_id = ? AND conversation_id = ? ORDER BY message_id""",
+        ("11", "1"),
+    ),
+    "clear conversation": ("DELETE FROM chat_messages WHERE user_id = ? AND conversation_id = ?", ("11", "1")),
+    "player data version": ("SELECT version FROM data_versions WHERE name = 'player_data'", ()),
+    "conversation summary": (
+        "SELECT covered_messages, summary FROM chat_summaries WHERE user_id = ? AND conversation_id = ?",
+        ("11", "1"),
+    ),
+    "user by email": ("SELECT user_id FROM users WHERE email = :email", {"email": "a@b.c"}),
+    "login": (
+        "SELECT user_id FROM users WHERE email = :email AND password = :password",
+        {"email": "a@b.c", "password": "x"},
+    ),
+}
+
+
+def scans(db, query, parameters=()):
+    """
+    Find the full table scans in the plan of a query.
+
+    Returns:
+        list: The plan lines that scan a table.
+    """
+    plan = db.execute(f"EXPLAIN QUERY PLAN {query}", parameters).fetchall()
+    # Every line of the plan is (id, parent, notused, detail). Walking a JSON array with json_each is a
+    # scan of a virtual table, not of a table of the database.
+    return [
+        detail for *_, detail in plan
+        if detail.startswith("SCAN") and detail != "SCAN CONSTANT ROW" and "VIRTUAL TABLE" not in detail
+    ]
+
+
+def capture_statements(db_path):
+    """
+    Run the engine, the name lookups and the candidate query, and record their statements.
+
+    Returns:
+        list: (label, statement) of every statement run, with the values inlined.
+    """
+    pool = get_pool(db_path)
+    statements = []
+    label = "squad ids"
+
+    def record(statement):
+        keyword = statement.split(None, 1)[0].upper()
+        if keyword not in {"BEGIN", "COMMIT", "ROLLBACK", "PRAGMA"}:
+            statements.append((label, statement))
+
+    # The pool lends the same connection back to the same thread, so the trace stays on
+    with pool.connection() as db:
+        db.set_trace_callback(record)
+    squad = [row[0] for row in pool.fetch_all("SELECT player_id FROM user_team WHERE user_id = 1 AND on_team = 1")]
+
+    label = "name lookup"
+    resolve_player_ids(["Mohamed Salah", "martin odegaard"], db_path)
+    label = "transfer"
+    execute_transfers(1, [Transfer(squad[0], 328)], db_path)
+    label = "refused transfer"
+    try:
+        execute_transfers(1, [Transfer(squad[0], 351)], db_path)
+    except TransferError:
+        pass
+    label = "candidates"
+    query_candidates(1, extract_constraints("two defenders under 12m, no Salah"), db_path)
+
+    with pool.connection() as db:
+        db.set_trace_callback(None)
+    return statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of every query.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        checks = [(label, statement, ()) for label, statement in capture_statements(db_path)]
+        checks += [(label, query, parameters) for label, (query, parameters) in INLINE_QUERIES.items()]
+
+        failures = 0
+        with closing(sqlite3.connect(db_path)) as db:
+            for label, query, parameters in checks:
+                found = scans(db, query, parameters)
+                failures += bool(found)
+                if found or args.verbose:
+                    status = "SCAN" if found else "ok"
+                    print(f"{status:<5}{label:<22}{' '.join(query.split())[:100]}")
+                    for detail in found:
+                        print(f"{'':<27}{detail}")
+        get_pool(db_path).close()
+
+    print(f"{len(checks)} queries checked, {failures} with a full table scan")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
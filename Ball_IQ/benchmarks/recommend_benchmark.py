@@ -0,0 +1,67 @@
+"""
+Compare the RecommendPlayers prompt with every player in it, as before, with the short
+candidate list of the constraint pre-filter.
+
+Uses the recommend_players messages of `chatbot/router/synthetic_intetions.json` and a stub
+language model, so only the prompt building and the local work are timed. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.recommend_benchmark
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.stubs import make_stub_llm
+from benchmarks.tokens import count_tokens
+from chatbot.chains.RecommendPlayersChain import RecommendPlayers
+from chatbot.router.evaluate_fast_path import SYNTHETIC_PATH, read_messages
+from data.snapshot import PlayerDataSnapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user-id", type=int, default=1, help="User asking for recommendations.")
+    args = parser.parse_args()
+
+    snapshot = PlayerDataSnapshot()
+    chain = RecommendPlayers(llm=make_stub_llm(), user_id=args.user_id, memory=False, snapshot=snapshot)
+    texts = [text for text, intention in read_messages(SYNTHETIC_PATH) if intention == "recommend_players"]
+
+    def full_table(text):
+        # The whole market, as the chain sent it before the pre-filter
+        return {"all_players": snapshot.market, "constraints": "none extracted", "recommendation": "none"}
+
+    def pre_filter(text):
+        constraints, candidates = chain.get_candidates(text)
+        return {
+            "all_players": candidates,
+            "constraints": constraints.describe(),
+            "recommendation": chain.get_recommendation(text, constraints),
+        }
+
+    snapshot.player_index  # Build the index outside of the measurements
+    print(f"{len(texts)} messages, user {args.user_id}")
+    print(f"{'context':<14}{'prompt tokens':>15}{'rows':>8}{'prepare ms':>12}{'invoke ms':>12}")
+    for label, build in (("full table", full_table), ("pre-filter", pre_filter)):
+        tokens, rows, prepare, invoke = [], [], [], []
+        for text in texts:
+            start = time.perf_counter()
+            inputs = {"customer_input": text, "chat_history": [], "names_list": chain.get_team(), **build(text)}
+            prepare.append((time.perf_counter() - start) * 1000)
+
+            tokens.append(count_tokens(chain.prompt.format(**inputs)))
+            rows.append(len(inputs["all_players"]))
+
+            start = time.perf_counter()
+            chain.chain.invoke(inputs)
+            invoke.append((time.perf_counter() - start) * 1000)
+        print(
+            f"{label:<14}{statistics.mean(tokens):>15.0f}{statistics.mean(rows):>8.0f}"
+            f"{statistics.median(prepare):>12.3f}{statistics.median(invoke):>12.3f}"
+        )
+    print("Tokens and rows are means per message, times are medians; invoke uses the stub model.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare building a MainChatbot from scratch, as every Streamlit rerun used to do, with
+fetching the one already built by the ChatbotRegistry.
+
+Run from the `Ball_IQ` folder:
+    python -m benchmarks.registry_benchmark --runs 20
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.stubs import make_stub_resources
+from chatbot.bot import MainChatbot
+from chatbot.registry import ChatbotRegistry
+from chatbot.router.loader import load_intention_classifier
+
+
+def time_calls(function, runs):
+    """
+    Time a function several times.
+
+    Args:
+        function: Callable without arguments.
+        runs (int): Number of calls.
+
+    Returns:
+        list: Duration of each call in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label, durations):
+    """Print the median and worst duration of a set of calls."""
+    print(
+        f"{label:<28} median {statistics.median(durations):10.3f} ms"
+        f"   max {max(durations):10.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20, help="Calls per measurement.")
+    parser.add_argument("--users", type=int, default=10, help="Distinct users in the warm run.")
+    parser.add_argument(
+        "--router",
+        action="store_true",
+        help="Load the real RouteLayer on every cold build (needs the HuggingFace encoder).",
+    )
+    args = parser.parse_args()
+
+    def build_resources():
+        classifier = load_intention_classifier() if args.router else None
+        return make_stub_resources(intention_classifier=classifier)
+
+    def build_cold():
+        bot = MainChatbot(11, 1, resources=build_resources())
+        bot.user_login(11, 1)
+        bot.chain_map.build_all()
+
+    # Cold: everything is rebuilt, including the player snapshot, the router and every chain
+    cold = time_calls(build_cold, args.runs)
+
+    # Warm: the registry already holds a bot for every user
+    registry = ChatbotRegistry(resources=build_resources())
+    for user_id in range(args.users):
+        registry.get_chatbot(user_id, 1)
+    user_ids = iter(range(args.runs * args.users))
+    warm = time_calls(
+        lambda: registry.get_chatbot(next(user_ids) % args.users, 1), args.runs * args.users
+    )
+
+    report("cold construction", cold)
+    report("warm registry lookup", warm)
+    print(f"speed-up (median)            x{statistics.median(cold) / statistics.median(warm):,.0f}")
+
+
+if __name__ == "__main__":
+    main()
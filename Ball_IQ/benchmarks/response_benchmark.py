@@ -0,0 +1,64 @@
+"""
+Time the replies of the starting eleven chain written from templates against the replies
+rephrased by the model.
+
+The model is a stub that waits `--model-ms` before answering, as a stand-in for the
+round-trip to OpenAI. The messages bench and start again the players of the user's
+starting eleven, each one followed by the one that undoes it, so the lineup ends as it
+started. Run from the `Ball_IQ` folder:
+    python -m benchmarks.response_benchmark --user-id 11 --model-ms 1500
+"""
+
+import argparse
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from chatbot.chains.PuttingPlayerInStarting11Chain import PlayerInStarting11ChainFinal
+from data.snapshot import PlayerDataSnapshot
+from data.squad_summary import get_summary
+
+
+class SlowModel:
+    """Stand-in for the chat model that takes a fixed time to answer and counts its calls."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+
+    def answer(self, prompt):
+        self.calls += 1
+        time.sleep(self.seconds)
+        return AIMessage(content="Here is what changed in your starting eleven.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--user-id", type=int, default=11, help="User whose starting eleven is edited.")
+    parser.add_argument("--model-ms", type=float, default=1500, help="Time the stub model takes to answer.")
+    parser.add_argument("--rounds", type=int, default=5, help="Players benched and started again.")
+    args = parser.parse_args()
+
+    snapshot = PlayerDataSnapshot()
+    starters = get_summary(args.user_id).starting_eleven[: args.rounds]
+    names = [snapshot.player_index.players[player_id]["web_name"] for player_id in starters]
+    messages = [message for name in names for message in (f"bench {name}", f"start {name}")]
+
+    print(f"user {args.user_id}, {len(messages)} messages, model answering in {args.model_ms:.0f} ms")
+    print(f"{'replies':<22}{'model calls':>12}{'reply ms p50':>14}")
+    for label, rephrase in (("from templates", False), ("rephrased by model", True)):
+        model = SlowModel(args.model_ms / 1000)
+        chain = PlayerInStarting11ChainFinal(llm=RunnableLambda(model.answer), user_id=args.user_id, snapshot=snapshot, rephrase=rephrase)
+        times = []
+        for message in messages:
+            start = time.perf_counter()
+            reply = chain.invoke({"customer_input": message, "chat_history": []}, config=None)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"{label:<22}{model.calls:>12}{statistics.median(times):>14.1f}")
+        print(f"  last reply: {reply!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Measure the response cache on a day of questions about the stats, the company and the
+fixtures asked by many users in slightly different words, mixed with chit chat it bypasses.
+
+The model is a stub taking `--model-ms` to answer and the retriever one taking
+`--retriever-ms`, in place of the OpenAI embedding and the Pinecone query. Messages are
+embedded by a hashing stand-in for the MiniLM encoder. Runs on a copy of `balliq.db` in a
+temporary folder, whose prices are changed halfway through to check that the cached
+replies are dropped. Only the first message of a conversation can be answered from the
+cache, a share `--new-conversations` of the messages start one. Run from the `Ball_IQ`
+folder:
+    python -m benchmarks.response_cache_benchmark --messages 300 --model-ms 300
+"""
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+from benchmarks.stubs import HashingEncoder, StubRouteChoice, make_stub_llm, make_stub_resources
+from chatbot.bot import MainChatbot
+from chatbot.memory import MemoryManager, SQLiteHistoryBackend
+from chatbot.response_cache import STATELESS_INTENTS, ResponseCache
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.snapshot import PlayerDataSnapshot
+
+ANSWER = "Expected points estimate how many points a player should score in the next gameweek."
+# The same questions as different users write them, with the intent the stub router gives them
+QUESTIONS = {
+    "know_information_about_stats": [
+        ["What are expected points?", "what are expected points", "What are Expected Points??", "what are the expected points"],
+        ["How is the form rank calculated?", "how is form rank calculated", "How is the form rank calculated"],
+        ["What does points per game mean?", "what does points per game mean", "What do points per game mean?"],
+    ],
+    "chit_chat_about_company": [
+        ["What is Ball IQ?", "what is ball iq", "What is Ball IQ exactly?", "what's Ball IQ?"],
+        ["Who created Ball IQ?", "who created ball iq", "Who created BallIQ?"],
+    ],
+    "check_upcoming_fixtures": [
+        ["When does Liverpool play next?", "when does liverpool play next", "When do Liverpool play next?", "when does Liverpool play next?!"],
+        ["Who do Arsenal play next?", "who do arsenal play next", "Who does Arsenal play next?"],
+        ["When is the next Chelsea game?", "when is the next chelsea game", "When's the next Chelsea game?"],
+    ],
+    "chit_chat": [
+        ["hello there", "hi, how are you?", "thanks a lot", "good morning", "you are great"],
+    ],
+}
+USER_IDS = range(1, 12)
+
+
+class StubIntentService:
+    """Intent service stand-in routing the questions above, with the hashing encoder for `embed`."""
+
+    def __init__(self):
+        self.routes = {text: intent for intent, groups in QUESTIONS.items() for group in groups for text in group}
+        self.encoder = HashingEncoder()
+
+    def retrieve_multiple_routes(self, text):
+        return [StubRouteChoice(self.routes[text], 1.0)]
+
+    def embed(self, text):
+        vector = self.encoder([text])[0]
+        return vector / (np.linalg.norm(vector) or 1)
+
+
+class NoFastPath:
+    """Fast path router stand-in that leaves every message to the intent service."""
+
+    def classify(self, text):
+        return None
+
+
+class ModelCalls(BaseCallbackHandler):
+    """Count the calls to a chat model."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+
+
+def workload(messages, new_conversations, seed=7):
+    """The messages of the day, each picked at random with its user and conversation."""
+    rng = random.Random(seed)
+    questions = [(intent, group) for intent, groups in QUESTIONS.items() for group in groups]
+    conversations = {user_id: 0 for user_id in USER_IDS}
+    day = []
+    for _ in range(messages):
+        intent, group = rng.choice(questions)
+        user_id = USER_IDS[rng.randrange(len(USER_IDS))]
+        if rng.random() < new_conversations:
+            conversations[user_id] += 1
+        day.append((user_id, f"response-cache-{conversations[user_id]}", intent, rng.choice(group)))
+    return day
+
+
+def run(db_path, args, cache, label):
+    """Send the messages of the day, returning the latency of each one by intent and the calls made."""
+    model_calls, retriever_calls = ModelCalls(), []
+
+    def retrieve(query):
+        retriever_calls.append(query)
+        time.sleep(args.retriever_ms / 1000)
+        return []
+
+    llm = make_stub_llm([ANSWER], chars_per_second=len(ANSWER) / (args.model_ms / 1000)).with_config(callbacks=[model_calls])
+    snapshot = PlayerDataSnapshot(db_path, check_interval=0)
+    resources = make_stub_resources(
+        llm=llm,
+        retriever=RunnableLambda(retrieve),
+        snapshot=snapshot,
+        memory=MemoryManager(SQLiteHistoryBackend(db_path)),
+        intent_service=StubIntentService(),
+        fast_router=NoFastPath(),
+        response_cache=cache(snapshot),
+    )
+    bots = {}
+    latencies = {}
+    messages = workload(args.messages, args.new_conversations)
+    for number, (user_id, conversation_id, intent, text) in enumerate(messages):
+        if number == len(messages) // 2:
+            # A price change moves the player data version, every cached reply is dropped
+            get_pool(db_path).run(lambda db: db.execute("UPDATE players_fantasy SET price = price + 0.1 WHERE player_id = 1"))
+        bot = bots.get((user_id, conversation_id))
+        if bot is None:
+            # Each run has its own conversations, their history is in the same database
+            bot = bots[user_id, conversation_id] = MainChatbot(user_id, f"{label} {conversation_id}", resources=resources)
+            bot.user_login(user_id, f"{label} {conversation_id}")
+        start = time.perf_counter()
+        bot.process_user_input({"customer_input": text})
+        latencies.setdefault(intent, []).append(time.perf_counter() - start)
+    return latencies, model_calls.calls, len(retriever_calls), resources.response_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=300, help="Messages sent over the day.")
+    parser.add_argument("--model-ms", type=float, default=300, help="Time the stub model takes to answer.")
+    parser.add_argument("--new-conversations", type=float, default=0.6, help="Share of the messages starting a conversation.")
+    parser.add_argument("--retriever-ms", type=float, default=150, help="Time the stub retriever takes, for the embedding and the Pinecone query.")
+    # The paraphrases above score 0.77 to 0.93 with the hashing encoder and different questions at most 0.63
+    parser.add_argument("--threshold", type=float, default=0.75, help="Similarity threshold of the cache, for the hashing encoder.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        results = {}
+        for label, cache in (
+            ("no cache", lambda snapshot: ResponseCache(HashingEncoder(), lambda: snapshot.version, intents=())),
+            ("cache", lambda snapshot: ResponseCache(
+                StubIntentService().embed,
+                lambda: snapshot.version,
+                names=lambda text: snapshot.player_index.mentioned_names(text),
+                similarity_threshold=args.threshold,
+            )),
+        ):
+            results[label] = run(db_path, args, cache, label)
+        get_pool(db_path).close()
+
+    print(f"{args.messages} messages, model answering in {args.model_ms:.0f} ms, retriever in {args.retriever_ms:.0f} ms")
+    print(f"{'intent':<30}{'no cache ms':>12}{'cache ms':>10}{'hit rate':>10}")
+    metrics = results["cache"][3].metrics.as_dict()
+    for intent in QUESTIONS:
+        before = statistics.mean(results["no cache"][0][intent]) * 1000
+        after = statistics.mean(results["cache"][0][intent]) * 1000
+        hit_rate = metrics["intents"].get(intent, {}).get("hit_rate")
+        print(f"{intent:<30}{before:>12.0f}{after:>10.0f}{'bypassed' if hit_rate is None else f'{hit_rate:.0%}':>10}")
+    for label, (_, model_calls, retriever_calls, _) in results.items():
+        print(f"{label}: {model_calls} model calls, {retriever_calls} retriever calls")
+    print("cache metrics:", {
+        intent: {key: value for key, value in counts.items() if key != "hit_rate"}
+        for intent, counts in metrics["intents"].items()
+    })
+    assert set(metrics["intents"]) <= set(STATELESS_INTENTS)
+
+
+if __name__ == "__main__":
+    main()
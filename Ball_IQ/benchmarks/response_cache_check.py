@@ -0,0 +1,109 @@
+"""
+Check which messages the response cache answers with the reply of another one, with the
+MiniLM encoder of the router and the 0.92 threshold the chatbot uses.
+
+Paraphrases of the same question must hit, questions naming other teams or players and
+different questions must miss, and a message following earlier ones in its conversation
+must bypass the cache. The similarity of each pair is printed next to whether both name
+the same teams and players, to show the pairs the embedding alone would confuse. `--encoder hashing` runs the same
+cases with the hashing stand-in and its 0.75 threshold, without downloading MiniLM. The
+exit code is 1 when a case fails. Run from the `Ball_IQ` folder:
+    python -m benchmarks.response_cache_check
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks.stubs import HashingEncoder, StubIntentionClassifier, make_stub_resources
+from chatbot.bot import MainChatbot
+from chatbot.memory import MemoryManager, SQLiteHistoryBackend
+from chatbot.response_cache import ResponseCache
+from chatbot.router.route_index import load_encoder, read_layer
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.snapshot import PlayerDataSnapshot
+
+# Message cached first, message looked up after it, and whether it must be served the first one's reply
+PAIRS = [
+    ("check_upcoming_fixtures", "When does Liverpool play next?", "when do liverpool play next", True),
+    ("check_upcoming_fixtures", "When does Liverpool play next?", "When does Arsenal play next?", False),
+    ("check_upcoming_fixtures", "Who do Chelsea play next?", "Who do Man City play next?", False),
+    ("know_information_about_stats", "What are expected points?", "what are the expected points", True),
+    ("know_information_about_stats", "How many points does Salah get for a goal?", "How many points does Haaland get for a goal?", False),
+    ("know_information_about_stats", "What are expected points?", "What is the form rank?", False),
+    ("chit_chat_about_company", "What is Ball IQ?", "what's Ball IQ?", True),
+    ("chit_chat_about_company", "What is Ball IQ?", "Who created Ball IQ?", False),
+]
+THRESHOLDS = {"minilm": 0.92, "hashing": 0.75}
+
+
+def make_embed(name):
+    """Embed one message with unit norm, with the router's MiniLM or the hashing stand-in."""
+    encoder = HashingEncoder() if name == "hashing" else load_encoder(read_layer())
+
+    def embed(text):
+        vector = np.asarray(encoder([text])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    return embed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--encoder", choices=sorted(THRESHOLDS), default="minilm", help="Encoder embedding the messages.")
+    args = parser.parse_args()
+
+    embed = make_embed(args.encoder)
+    threshold = THRESHOLDS[args.encoder]
+    failures = 0
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        snapshot = PlayerDataSnapshot(db_path)
+        names = snapshot.player_index.mentioned_names
+
+        print(f"{args.encoder}, threshold {threshold}")
+        print(f"{'similarity':>10}  {'names':<16}{'expected':<10}{'served':<8}pair")
+        for intent, cached, asked, should_hit in PAIRS:
+            cache = ResponseCache(embed, lambda: None, names=names, similarity_threshold=threshold)
+            cache.store(cache.lookup(intent, cached), f"reply to {cached}")
+            served = cache.lookup(intent, asked).reply is not None
+            similarity = float(embed(cached) @ embed(asked))
+            same_names = names(cached) == names(asked)
+            failures += served != should_hit
+            print(
+                f"{similarity:>10.3f}  {'same' if same_names else 'different':<16}"
+                f"{'hit' if should_hit else 'miss':<10}{'hit' if served else 'miss':<8}"
+                f"{cached!r} -> {asked!r}{'' if served == should_hit else '  FAIL'}"
+            )
+
+        # The same question as the first message of a conversation, then after another one
+        cache = ResponseCache(embed, lambda: snapshot.version, names=names, similarity_threshold=threshold)
+        resources = make_stub_resources(
+            intent_service=StubIntentionClassifier("know_information_about_stats"),
+            snapshot=snapshot,
+            memory=MemoryManager(SQLiteHistoryBackend(db_path)),
+            response_cache=cache,
+        )
+        first = MainChatbot(1, "first", resources=resources)
+        first.user_login(1, "first")
+        first.process_user_input({"customer_input": "What are expected points?"})
+        follow_up = MainChatbot(2, "follow-up", resources=resources)
+        follow_up.user_login(2, "follow-up")
+        follow_up.process_user_input({"customer_input": "How is the form rank calculated?"})
+        metrics = cache.metrics.as_dict()["intents"]["know_information_about_stats"]
+        follow_up.process_user_input({"customer_input": "What are expected points?"})
+        bypassed = cache.metrics.as_dict()["intents"]["know_information_about_stats"] == metrics
+        failures += not bypassed
+        print(f"{'ok  ' if bypassed else 'FAIL'} a message after others in its conversation bypasses the cache")
+        get_pool(db_path).close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Time the local document index used by the RAG chains: loading it from its memory mapped
+file and answering questions through the LangChain retriever, with the k=2 and 0.5 score
+threshold of the Pinecone retriever.
+
+The chunks are made up sentences about the fantasy rules, embedded by a hashing stand-in
+for the MiniLM encoder, at several sizes of index. Every result is checked against a
+brute force search with NumPy. Run from the `Ball_IQ` folder:
+    python -m benchmarks.retriever_benchmark --sizes 100 1000 10000 --queries 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stubs import HashingEncoder
+from chatbot.chains.RAG import SEARCH_KWARGS
+from chatbot.document_index import EncoderEmbeddings, LocalVectorStore
+
+SUBJECTS = ["a goalkeeper", "a defender", "a midfielder", "a forward", "the captain", "the vice captain", "a substitute"]
+ACTIONS = [
+    "scores a goal", "gets an assist", "keeps a clean sheet", "saves a penalty", "misses a penalty",
+    "gets a yellow card", "gets a red card", "scores an own goal", "plays 60 minutes", "makes three saves",
+]
+OUTCOMES = ["earns {n} points", "loses {n} points", "gets {n} bonus points", "doubles the {n} points"]
+
+
+def make_chunks(count, seed=3):
+    """Made up chunks of the rules, a few sentences each."""
+    rng = random.Random(seed)
+    chunks = []
+    for _ in range(count):
+        sentences = [
+            f"When {rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} he {rng.choice(OUTCOMES).format(n=rng.randint(1, 6))}."
+            for _ in range(rng.randint(2, 5))
+        ]
+        chunks.append(" ".join(sentences))
+    return chunks
+
+
+def make_queries(count, seed=5):
+    """Questions about the rules, and some off topic ones."""
+    rng = random.Random(seed)
+    queries = [f"How many points when {rng.choice(SUBJECTS)} {rng.choice(ACTIONS)}?" for _ in range(count)]
+    # A relevance of 0.5 is a cosine similarity of 0, so off topic questions still find chunks, as with Pinecone
+    return queries + ["What is the weather like in Lisbon tomorrow?"] * (count // 10)
+
+
+def brute_force(matrix, query_vector, k, score_threshold):
+    """The chunks the retriever should return: the k closest whose relevance is at least the threshold."""
+    similarities = np.asarray(matrix) @ query_vector
+    order = np.argsort(-similarities, kind="stable")[:k]
+    return [int(index) for index in order if (similarities[index] + 1) / 2 >= score_threshold]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="Chunks in each index.")
+    parser.add_argument("--queries", type=int, default=200, help="Questions asked of each index.")
+    args = parser.parse_args()
+
+    encoder = HashingEncoder()
+    embeddings = EncoderEmbeddings(encoder)
+    queries = make_queries(args.queries)
+    # Embedded up front, as the intent service hands the retriever the embedding of the message it classified
+    query_vectors = {query: embeddings.embed_query(query) for query in set(queries)}
+    cached = EncoderEmbeddings(encoder, embed_query=query_vectors.__getitem__)
+
+    print(f"k={SEARCH_KWARGS['k']}, score threshold {SEARCH_KWARGS['score_threshold']}, {len(queries)} questions")
+    print(f"{'chunks':>8}{'build s':>9}{'load ms':>9}{'p50 ms':>8}{'p95 ms':>8}{'found':>7}")
+    with tempfile.TemporaryDirectory() as folder:
+        for size in args.sizes:
+            texts = make_chunks(size)
+            index_path = os.path.join(folder, f"documents_{size}.npy")
+            metadata_path = os.path.join(folder, f"documents_{size}.json")
+            start = time.perf_counter()
+            LocalVectorStore.from_texts(
+                texts, embeddings, metadatas=[{"chunk": number} for number in range(size)]
+            ).save(index_path, metadata_path)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            store = LocalVectorStore.load(cached, index_path, metadata_path)
+            load = time.perf_counter() - start
+            retriever = store.as_retriever(search_type="similarity_score_threshold", search_kwargs=SEARCH_KWARGS)
+
+            latencies, found = [], 0
+            for query in queries:
+                start = time.perf_counter()
+                documents = retriever.invoke(query)
+                latencies.append(time.perf_counter() - start)
+                expected = brute_force(
+                    store.matrix, np.asarray(query_vectors[query]), SEARCH_KWARGS["k"], SEARCH_KWARGS["score_threshold"]
+                )
+                got = [document.metadata["chunk"] for document in documents]
+                # Chunks with the same similarity may come back in either order, compare the similarities
+                similarities = np.asarray(store.matrix) @ np.asarray(query_vectors[query])
+                assert np.allclose(similarities[got], similarities[expected]), (query, got, expected)
+                found += bool(documents)
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+            print(f"{size:>8}{build:>9.2f}{load * 1000:>9.2f}{p50:>8.2f}{p95:>8.2f}{found / len(queries):>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare the local document index with the Pinecone index on the questions the RAG chains
+answer, to check the k=2 and 0.5 score threshold before switching `RETRIEVER_BACKEND` to
+"local".
+
+The questions are the messages of `synthetic_intetions.json` and `new_intentions.json`
+routed to the RAG chains. For each backend the two best chunks of every question are
+found without a threshold, and the report shows how their relevance scores spread, how
+many questions the threshold leaves without context, and how often both backends return
+the same chunks. Needs the local index built with `python -m chatbot.document_index`,
+MiniLM and the Pinecone and OpenAI keys. Run from the `Ball_IQ` folder:
+    python -m benchmarks.retriever_check --show 5
+"""
+
+import argparse
+
+import numpy as np
+
+from chatbot.chains.RAG import SEARCH_KWARGS, build_pinecone_store
+from chatbot.document_index import load_document_index
+from chatbot.router.evaluate_fast_path import NEW_PATH, SYNTHETIC_PATH, read_messages
+
+RAG_INTENTS = ("know_information_about_stats", "chit_chat_about_company")
+
+
+def best_chunks(store, questions, k):
+    """The `k` best chunks of each question and their relevance scores, without a threshold."""
+    return [store.similarity_search_with_relevance_scores(question, k=k) for question in questions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--show", type=int, default=0, help="Questions to print with the chunks of each backend.")
+    args = parser.parse_args()
+
+    questions = sorted({
+        text for text, intention in read_messages(SYNTHETIC_PATH) + read_messages(NEW_PATH) if intention in RAG_INTENTS
+    })
+    k, threshold = SEARCH_KWARGS["k"], SEARCH_KWARGS["score_threshold"]
+    results = {
+        "local": best_chunks(load_document_index(), questions, k),
+        "pinecone": best_chunks(build_pinecone_store(), questions, k),
+    }
+
+    print(f"{len(questions)} questions, k={k}, score threshold {threshold}")
+    print(f"{'backend':<10}{'p10':>7}{'p50':>7}{'p90':>7}{'without context':>17}")
+    for backend, found in results.items():
+        scores = np.array([score for chunks in found for _, score in chunks])
+        empty = sum(not any(score >= threshold for _, score in chunks) for chunks in found)
+        p10, p50, p90 = np.percentile(scores, [10, 50, 90]) if len(scores) else (0, 0, 0)
+        print(f"{backend:<10}{p10:>7.2f}{p50:>7.2f}{p90:>7.2f}{empty / len(questions):>17.0%}")
+
+    # The chunks are split the same way, so the same passage has the same text in both indexes
+    same = sum(
+        {document.page_content for document, _ in local} == {document.page_content for document, _ in pinecone}
+        for local, pinecone in zip(results["local"], results["pinecone"])
+    )
+    print(f"same chunks from both backends: {same / len(questions):.0%}")
+
+    for question, local, pinecone in list(zip(questions, results["local"], results["pinecone"]))[:args.show]:
+        print(f"\n{question}")
+        for backend, chunks in (("local", local), ("pinecone", pinecone)):
+            for document, score in chunks:
+                print(f"  {backend:<9}{score:.2f}  {document.page_content[:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Time the loading of the player snapshot, the cost of its version check on each read, and
+how quickly a write to the database shows up in it.
+
+The writes go to a copy of `balliq.db` in a temporary folder. Run from the `Ball_IQ` folder:
+    python -m benchmarks.snapshot_benchmark --reads 10000
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import closing
+
+from data.loader import get_sqlite_database_path
+from data.snapshot import PlayerDataSnapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--reads", type=int, default=10000, help="Reads of the tables timed.")
+    parser.add_argument("--writes", type=int, default=20, help="Price updates made to the copy.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+
+        start = time.perf_counter()
+        snapshot = PlayerDataSnapshot(db_path, check_interval=0)
+        tables = snapshot.tables
+        tables.player_index, tables.transfer_recommender
+        print(f"load with indexes: {(time.perf_counter() - start) * 1000:.1f} ms, {len(tables.names)} players")
+
+        for interval in (0, 1.0):
+            snapshot.check_interval = interval
+            start = time.perf_counter()
+            for _ in range(args.reads):
+                snapshot.tables
+            elapsed = (time.perf_counter() - start) / args.reads * 1e6
+            print(f"read with check interval {interval:g} s: {elapsed:.2f} us")
+
+        snapshot.check_interval = 0
+        refreshes = []
+        with closing(sqlite3.connect(db_path)) as db:
+            player_id, name = db.execute("SELECT player_id, name FROM players_fantasy LIMIT 1").fetchone()
+            for write in range(args.writes):
+                with db:
+                    db.execute("UPDATE players_fantasy SET price = price + 0.1 WHERE player_id = ?", (player_id,))
+                expected = db.execute("SELECT price FROM players_fantasy WHERE player_id = ?", (player_id,)).fetchone()[0]
+                start = time.perf_counter()
+                tables = snapshot.tables
+                refreshes.append((time.perf_counter() - start) * 1000)
+                price = tables.players["price"][tables.row_by_name[name]]
+                assert price == expected, f"stale price after write {write}: {price} != {expected}"
+        print(f"refresh after a write: median {statistics.median(refreshes):.1f} ms, every write seen")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Check that the squad summaries kept by triggers match a recomputation from user_team after
+every kind of write, and time reading a squad through the summary against the join.
+
+Runs on a copy of `balliq.db` in a temporary folder with simulated users: transfers by the
+engine, starting eleven edits, price and expected points changes as the ETL and
+the gameweek rollover make them. The exit code is 1 when a summary is off. Run from the
+`Ball_IQ` folder:
+    python -m benchmarks.squad_summary_check --users 200 --writes 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import timeit
+from contextlib import closing
+
+from benchmarks.gameweek_benchmark import add_users
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.migrations import SUMMARY_REFRESH
+from data.squad_summary import SUMMARY_COLUMNS, get_summary, squad_players
+from data.transfers import Transfer, TransferError, execute_transfers
+
+JOIN_QUERY = """SELECT p.name, p.team, p.position, p.expected_points_next_game
+    FROM players_fantasy p
+    JOIN user_team ut ON p.player_id = ut.player_id
+    WHERE ut.user_id = ? AND ut.on_team = 1
+    ORDER BY p.expected_points_next_game DESC"""
+
+
+def random_writes(db_path, user_ids, count, seed=0):
+    """Make transfers, lineup edits and player changes in random order."""
+    rng = random.Random(seed)
+    pool = get_pool(db_path)
+    players = pool.fetch_all("SELECT player_id, position FROM players_fantasy")
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        kind = rng.random()
+        if kind < 0.4:
+            squad = get_summary(user_id, db_path).squad
+            player_out = rng.choice(squad)
+            position = next(p[1] for p in players if p[0] == player_out)
+            player_in = rng.choice([p[0] for p in players if p[1] == position and p[0] not in squad])
+            try:
+                execute_transfers(user_id, [Transfer(player_out, player_in)], db_path)
+            except TransferError:
+                pass
+        elif kind < 0.8:
+            # A starting eleven edit, as the lineup tool writes it
+            player_id = rng.choice(get_summary(user_id, db_path).squad)
+            pool.run(lambda db: db.execute(
+                "UPDATE user_team SET starting_eleven = 1 - starting_eleven WHERE user_id = ? AND player_id = ?",
+                (user_id, player_id),
+            ))
+        else:
+            player_id = rng.choice(players)[0]
+            pool.run(lambda db: db.execute(
+                """UPDATE players_fantasy SET price = ROUND(price + ?, 1),
+                expected_points_next_game = ROUND(MAX(expected_points_next_game + ?, 0), 1) WHERE player_id = ?""",
+                (rng.choice((-0.1, 0.1, 0.2)), rng.choice((-1.0, 0.5, 2.0)), player_id),
+            ))
+
+
+def mismatches(db_path):
+    """Compare every summary with one rebuilt from user_team."""
+    columns = ", ".join(SUMMARY_COLUMNS)
+    with closing(sqlite3.connect(db_path)) as db:
+        db.execute(f"CREATE TEMP TABLE expected ({columns.replace('user_id', 'user_id INTEGER PRIMARY KEY', 1)})")
+        db.execute(SUMMARY_REFRESH.format(users="1").replace("INTO user_squad_summary", "INTO temp.expected"))
+        stored = {row[0]: row for row in db.execute(f"SELECT {columns} FROM user_squad_summary")}
+        expected = {row[0]: row for row in db.execute(f"SELECT {columns} FROM temp.expected")}
+
+    def normalized(row):
+        # The order of the ids in the lists doesn't matter
+        return (*row[:1], *(sorted(json.loads(value)) for value in row[1:3]), *row[3:]) if row else row
+
+    return [
+        user_id for user_id in stored.keys() | expected.keys()
+        if normalized(stored.get(user_id)) != normalized(expected.get(user_id))
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=200, help="Simulated users.")
+    parser.add_argument("--writes", type=int, default=2000, help="Random writes made.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, "balliq.db")
+        shutil.copy(get_sqlite_database_path(), db_path)
+        get_pool(db_path)
+        user_ids = add_users(db_path, args.users)
+        random_writes(db_path, user_ids, args.writes)
+        off = mismatches(db_path)
+        print(f"{args.writes} writes on {args.users} users: {len(off)} summaries off {off[:10]}")
+
+        user_id = user_ids[0]
+        pool = get_pool(db_path)
+        number = 2000
+        timings = {
+            "join on user_team": lambda: pool.fetch_all(JOIN_QUERY, (user_id,)),
+            "squad from summary": lambda: squad_players(user_id, ("name", "team", "position", "expected_points_next_game"), db_path),
+            "checks from summary": lambda: get_summary(user_id, db_path),
+            "checks by COUNT": lambda: pool.fetch_all(
+                """SELECT budget, (SELECT COUNT(*) FROM user_team WHERE user_id = ? AND on_team = 1),
+                (SELECT COUNT(*) FROM user_team WHERE user_id = ? AND starting_eleven = 1) FROM users WHERE user_id = ?""",
+                (user_id, user_id, user_id),
+            ),
+        }
+        for name, read in timings.items():
+            print(f"{name:<22}{timeit.timeit(read, number=number) / number * 1e6:>8.1f} µs")
+        pool.close()
+    sys.exit(1 if off else 0)
+
+
+if __name__ == "__main__":
+    main()
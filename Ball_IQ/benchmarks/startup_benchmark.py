@@ -0,0 +1,128 @@
+"""
+Measure MainChatbot startup time and peak RSS with eagerly built chains, lazily built
+ones, and lazily built ones with the common intents warmed in the background, the default.
+
+Each mode runs in its own Python process so the peak RSS of one doesn't hide the other.
+The LLM, router and retriever are stubbed, so this runs in CI without API keys. The first
+message, a chit chat one, is sent once the background builds are done, as when the user
+is still typing it. The chat history is written to a copy of `balliq.db`.
+
+Run from the `Ball_IQ` folder:
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("eager", "lazy", "warm")
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process.
+
+    Returns:
+        float: Peak RSS in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(mode):
+    """
+    Build one bot, answer one message and collect the timings.
+
+    Args:
+        mode (str): 'eager' to build every chain on startup, 'lazy' to build them on demand,
+            'warm' to also build the chains of `WARM_INTENTS` in the background.
+
+    Returns:
+        dict: Timings in milliseconds, peak RSS in megabytes and the chains that were built.
+    """
+    baseline_rss = peak_rss_mb()
+    start = time.perf_counter()
+
+    from benchmarks.stubs import make_stub_resources
+    from chatbot.bot import WARM_INTENTS, MainChatbot
+    from chatbot.memory import MemoryManager, SQLiteHistoryBackend
+    from data.loader import get_sqlite_database_path
+
+    imported = time.perf_counter()
+    folder = tempfile.mkdtemp()
+    db_path = os.path.join(folder, "balliq.db")
+    shutil.copy(get_sqlite_database_path(), db_path)
+    copied = time.perf_counter()
+
+    resources = make_stub_resources(memory=MemoryManager(SQLiteHistoryBackend(db_path)))
+    bot = MainChatbot(11, 1, resources=resources, warm_intents=WARM_INTENTS if mode == "warm" else ())
+    bot.user_login(11, 1)
+    if mode == "eager":
+        bot.chain_map.build_all()
+    started = time.perf_counter()
+    if bot.warming is not None:
+        bot.warming.join()
+    warmed = time.perf_counter()
+
+    bot.process_user_input({"customer_input": "Hi, how are you today?"})
+    answered = time.perf_counter()
+    shutil.rmtree(folder)
+
+    return {
+        "mode": mode,
+        "import_ms": (imported - start) * 1000,
+        "startup_ms": (started - copied) * 1000,
+        "background_ms": (warmed - started) * 1000,
+        "first_message_ms": (answered - warmed) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": peak_rss_mb() - baseline_rss,
+        "chains_built": sorted(bot.chain_map.build_times),
+    }
+
+
+def run_child(mode):
+    """Run `measure` in a fresh interpreter and return its result."""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup_benchmark", "--child", mode],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    results = [run_child(mode) for mode in MODES]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for result in results:
+        print(
+            f"{result['mode']:<6} startup {result['startup_ms']:9.2f} ms"
+            f"   background {result['background_ms']:8.2f} ms"
+            f"   first message {result['first_message_ms']:8.2f} ms"
+            f"   peak RSS {result['peak_rss_mb']:8.1f} MB"
+            f"   chains built {len(result['chains_built'])}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare the time to the first word of a reply streamed from the model with the reply
+returned whole and then shown word by word, as the chat page did before.
+
+The model is a stub writing a 200-word answer at `--chars-per-second`. The intent router is
+stubbed to chit chat, the memory is the real one. Run from the `Ball_IQ` folder:
+    python -m benchmarks.streaming_benchmark --chars-per-second 800
+"""
+
+import argparse
+import time
+
+from benchmarks.stubs import make_stub_llm, make_stub_resources
+from chatbot.bot import MainChatbot
+
+ANSWER = " ".join(["Fantasy football rewards patience and a squad that fits the fixtures."] * 20)
+
+
+def word_by_word(message):
+    """The reply shown a word at a time with a pause after each one, as the chat page did before."""
+    buffer = ""
+    for char in message:
+        buffer += char
+        if char == " " or char == "\n":
+            yield buffer
+            buffer = ""
+            time.sleep(0.1 if char == "\n" else 0.05)
+    if buffer:
+        yield buffer
+
+
+def time_reply(reply):
+    """Seconds from the message to the first chunk and to the end of a reply, and its text."""
+    start = time.perf_counter()
+    first, text = None, ""
+    for chunk in reply():
+        if first is None:
+            first = time.perf_counter() - start
+        text += chunk
+    return first, time.perf_counter() - start, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chars-per-second", type=float, default=800, help="Speed at which the stub model writes.")
+    parser.add_argument("--replies", type=int, default=3, help="Replies timed each way.")
+    args = parser.parse_args()
+
+    resources = make_stub_resources(llm=make_stub_llm([ANSWER], chars_per_second=args.chars_per_second))
+    bot = MainChatbot(1, "streaming-benchmark", resources=resources)
+    bot.user_login(1, "streaming-benchmark")
+    bot.process_user_input({"customer_input": "hello there"})  # Builds the chain outside of the measurements
+
+    print(f"answer of {len(ANSWER.split())} words written at {args.chars_per_second:.0f} characters per second")
+    print(f"{'reply':<28}{'first word s':>14}{'whole reply s':>15}")
+    for label, reply in (
+        ("whole, then word by word", lambda: word_by_word(bot.process_user_input({"customer_input": "tell me something"}))),
+        ("streamed from the model", lambda: bot.stream_user_input({"customer_input": "tell me something"})),
+    ):
+        for _ in range(args.replies):
+            first, total, text = time_reply(reply)
+        print(f"{label:<28}{first:>14.2f}{total:>15.2f}")
+
+    history = resources.memory.get_session_history(1, "streaming-benchmark").messages
+    print(f"streamed reply saved in the history: {history[-1].content == text}")
+    print("response metrics:", resources.response_metrics.as_dict())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Stand-ins for the remote services so the benchmarks run offline and without API keys.
+"""
+
+import asyncio
+import time
+import zlib
+
+import numpy as np
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from chatbot.resources import SharedResources
+from chatbot.response_cache import ResponseCache
+
+
+class StubRouteChoice:
+    """Minimal RouteChoice with the attributes read by MainChatbot."""
+
+    def __init__(self, name, similarity_score):
+        self.name = name
+        self.similarity_score = similarity_score
+
+
+class StubIntentionClassifier:
+    """Classifier that always answers the same route, in place of the RouteLayer."""
+
+    def __init__(self, route="chit_chat"):
+        self.route = route
+
+    def retrieve_multiple_routes(self, text):
+        return [StubRouteChoice(self.route, 1.0)]
+
+
+class HashingEncoder:
+    """Stand-in for the MiniLM encoder: counts of the hashed character trigrams of each text.
+
+    Messages that share most of their words get close embeddings, which is enough to
+    exercise the code matching similar messages without downloading the model.
+    """
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f"  {' '.join(text.lower().split())} "
+            for start in range(len(padded) - 2):
+                vectors[row, zlib.crc32(padded[start:start + 3].encode()) % self.dimensions] += 1
+        return vectors
+
+
+class PacedFakeChatModel(FakeListChatModel):
+    """FakeListChatModel that writes its answers at a fixed speed, streamed or not."""
+
+    def _call(self, *args, **kwargs):
+        response = super()._call(*args, **kwargs)
+        # Streaming waits before each character, a whole answer waits for all of them
+        time.sleep((self.sleep or 0) * len(response))
+        return response
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Awaits instead of taking a thread of the executor, as a call to the OpenAI API would
+        response = super()._call(messages, stop=stop, **kwargs)
+        await asyncio.sleep((self.sleep or 0) * len(response))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+
+def make_stub_llm(responses=None, chars_per_second=None):
+    """
+    Create a chat model that answers from a fixed list instead of calling OpenAI.
+
+    Args:
+        responses (list, optional): Answers returned in turn.
+        chars_per_second (float, optional): Speed at which the answers are written, instant if not given.
+
+    Returns:
+        A FakeListChatModel.
+    """
+    responses = responses or ["This is a stub answer."]
+    if chars_per_second is None:
+        return FakeListChatModel(responses=responses)
+    return PacedFakeChatModel(responses=responses, sleep=1 / chars_per_second)
+
+
+def make_stub_retriever():
+    """
+    Create a retriever that returns no documents instead of querying Pinecone.
+
+    Returns:
+        A runnable returning an empty list of documents.
+    """
+    return RunnableLambda(lambda query: [])
+
+
+def make_stub_resources(intention_classifier=None, **kwargs):
+    """
+    Create SharedResources with the language model, router and retriever stubbed.
+
+    The player snapshot and memory are still the real ones, built from `balliq.db`. The
+    response cache serves no intent unless one is passed, so the chains are always measured.
+
+    Args:
+        intention_classifier (optional): RouteLayer to classify with instead of the stub one.
+        **kwargs: Any other resource to pass to SharedResources.
+
+    Returns:
+        SharedResources ready to be used offline.
+    """
+    if intention_classifier is None:
+        kwargs.setdefault("intent_service", StubIntentionClassifier())
+    kwargs.setdefault("response_cache", ResponseCache(HashingEncoder(), lambda: None, intents=()))
+    return SharedResources(
+        llm=kwargs.pop("llm", None) or make_stub_llm(),
+        intention_classifier=intention_classifier,
+        retriever=kwargs.pop("retriever", None) or make_stub_retriever(),
+        **kwargs,
+    )
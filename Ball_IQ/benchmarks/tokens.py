@@ -0,0 +1,35 @@
+"""
+Prompt size measurements shared by the benchmarks.
+"""
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Tokenizer of gpt-4o-mini, or None when tiktoken cannot load it (e.g. offline)."""
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a text as gpt-4o-mini would.
+
+    Falls back to the usual estimate of four characters per token when the tokenizer is
+    not available, which is enough to compare prompt sizes.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
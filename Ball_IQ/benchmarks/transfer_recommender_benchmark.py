@@ -0,0 +1,85 @@
+"""
+Time the transfer recommender on every player of players.csv and check its answers
+against a brute force search on random subsets of players.
+
+Run from the `Ball_IQ` folder:
+    python -m benchmarks.transfer_recommender_benchmark
+"""
+
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from data.player_index import PLAYERS_CSV_PATH
+from data.transfer_recommender import TransferRecommender
+
+# Requests of increasing difficulty: (label, keyword arguments of `recommend`)
+SCENARIOS = [
+    ("1 midfielder, budget 8", dict(budget=8.0, count=1, positions=["Midfielder"])),
+    ("3 players, budget 20", dict(budget=20.0, count=3)),
+    ("3 players, budget 100", dict(budget=100.0, count=3)),
+    ("5 players, budget 40", dict(budget=40.0, count=5)),
+    ("2 DEF + 2 MID + 1 FWD, budget 30", dict(budget=30.0, position_counts={"Defender": 2, "Midfielder": 2, "Forward": 1})),
+    ("2 DEF + 2 MID + 1 FWD, budget 100", dict(budget=100.0, position_counts={"Defender": 2, "Midfielder": 2, "Forward": 1})),
+]
+
+
+def brute_force_points(players, budget, count):
+    """Most expected points of any `count` players within the budget, None if none fit."""
+    best = None
+    for chosen in itertools.combinations(players, count):
+        if sum(player.price for player in chosen) <= budget + 1e-9:
+            points = sum(player.expected_points for player in chosen)
+            best = points if best is None else max(best, points)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=50, help="Calls per scenario.")
+    parser.add_argument("--checks", type=int, default=200, help="Random subsets checked by brute force.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    recommender = TransferRecommender.from_players_csv(PLAYERS_CSV_PATH)
+    print(f"{len(recommender.players)} players loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    rng = random.Random(0)
+    for label, kwargs in SCENARIOS:
+        durations = []
+        for _ in range(args.runs):
+            # A random squad of 15 players to exclude, as in a real request
+            squad = rng.sample(recommender.ids.tolist(), 15)
+            start = time.perf_counter()
+            recommendation = recommender.recommend(exclude=squad, **kwargs)
+            durations.append((time.perf_counter() - start) * 1000)
+        print(
+            f"{label:<36} median {statistics.median(durations):7.3f} ms   max {max(durations):7.3f} ms"
+            f"   {recommendation.total_points:g} points for {recommendation.total_price:g}"
+        )
+
+    durations = []
+    for _ in range(args.runs):
+        player_out = rng.choice(recommender.ids.tolist())
+        start = time.perf_counter()
+        recommender.best_swaps(player_out, budget=2.0)
+        durations.append((time.perf_counter() - start) * 1000)
+    print(f"{'best swap for a player':<36} median {statistics.median(durations):7.3f} ms   max {max(durations):7.3f} ms")
+
+    mismatches = 0
+    for _ in range(args.checks):
+        subset = TransferRecommender(rng.sample(recommender.players, 40))
+        budget, count = rng.uniform(8, 30), rng.randint(1, 4)
+        expected = brute_force_points(subset.players, budget, count)
+        got = subset.recommend(budget, count)
+        if expected is None:
+            mismatches += bool(got.players)
+        else:
+            mismatches += abs(expected - got.total_points) > 1e-6
+    print(f"brute force check: {mismatches} of {args.checks} recommendations not optimal")
+
+
+if __name__ == "__main__":
+    main()
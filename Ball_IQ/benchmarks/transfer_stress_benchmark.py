@@ -0,0 +1,186 @@
+"""
+Hammer the transfer code with many threads per user, as when a user has the app open in
+several tabs, and check that no budget update is lost.
+
+Three implementations run on their own copy of `balliq.db` in a temporary folder:
+    original  the statements of the old TransferPlayerTool, by name, a new connection per call
+    pooled    the same statements in one BEGIN IMMEDIATE transaction of the connection pool
+    engine    `data.transfers.execute_transfers`
+
+Prices don't change during the run, so the budget plus the value of the squad of every
+user must stay what it was; any difference is money created or lost by a race.
+
+Run from the `Ball_IQ` folder:
+    python -m benchmarks.transfer_stress_benchmark --users 8 --tabs 4 --transfers 100
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from benchmarks.concurrency_benchmark import add_users
+from data.connection import ConnectionPool, is_busy_error
+from data.loader import get_sqlite_database_path
+from data.transfers import Transfer, TransferError, execute_transfers
+
+# Budget of every simulated user, low enough that the check of the budget matters
+START_BUDGET = 20
+
+
+class Rejected(Exception):
+    """A transfer refused by the rules, as the tool reports it to the user."""
+
+
+def legacy_transfer(db, user_id, player_out_name, player_in_name):
+    """The statements the TransferPlayerTool used to run, from reading the budget to the commit."""
+    cursor = db.cursor()
+    user_budget = cursor.execute("SELECT budget FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+    player_out_id, player_out_price = cursor.execute(
+        "SELECT player_id, price FROM players_fantasy WHERE name = ?", (player_out_name,)
+    ).fetchone()
+    if cursor.execute(
+        "SELECT player_id FROM user_team WHERE user_id = ? AND player_id = ? AND on_team = 1", (user_id, player_out_id)
+    ).fetchone() is None:
+        raise Rejected("not on team")
+    player_in_price = cursor.execute("SELECT price FROM players_fantasy WHERE name = ?", (player_in_name,)).fetchone()[0]
+    budget_after_transfer = user_budget + player_out_price - player_in_price
+    if budget_after_transfer < 0:
+        raise Rejected("budget")
+    cursor.execute(
+        "UPDATE user_team SET on_team = 0, starting_eleven = 0 WHERE user_id = ? AND player_id = ?",
+        (user_id, player_out_id),
+    )
+    player_in_id = cursor.execute("SELECT player_id FROM players_fantasy WHERE name = ?", (player_in_name,)).fetchone()[0]
+    if cursor.execute(
+        "SELECT player_id FROM user_team WHERE user_id = ? AND player_id = ?", (user_id, player_in_id)
+    ).fetchone() is None:
+        cursor.execute(
+            "INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, 0)",
+            (user_id, player_in_id),
+        )
+    else:
+        cursor.execute("UPDATE user_team SET on_team = 1 WHERE user_id = ? AND player_id = ?", (user_id, player_in_id))
+    cursor.execute("UPDATE users SET budget = ? WHERE user_id = ?", (budget_after_transfer, user_id))
+
+
+def account_values(db_path, user_ids):
+    """Budget plus squad value, and squad size, of each user."""
+    with closing(sqlite3.connect(db_path)) as db:
+        rows = db.execute(
+            f"""SELECT u.user_id, u.budget + TOTAL(p.price), COUNT(p.player_id)
+            FROM users u
+            LEFT JOIN user_team ut ON ut.user_id = u.user_id AND ut.on_team = 1
+            LEFT JOIN players_fantasy p ON p.player_id = ut.player_id
+            WHERE u.user_id IN ({','.join('?' * len(user_ids))})
+            GROUP BY u.user_id""",
+            user_ids,
+        ).fetchall()
+    return {user_id: (round(value, 1), size) for user_id, value, size in rows}
+
+
+def run_mode(mode, db_path, user_ids, tabs, transfers):
+    """
+    Run every tab of every user in its own thread.
+
+    Returns:
+        tuple: Transfers done, rejected, failed on a locked database, and elapsed seconds.
+    """
+    with closing(sqlite3.connect(db_path)) as db:
+        players = db.execute("SELECT player_id, name, position FROM players_fantasy").fetchall()
+    name_of = {player_id: name for player_id, name, _ in players}
+    by_position = {}
+    for player_id, _, position in players:
+        by_position.setdefault(position, []).append(player_id)
+
+    pool = ConnectionPool(db_path, max_connections=8)
+    counts = {"done": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(user_ids) * tabs)
+
+    def squad_of(user_id):
+        return pool.fetch_all(
+            """SELECT p.player_id, p.position FROM user_team ut JOIN players_fantasy p ON p.player_id = ut.player_id
+            WHERE ut.user_id = ? AND ut.on_team = 1""",
+            (user_id,),
+        )
+
+    def tab(user_id, seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(transfers):
+            squad = squad_of(user_id)
+            player_out, position = rng.choice(squad)
+            owned = {player_id for player_id, _ in squad}
+            player_in = rng.choice([p for p in by_position[position] if p not in owned])
+            outcome = "done"
+            try:
+                if mode == "original":
+                    with closing(sqlite3.connect(db_path)) as db:
+                        with db:
+                            legacy_transfer(db, user_id, name_of[player_out], name_of[player_in])
+                elif mode == "pooled":
+                    pool.run(lambda db: legacy_transfer(db, user_id, name_of[player_out], name_of[player_in]))
+                else:
+                    execute_transfers(user_id, [Transfer(player_out, player_in)], db_path=db_path)
+            except (Rejected, TransferError, sqlite3.IntegrityError):
+                outcome = "rejected"
+            except sqlite3.OperationalError as error:
+                if not is_busy_error(error):
+                    raise
+                outcome = "failed"
+            with lock:
+                counts[outcome] += 1
+
+    threads = [
+        threading.Thread(target=tab, args=(user_id, user_id * 100 + number))
+        for user_id in user_ids
+        for number in range(tabs)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return counts["done"], counts["rejected"], counts["failed"], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=8, help="Simulated users.")
+    parser.add_argument("--tabs", type=int, default=4, help="Threads making transfers for each user.")
+    parser.add_argument("--transfers", type=int, default=100, help="Transfers tried by each thread.")
+    args = parser.parse_args()
+
+    print(f"{args.users} users x {args.tabs} tabs x {args.transfers} transfers")
+    print(f"{'mode':<10}{'transfers/s':>13}{'done':>7}{'rejected':>10}{'failed':>8}{'users off':>11}{'money created':>15}")
+    with tempfile.TemporaryDirectory() as folder:
+        for mode in ("original", "pooled", "engine"):
+            db_path = os.path.join(folder, f"{mode}.db")
+            shutil.copy(get_sqlite_database_path(), db_path)
+            user_ids = add_users(db_path, args.users)
+            with closing(sqlite3.connect(db_path)) as db, db:
+                db.execute(
+                    f"UPDATE users SET budget = ? WHERE user_id IN ({','.join('?' * len(user_ids))})",
+                    (START_BUDGET, *user_ids),
+                )
+            before = account_values(db_path, user_ids)
+
+            done, rejected, failed, elapsed = run_mode(mode, db_path, user_ids, args.tabs, args.transfers)
+
+            after = account_values(db_path, user_ids)
+            off = [user_id for user_id in user_ids if after[user_id][0] != before[user_id][0] or after[user_id][1] != 15]
+            created = sum(after[user_id][0] - before[user_id][0] for user_id in user_ids)
+            print(f"{mode:<10}{done / elapsed:>13.0f}{done:>7}{rejected:>10}{failed:>8}{len(off):>11}{created:>15.1f}")
+    print("users off: users whose budget plus squad value changed, or whose squad no longer has 15 players.")
+
+
+if __name__ == "__main__":
+    main()
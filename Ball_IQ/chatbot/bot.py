@@ -1,7 +1,9 @@
 # Import necessary classes and modules for chatbot functionality
-from typing import Callable, Dict, Optional
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables.config import run_in_executor
 from chatbot.chains.CheckUpcomingFixturesChain import *
 from chatbot.chains.OptimizeLineupChain import *
 from chatbot.chains.PuttingPlayerInStarting11Chain import *
@@ -12,41 +14,76 @@ from chatbot.chains.TransferPlayerChain import *
 from chatbot.chains.ViewPlayerStatsandPriceChange import *
 from chatbot.chains.no_intention import *
 from chatbot.chains.chictchat import *
-from chatbot.memory import MemoryManager
-from chatbot.router.loader import load_intention_classifier
+from chatbot.chain_map import LazyChainMap
+from chatbot.resources import SharedResources
 from dotenv import load_dotenv
 import re
 load_dotenv()
 
+INJECTION_REPLY = "Invalid input, seems like something you said is trying to create a prompt injection"
+# Intents the no_intent chain chooses from, and the intent handling each of them when the name differs
+NO_INTENT_CHOICES = [
+    "check_upcoming_fixtures",
+    "optimize_lineup",
+    "putting_players_in_starting11",
+    "what_is_a_stat",
+    "recommend_players",
+    "transfer_players",
+    "view_or_update_team_points",
+    "view_players_stats",
+    "about_company_Ball_IQ",
+    "chitchat",
+]
+# Intents users hit most, whose chains are built in the background once the bot is up
+WARM_INTENTS = ("know_information_about_stats", "check_upcoming_fixtures", "chit_chat")
+NO_INTENT_ROUTES = {
+    "chitchat": "chit_chat",
+    "about_company_Ball_IQ": "chit_chat_about_company",
+    "what_is_a_stat": "know_information_about_stats",
+}
+
 
 class MainChatbot:
     """A bot that handles customer service interactions by processing user inputs and
     routing them through configured reasoning and response chains.
     """
 
-    def __init__(self, user_id, conversation_id):
-        """Initialize the bot with session and language model configurations."""
-        # Initialize the memory manager to manage session history
+    def __init__(self, user_id, conversation_id, resources=None, warm_intents=WARM_INTENTS):
+        """Initialize the bot with session and language model configurations.
+
+        Args:
+            user_id: Identifier for the user.
+            conversation_id: Identifier for the conversation.
+            resources: SharedResources to build the chains from, a new private set is used if not given.
+            warm_intents: Intents whose chains are built in a background thread right away, the
+                others are built on their first message.
+        """
+        # The language model, router, retriever and player tables don't depend on the user
+        self.resources = resources or SharedResources()
         self.id = user_id
-        self.memory = MemoryManager()
-        api_key = os.getenv("api_key")
+        # Initialize the memory manager to manage session history
+        self.memory = self.resources.memory
         # Configure the language model with specific parameters for response generation
-        self.llm = ChatOpenAI(temperature=0.0, model="gpt-4o-mini", api_key=api_key)
+        self.llm = self.resources.llm
         
-        # Map intent names to their corresponding reasoning and response chains
-        self.chain_map = {
-            "check_upcoming_fixtures": self.add_memory_to_runnable(CheckUpcomingFixtures(llm = self.llm)),
-            "optimize_lineup": self.add_memory_to_runnable(OptimizeLineup(user_id=self.id, llm=self.llm)), 
-            "putting_players_in_starting11": self.add_memory_to_runnable(PlayerInStarting11ChainFinal(user_id = self.id, llm = self.llm)), 
-            "know_information_about_stats": self.add_memory_to_runnable(RAGChatBot(llm = self.llm)), 
-            "recommend_players": self.add_memory_to_runnable(RecommendPlayers(user_id=self.id, llm=self.llm)), 
-            "transfer_players": self.add_memory_to_runnable(TransferPlayerChainFinal(user_id=self.id, llm=self.llm)), 
-            "view_or_update_team_points": self.add_memory_to_runnable(PointsRunnableResponse(user_id=self.id, llm=self.llm)), 
-            "view_players_stats": self.add_memory_to_runnable(ViewPlayerStats(llm = self.llm)), 
-            "chit_chat_about_company": self.add_memory_to_runnable(RAGChatBot(llm= self.llm)),
-            "no_intent": self.add_memory_to_runnable(DealwithNoneIntention(llm = self.llm)),
-            "chit_chat": self.add_memory_to_runnable(Chitchat(llm=self.llm))
-        }
+        # Map intent names to their corresponding reasoning and response chains.
+        # Chains are only built the first time their intent is routed to.
+        self.chain_map = LazyChainMap(
+            {
+                "check_upcoming_fixtures": lambda: self.add_memory_to_runnable(CheckUpcomingFixtures(llm = self.llm, snapshot=self.resources.snapshot)),
+                "optimize_lineup": lambda: self.add_memory_to_runnable(OptimizeLineup(user_id=self.id, llm=self.llm)), 
+                "putting_players_in_starting11": lambda: self.add_memory_to_runnable(PlayerInStarting11ChainFinal(user_id = self.id, llm = self.llm, snapshot=self.resources.snapshot, rephrase=self.resources.rephrase_responses)), 
+                "know_information_about_stats": lambda: self.add_memory_to_runnable(RAGChatBot(llm = self.llm, retriever=self.resources.retriever)), 
+                "recommend_players": lambda: self.add_memory_to_runnable(RecommendPlayers(user_id=self.id, llm=self.llm, snapshot=self.resources.snapshot)), 
+                "transfer_players": lambda: self.add_memory_to_runnable(TransferPlayerChainFinal(user_id=self.id, llm=self.llm, snapshot=self.resources.snapshot, rephrase=self.resources.rephrase_responses)), 
+                "view_or_update_team_points": lambda: self.add_memory_to_runnable(PointsRunnableResponse(user_id=self.id, llm=self.llm, rephrase=self.resources.rephrase_responses)), 
+                "view_players_stats": lambda: self.add_memory_to_runnable(ViewPlayerStats(llm = self.llm, snapshot=self.resources.snapshot)), 
+                "no_intent": lambda: self.add_memory_to_runnable(DealwithNoneIntention(llm = self.llm)),
+                "chit_chat": lambda: self.add_memory_to_runnable(Chitchat(llm=self.llm))
+            },
+            # Both RAG intents answer from the same documents with the same prompt
+            aliases={"chit_chat_about_company": "know_information_about_stats"},
+        )
 
 
         # Map of intentions to their corresponding handlers
@@ -63,8 +100,15 @@ class MainChatbot:
             "chit_chat": self.handle_chitchat_intent
         }
 
-        # Load the intention classifier to determine user intents
-        self.intention_classifier = load_intention_classifier()
+        # Load the intention classifier to determine user intents, shared with every other
+        # session so repeated messages are cached and concurrent ones are encoded together
+        self.intention_classifier = self.resources.intent_service
+        # Keyword and pattern router that answers obvious messages without the encoder
+        self.fast_router = self.resources.fast_router
+
+        # Started last, the chains read the attributes set above. The startup stays short and
+        # the first message of a common intent finds its chain built.
+        self.warming = self.chain_map.warm(warm_intents) if warm_intents else None
 
     def user_login(self, user_id: str, conversation_id: str) -> None:
         """Log in a user by setting the user and conversation identifiers.
@@ -94,7 +138,7 @@ class MainChatbot:
 
         return RunnableWithMessageHistory(
             original_runnable,
-            self.memory.get_session_history,  # Retrieve session history
+            self.memory.get_prompt_history,  # Retrieve session history, compacted for the prompt
             input_messages_key="customer_input",  # Key for user inputs
             history_messages_key="chat_history",  # Key for chat history
             history_factory_config=self.memory.get_history_factory_config(),  # Config for history factory
@@ -116,6 +160,60 @@ class MainChatbot:
         return self.chain_map[intent]
 
 
+    def save_cached_reply(self, user_input: Dict[str, str], reply: str) -> None:
+        """Add a message answered from the response cache and its reply to the session history.
+
+        Args:
+            user_input: The input text from the user.
+            reply: The reply found in the cache.
+        """
+        self.memory.get_session_history(self.user_id, self.conversation_id).add_messages(
+            [HumanMessage(content=user_input["customer_input"]), AIMessage(content=reply)]
+        )
+
+    def lookup_cached_reply(self, intent: str, user_input: Dict[str, str]):
+        """Look a message up in the response cache.
+
+        The cached chains read the chat history, so only the first message of a conversation
+        is looked up, and only its reply is stored.
+
+        Args:
+            intent: The identified intent of the user input.
+            user_input: The input text from the user.
+
+        Returns:
+            The CacheLookup, None if the intent isn't cached or the conversation has history.
+        """
+        cache = self.resources.response_cache
+        if intent not in cache.intents:
+            return None
+        if self.memory.get_session_history(self.user_id, self.conversation_id).messages:
+            return None
+        return cache.lookup(intent, user_input["customer_input"])
+
+    def invoke_cached(self, intent: str, user_input: Dict[str, str]) -> str:
+        """Answer with the chain of an intent, or with the reply the response cache has for a similar message.
+
+        The cache bypasses the intents whose replies depend on the user, and the messages
+        after the first of a conversation.
+
+        Args:
+            intent: The identified intent of the user input.
+            user_input: The input text from the user.
+
+        Returns:
+            The content of the response.
+        """
+        cache = self.resources.response_cache
+        lookup = self.lookup_cached_reply(intent, user_input)
+        if lookup is not None and lookup.reply is not None:
+            self.save_cached_reply(user_input, lookup.reply)
+            return lookup.reply
+        response = self.get_chain(intent).invoke(user_input, config=self.memory_config)
+        if lookup is not None:
+            cache.store(lookup, response)
+        return response
+
     def get_user_intent(self, user_input: Dict):
         """Classify the user intent based on the input text.
 
@@ -125,7 +223,12 @@ class MainChatbot:
         Returns:
             The classified intent of the user input.
         """
-        # Retrieve possible routes for the user's input using the classifier
+        # Obvious messages are routed by keywords, skipping the embedding model entirely
+        fast_choice = self.fast_router.classify(user_input["customer_input"])
+        if fast_choice is not None:
+            return fast_choice.name
+
+        # Retrieve possible routes for the user's input using the classifier, best score first
         intent_routes = self.intention_classifier.retrieve_multiple_routes(
             user_input["customer_input"]
         )
@@ -163,7 +266,7 @@ class MainChatbot:
         """
 
         # Generate a response using the output of the reasoning chain
-        response = self.get_chain("check_upcoming_fixtures").invoke(user_input, config=self.memory_config)
+        response = self.invoke_cached("check_upcoming_fixtures", user_input)
 
         return response
     
@@ -208,7 +311,7 @@ class MainChatbot:
         """
 
         # Generate a response using the output of the reasoning chain
-        response = self.get_chain("know_information_about_stats").invoke(user_input, config = self.memory_config)
+        response = self.invoke_cached("know_information_about_stats", user_input)
 
         return response
     
@@ -284,7 +387,7 @@ class MainChatbot:
         """
 
         # Generate a response using the output of the reasoning chain
-        response = self.get_chain("chit_chat_about_company").invoke(user_input, self.memory_config)
+        response = self.invoke_cached("chit_chat_about_company", user_input)
         return response
     
     def handle_chitchat_intent(self, user_input: Dict):
@@ -301,59 +404,50 @@ class MainChatbot:
         response = self.get_chain("chit_chat").invoke(user_input, config=self.memory_config)
         return response
     
-    def handle_unknown_intent(self, user_input: Dict[str, str]) -> str:
-        """Handle unknown intents by providing a chitchat response.
+    def resolve_unknown_intent(self, user_input: Dict[str, str]) -> Optional[str]:
+        """Ask the no_intent chain which intent a message the router couldn't place belongs to.
 
         Args:
             user_input: The input text from the user.
 
         Returns:
-            The content of the response after processing through the new chain.
+            The name of the intent to handle the message with.
         """
-        possible_intention = ["check_upcoming_fixtures",
-                            "optimize_lineup",
-                            "putting_players_in_starting11",
-                            "what_is_a_stat",
-                            "recommend_players",
-                            "transfer_players",
-                            "view_or_update_team_points",
-                            "view_players_stats",
-                            "about_company_Ball_IQ",
-                            "chitchat"]
+        none_output1 = self.get_chain("no_intent").invoke(
+            {"customer_input": user_input["customer_input"], "list_of_intentions": NO_INTENT_CHOICES},
+            self.memory_config,
+        )
+        return NO_INTENT_ROUTES.get(none_output1, none_output1)
 
+    async def aresolve_unknown_intent(self, user_input: Dict[str, str]) -> Optional[str]:
+        """Like `resolve_unknown_intent`, without blocking the event loop.
 
-        none_reasoning_chain = self.get_chain("no_intent")
+        Args:
+            user_input: The input text from the user.
 
-        input_message = {}
+        Returns:
+            The name of the intent to handle the message with.
+        """
+        none_reasoning_chain = await run_in_executor(None, self.get_chain, "no_intent")
+        none_output1 = await none_reasoning_chain.ainvoke(
+            {"customer_input": user_input["customer_input"], "list_of_intentions": NO_INTENT_CHOICES},
+            self.memory_config,
+        )
+        return NO_INTENT_ROUTES.get(none_output1, none_output1)
 
-        input_message["customer_input"] = user_input["customer_input"]
-        input_message["list_of_intentions"] = possible_intention
-        memory_config = {
-            "configurable": {
-                "user_id": self.user_id,
-                "conversation_id": self.conversation_id,
-            }}
+    def handle_unknown_intent(self, user_input: Dict[str, str]) -> str:
+        """Handle unknown intents by providing a chitchat response.
 
-        none_output1 = none_reasoning_chain.invoke(input_message, memory_config)
-        if none_output1 == "chitchat":
-            #print("Chitchat")
-            return self.handle_chitchat_intent(user_input)
-        
-        elif none_output1 == "about_company_Ball_IQ":
-            new_intention = "chit_chat_about_company"
-            #print("New Intention:", new_intention) #used to see if it finally gets the intent right
-            new_handler = self.intent_handlers.get(new_intention)
-            return new_handler(user_input)
-        elif none_output1 == "what_is_a_stat":
-            new_intention = "know_information_about_stats"
-            #print("New Intention:", new_intention) #used to see if it finally gets the intent right
-            new_handler = self.intent_handlers.get(new_intention)
-            return new_handler(user_input)
-        else:
-            new_intention = none_output1
-            #print("New Intention:", new_intention) #used to see if it finally gets the intent right
-            new_handler = self.intent_handlers.get(new_intention)
-            return new_handler(user_input)
+        Args:
+            user_input: The input text from the user.
+
+        Returns:
+            The content of the response after processing through the new chain.
+        """
+        new_intention = self.resolve_unknown_intent(user_input)
+        #print("New Intention:", new_intention) #used to see if it finally gets the intent right
+        new_handler = self.intent_handlers.get(new_intention)
+        return new_handler(user_input)
 
     def save_memory(self) -> None:
         """Save the current memory state of the bot."""
@@ -391,13 +485,9 @@ class MainChatbot:
             The content of the response after processing through the chains.
         """
         if not self.check_for_injections(user_input = user_input):
-            return "Invalid input, seems like something you said is trying to create a prompt injection"
+            return INJECTION_REPLY
         # Classify the user's intent based on their input
         else:
-            user_input["chat_history"] = self.memory.get_session_history(
-                self.user_id, self.conversation_id
-            )
-            
             intention = self.get_user_intent(user_input)
 
             #use to see wether the model is getting the intentions right
@@ -405,4 +495,148 @@ class MainChatbot:
 
             # Route the input based on the identified intention
             handler = self.intent_handlers.get(intention, self.handle_unknown_intent)
-            return handler(user_input)
\ No newline at end of file
+            return handler(user_input)
+
+    def stream_user_input(self, user_input: Dict[str, str]) -> Iterator[str]:
+        """Process user input like `process_user_input`, yielding the reply as it is written.
+
+        The chunks come from the model as it generates them, and the whole reply is added to
+        the session history once the last one is out. The time to the first and last chunk
+        is recorded in the response metrics of the shared resources.
+
+        Args:
+            user_input: The input text from the user.
+
+        Yields:
+            The chunks of the reply.
+        """
+        start = time.perf_counter()
+        first_chunk = None
+        intention = None
+        try:
+            if not self.check_for_injections(user_input = user_input):
+                first_chunk = time.perf_counter() - start
+                yield INJECTION_REPLY
+                return
+            intention = self.get_user_intent(user_input)
+            if intention not in self.intent_handlers:
+                intention = self.resolve_unknown_intent(user_input)
+                if intention not in self.intent_handlers:
+                    intention = "chit_chat"
+
+            cache = self.resources.response_cache
+            lookup = self.lookup_cached_reply(intention, user_input)
+            if lookup is not None and lookup.reply is not None:
+                self.save_cached_reply(user_input, lookup.reply)
+                first_chunk = time.perf_counter() - start
+                yield lookup.reply
+                return
+
+            chunks = []
+            for chunk in self.get_chain(intention).stream(user_input, config=self.memory_config):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                chunks.append(chunk)
+                yield chunk
+            if lookup is not None:
+                cache.store(lookup, "".join(chunks))
+        finally:
+            if first_chunk is not None:
+                self.resources.response_metrics.record(intention, first_chunk, time.perf_counter() - start)
+
+    async def aroute_user_input(self, user_input: Dict[str, str]):
+        """Find the intent of a message and its chain without blocking the event loop.
+
+        The intent service and the first build of a chain, which may read the player tables,
+        run in a thread, the no_intent chain awaits the model.
+
+        Args:
+            user_input: The input text from the user.
+
+        Returns:
+            The name of the intent and its chain.
+        """
+        intention = await run_in_executor(None, self.get_user_intent, user_input)
+        if intention not in self.intent_handlers:
+            intention = await self.aresolve_unknown_intent(user_input)
+            if intention not in self.intent_handlers:
+                intention = "chit_chat"
+        return intention, await run_in_executor(None, self.get_chain, intention)
+
+    async def alookup_cached_reply(self, intention: str, user_input: Dict[str, str]):
+        """Look a message up in the response cache from a thread, saving a reply found in the session history.
+
+        Args:
+            intention: The identified intent of the user input.
+            user_input: The input text from the user.
+
+        Returns:
+            The response cache and the CacheLookup, None if the intent isn't cached or the conversation has history.
+        """
+        cache = self.resources.response_cache
+        if intention not in cache.intents:
+            return cache, None
+        # The history may be read from the database
+        lookup = await run_in_executor(None, self.lookup_cached_reply, intention, user_input)
+        if lookup is not None and lookup.reply is not None:
+            await run_in_executor(None, self.save_cached_reply, user_input, lookup.reply)
+        return cache, lookup
+
+    async def aprocess_user_input(self, user_input: Dict[str, str]) -> str:
+        """Process user input like `process_user_input` without blocking the event loop.
+
+        Calls to the model are awaited and the database is used from a thread, so a single
+        event loop can serve many conversations at once.
+
+        Args:
+            user_input: The input text from the user.
+
+        Returns:
+            The content of the response after processing through the chains.
+        """
+        if not self.check_for_injections(user_input = user_input):
+            return INJECTION_REPLY
+        intention, chain = await self.aroute_user_input(user_input)
+        cache, lookup = await self.alookup_cached_reply(intention, user_input)
+        if lookup is not None and lookup.reply is not None:
+            return lookup.reply
+        response = await chain.ainvoke(user_input, config=self.memory_config)
+        if lookup is not None:
+            await run_in_executor(None, cache.store, lookup, response)
+        return response
+
+    async def astream_user_input(self, user_input: Dict[str, str]) -> AsyncIterator[str]:
+        """Process user input like `stream_user_input` without blocking the event loop.
+
+        Args:
+            user_input: The input text from the user.
+
+        Yields:
+            The chunks of the reply.
+        """
+        start = time.perf_counter()
+        first_chunk = None
+        intention = None
+        try:
+            if not self.check_for_injections(user_input = user_input):
+                first_chunk = time.perf_counter() - start
+                yield INJECTION_REPLY
+                return
+            intention, chain = await self.aroute_user_input(user_input)
+            cache, lookup = await self.alookup_cached_reply(intention, user_input)
+            if lookup is not None and lookup.reply is not None:
+                first_chunk = time.perf_counter() - start
+                yield lookup.reply
+                return
+
+            chunks = []
+            async for chunk in chain.astream(user_input, config=self.memory_config):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                chunks.append(chunk)
+                yield chunk
+            if lookup is not None:
+                await run_in_executor(None, cache.store, lookup, "".join(chunks))
+        finally:
+            if first_chunk is not None:
+                self.resources.response_metrics.record(intention, first_chunk, time.perf_counter() - start)
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Optional
+
+
+class LazyChainMap(Mapping):
+    """Mapping of intent names to chains that builds each chain the first time it is requested.
+
+    Most conversations only touch a couple of intents, so building every chain up front
+    wastes time and memory. Intents listed in `aliases` share the chain of another intent
+    instead of building an identical copy. The chains of the intents users hit most can be
+    built ahead in a background thread with `warm`, so their first message doesn't pay for it.
+    """
+
+    def __init__(
+        self,
+        factories: Dict[str, Callable[[], object]],
+        aliases: Optional[Dict[str, str]] = None,
+    ):
+        """Initialize the lazy chain map.
+
+        Args:
+            factories: Callables without arguments that build the chain of each intent.
+            aliases: Intents that reuse the chain of another intent, as {intent: shared_intent}.
+        """
+        self._factories = factories
+        self._aliases = aliases or {}
+        self._chains = {}
+        # One lock per chain, so a slow build in the background doesn't hold up the others
+        self._locks = {intent: threading.Lock() for intent in factories}
+        # Seconds spent building each chain, useful to see what a first message costs
+        self.build_times: Dict[str, float] = {}
+
+    def _resolve(self, intent: str) -> str:
+        """Return the intent whose factory builds the chain of the given intent."""
+        return self._aliases.get(intent, intent)
+
+    def __getitem__(self, intent: str):
+        key = self._resolve(intent)
+        chain = self._chains.get(key)
+        if chain is None:
+            if key not in self._factories:
+                raise KeyError(intent)
+            with self._locks[key]:
+                # Another thread may have built it while we waited for the lock
+                chain = self._chains.get(key)
+                if chain is None:
+                    start = time.perf_counter()
+                    chain = self._factories[key]()
+                    self.build_times[key] = time.perf_counter() - start
+                    self._chains[key] = chain
+        return chain
+
+    def __iter__(self):
+        yield from self._factories
+        yield from self._aliases
+
+    def __len__(self) -> int:
+        return len(self._factories) + len(self._aliases)
+
+    def is_built(self, intent: str) -> bool:
+        """Check whether the chain of an intent has already been built.
+
+        Args:
+            intent: Name of the intent.
+
+        Returns:
+            True if the chain exists, False otherwise.
+        """
+        return self._resolve(intent) in self._chains
+
+    def build_all(self) -> None:
+        """Build every chain now, which is what MainChatbot used to do on construction."""
+        for intent in self._factories:
+            self[intent]
+
+    def warm(self, intents: Iterable[str]) -> threading.Thread:
+        """Build the chains of some intents in a background thread, in order.
+
+        A message routed to one of them meanwhile waits for its build instead of starting another.
+
+        Args:
+            intents: Names of the intents, aliases included.
+
+        Returns:
+            The daemon thread building them, already started.
+        """
+        intents = list(intents)
+
+        def build():
+            for intent in intents:
+                try:
+                    self[intent]
+                except Exception:
+                    # Built again, and raising, when a message is routed to it
+                    pass
+
+        thread = threading.Thread(target=build, name="warm-chains", daemon=True)
+        thread.start()
+        return thread
@@ -1,30 +1,28 @@
 from langchain.schema import StrOutputParser
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
-import sqlite3
+from data.snapshot import PlayerDataSnapshot
 from langchain import callbacks
 
 class CheckUpcomingFixtures(Runnable):
     """Chain that generates a response to customer queries about upcoming fixtures."""
-    def __init__(self, llm, memory=True):
+    def __init__(self, llm, memory=True, snapshot=None):
         """Initialize the check upcoming fixtures chain."""
         super().__init__()
 
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.name_list = self.query_as_list("SELECT name, team FROM players_fantasy")
-        self.fixtures = self.query_as_list("SELECT * From fixtures")
+        # Player and fixture tables are shared by every user, reuse the process snapshot when given
+        self.snapshot = snapshot or PlayerDataSnapshot()
 
         prompt_template = PromptTemplate(
             system_template=""" 
             You are a part of a company about fantasy football. 
             Your task is to identify the matches a certain player will play accordingly to what player is in the user input.
 
-            Here is the list all players:
+            Here is the list of players that match the user input:
             {names_list}
 
             Here is a list of all matches and the teams playing:
@@ -42,8 +40,6 @@ class CheckUpcomingFixtures(Runnable):
             8. Don't use bullet points, provide the message as if you were exchanging texts with the user
             9. Don't greet the user
 
-            Chat History:
-            {chat_history}
                         """,
             human_template="Customer Query: {customer_input}",
         )
@@ -53,18 +49,41 @@ class CheckUpcomingFixtures(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    def query_as_list(self, query):
-        """Retrieve a query as a list"""
-        cursor = self.db.cursor()
-        cursor.execute(query)
-        res = cursor.fetchall()
-        return list(set(res))
-    
+    def get_candidates(self, customer_input):
+        """
+        Retrieve the players and fixtures of the teams the user input talks about, everything if none is found.
+        """
+        # Read the tables once so the names and fixtures come from the same data version
+        tables = self.snapshot.tables
+        index = tables.player_index
+        matches = index.search(customer_input)
+        teams = set(index.search_teams(customer_input)) | {match.team for match in matches}
+        if not teams:
+            return tables.names_and_teams, tables.all_fixtures
+
+        names_list = [(match.name, match.team) for match in matches]
+        return names_list, tables.fixture_rows(teams)
+
     def invoke(self, inputs, config):
             with callbacks.collect_runs() as cb:
-                inputs["names_list"] = self.name_list
-                inputs["fixtures"] = self.fixtures
+                inputs["names_list"], inputs["fixtures"] = self.get_candidates(inputs["customer_input"])
                                 
                 result = self.chain.invoke(inputs, config=config)
                 
-                return result
\ No newline at end of file
+                return result
+
+    def stream(self, inputs, config=None, **kwargs):
+            """Yield the answer chunk by chunk as the model writes it."""
+            inputs["names_list"], inputs["fixtures"] = self.get_candidates(inputs["customer_input"])
+            yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+            """Invoke the chain without blocking the event loop, the player tables are read in a thread."""
+            inputs["names_list"], inputs["fixtures"] = await run_in_executor(config, self.get_candidates, inputs["customer_input"])
+            return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+            """Yield the answer as the model writes it without blocking the event loop."""
+            inputs["names_list"], inputs["fixtures"] = await run_in_executor(config, self.get_candidates, inputs["customer_input"])
+            async for chunk in self.chain.astream(inputs, config=config):
+                yield chunk
\ No newline at end of file
@@ -1,10 +1,11 @@
 from langchain.schema import StrOutputParser
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
-import sqlite3
+from data.lineup_optimizer import SquadPlayer, optimize_lineup, parse_formation
+from data.squad_summary import squad_players
 from langchain import callbacks
 
 class OptimizeLineup(Runnable):
@@ -16,42 +17,28 @@ class OptimizeLineup(Runnable):
 
         self.user_id = user_id
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.name_list = self.query_as_list("""
-            SELECT p.name, p.team, p.position, p.expected_points_next_game
-            FROM players_fantasy p
-            JOIN user_team ut ON p.player_id = ut.player_id
-            WHERE ut.user_id = ? AND ut.on_team = 1
-            ORDER BY p.expected_points_next_game DESC
-        """, user_id= self.user_id)
 
         prompt_template = PromptTemplate(
             system_template=""" 
             You are a part of a company about fantasy football. 
-            Your task is to identify the best players in the users team and tell him how to make the best of them.
-            You choose tell him a tactic to use or simply follow the one he says, to compare players you should focus on the 
-            expected_points_next_game
+            Your task is to tell the user the best lineup for his team and how to make the best of it.
+            The lineup was already chosen for him to get the most expected_points_next_game, you only explain it
 
-            Here is the list all players in the user's team:
-            {names_list}
+            Here is the best lineup for the user's team:
+            {lineup}
             
             Here is the user input:
             {customer_input}
             
             Focus:
-            0. Focus on the values under the expected_points_next_game
-            1. Check if a user defines a tactic he wants you to use if not you choose the one that will yield in most points for his team, by summing the expected_points_next_game of all the players you recommend
+            0. Present exactly the players, formation and expected points of the lineup, don't change or add any player
+            1. If the user asked for a tactic, the lineup already follows it
             2. Tell users the name, team, position, expected points
             3. Be accurate and informal
             4. Don't use bullet points, provide the message as if you were exchanging texts with the user
-            5. You should provide always 11 players, unless the user specifies otherwise, like wanting a specific number of players from a certain position
-            6. The most common tactics asked are 433, which means you need to provide 4 defenders, 3 midfielders and 3 forwards, 442 which means you need to provide 4 defenders, 4 midfielders and 2 forwards and lastly 343 which means you need to provide 3 defenders, 4 midfielders and 3 forwards
-            7. Always provide a goalkeeper
-            6. By default you should suggest 4 defenders, 4 midfielders and 2 forwards
+            5. If there are not enough players to fill the lineup, tell the user which positions he should buy players for
+            6. You can mention the best players on the bench as options if the user asks
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -61,17 +48,39 @@ class OptimizeLineup(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    def query_as_list(self, query, user_id):
+    def get_team(self):
         """
-        Executes the SQL query and formats the result as a list.
+        Retrieve the user's current squad, read on every call so transfers are reflected.
         """
-        cursor = self.db.cursor()
-        cursor.execute(query, (user_id,))
-        res = cursor.fetchall()
-        return res
+        return [SquadPlayer(*row) for row in squad_players(
+            self.user_id, ("player_id", "name", "team", "position", "expected_points_next_game")
+        )]
+
+    def get_lineup(self, customer_input):
+        """
+        Choose the best starting eleven of the squad, in the formation asked by the user if any.
+        """
+        return optimize_lineup(self.get_team(), parse_formation(customer_input))
 
-    
     def invoke(self, inputs, config):
         with callbacks.collect_runs() as cb:
-            inputs["names_list"] = self.name_list
+            inputs["lineup"] = self.get_lineup(inputs["customer_input"]).describe()
             return self.chain.invoke(inputs, config=config)
+
+    def stream(self, inputs, config=None, **kwargs):
+        """Yield the answer chunk by chunk as the model writes it."""
+        inputs["lineup"] = self.get_lineup(inputs["customer_input"]).describe()
+        yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """Invoke the chain without blocking the event loop, the squad is read in a thread."""
+        lineup = await run_in_executor(config, self.get_lineup, inputs["customer_input"])
+        inputs["lineup"] = lineup.describe()
+        return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+        """Yield the answer as the model writes it without blocking the event loop."""
+        lineup = await run_in_executor(config, self.get_lineup, inputs["customer_input"])
+        inputs["lineup"] = lineup.describe()
+        async for chunk in self.chain.astream(inputs, config=config):
+            yield chunk
@@ -1,11 +1,16 @@
-from typing import Type, Optional
+from typing import List, Type, Optional, Union
 from pydantic import BaseModel
 from langchain.tools import BaseTool
 import sqlite3
-from data.loader import get_sqlite_database_path
+from data.connection import get_pool
+from data.transfers import resolve_player_ids
+from data.squad_summary import get_summary, read_summary, squad_players
+from data.snapshot import PlayerDataSnapshot
+from chatbot.chains.lineup_commands import LineupCommand, parse_lineup_commands, squad_index
+from chatbot.chains.responses import Outcome, plain_text, renderer
 from langchain.output_parsers import PydanticOutputParser
-from langchain.prompts import PromptTemplate
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
 from langchain import callbacks
@@ -27,82 +32,157 @@ class PuttingPlayerInStarting11(BaseTool):
     )
     args_schema: Type[BaseModel] = PuttingPlayerInStarting11Input  # Input schema for the tool
     return_direct: bool = True
+    # Database of the squads, get_sqlite_database_path() when not given
+    db_path: Optional[str] = None
 
-    def _run(self, user_id: int, player_name: str, action: Optional[str] = "add") -> str:
-        """Add or remove a player from the starting eleven based on the action."""
-        db_path = get_sqlite_database_path()
-        
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+    def _run(self, user_id: int, player_name: str, action: Optional[str] = "add") -> Union[Outcome, List[Outcome]]:
+        """Add or remove a player from the starting eleven based on the action, benching the captain clears it."""
+        def update(conn):
+            cursor = conn.cursor()
 
-        try:
-            # Step 1: Get the player_id from the player_name
-            cursor.execute("SELECT player_id, name FROM players_fantasy")
-            players = cursor.fetchall()
-            
             if player_name == "Unknown player":
-                return f"You didn't introduce the name of anyone in your team"
-            
-            else:
-                player_id = next(player[0] for player in players if player[1] == player_name)
+                return Outcome("lineup.no_player")
 
-            # Step 2: Check if the player is on the user's team
-            cursor.execute(
-                "SELECT on_team, starting_eleven FROM user_team WHERE user_id = ? AND player_id = ?",
-                (user_id, player_id),
-            )
-            result = cursor.fetchone()
+            # Step 1: Get the player_id from the player_name, an index lookup on the exact or normalized name
+            player_id = resolve_player_ids([player_name], self.db_path).get(player_name)
+            if player_id is None:
+                return Outcome("player.not_found", {"name": player_name})
 
-            on_team, starting_eleven = result
+            # Step 2: Check if the player is on the user's team, from the summary of the squad
+            summary = read_summary(conn, user_id)
+            if summary is None or player_id not in summary.squad:
+                return Outcome("player.not_on_team", {"name": player_name})
+
+            starting_eleven = int(player_id in summary.starting_eleven)
 
             if action == "add":
                 # Step 3: Ensure that no more than 11 players are in the starting eleven
-                cursor.execute(
-                    "SELECT COUNT(*) FROM user_team WHERE user_id = ? AND starting_eleven = 1",
-                    (user_id,)
-                )
-                starting_eleven_count = cursor.fetchone()[0]
-
-                if starting_eleven_count >= 11:
-                    return "Error: You cannot have more than 11 players in the starting eleven."
+                if summary.starters >= 11:
+                    return Outcome("lineup.full")
 
                 # Step 4: If the player is not already in the starting eleven, add them
                 if starting_eleven == 1:
-                    return f"Player '{player_name}' is already in the starting eleven."
+                    return Outcome("lineup.already_starting", {"name": player_name})
 
                 cursor.execute(
                     "UPDATE user_team SET starting_eleven = 1 WHERE user_id = ? AND player_id = ?",
                     (user_id, player_id),
                 )
-                conn.commit()
-                return f"Player '{player_name}' has been successfully added to the starting eleven."
+                return Outcome("lineup.added", {"name": player_name})
 
             elif action == "remove":
                 # Step 5: If removing, ensure the player is in the starting eleven
                 if starting_eleven == 0:
-                    return f"Player '{player_name}' is not in the starting eleven."
+                    return Outcome("lineup.not_starting", {"name": player_name})
 
+                captain = cursor.execute(
+                    "SELECT captain FROM user_team WHERE user_id = ? AND player_id = ?", (user_id, player_id)
+                ).fetchone()[0]
+                # Only a starter can be captain, so benching the captain clears it
                 cursor.execute(
-                    "UPDATE user_team SET starting_eleven = 0 WHERE user_id = ? AND player_id = ?",
+                    "UPDATE user_team SET starting_eleven = 0, captain = 0 WHERE user_id = ? AND player_id = ?",
                     (user_id, player_id),
                 )
-                conn.commit()
-                return f"Player '{player_name}' has been successfully removed from the starting eleven."
+                if captain:
+                    return [Outcome("lineup.removed", {"name": player_name}), Outcome("lineup.captain_cleared")]
+                return Outcome("lineup.removed", {"name": player_name})
 
             else:
-                return "Error: Invalid action. Use 'add' to add a player or 'remove' to remove a player."
+                return Outcome("lineup.invalid_action")
+
+        try:
+            # The checks and the update run in one transaction, so two edits can't both pass the 11 player limit
+            return get_pool(self.db_path).run(update)
+        except sqlite3.OperationalError as e:
+            return Outcome("db.error", {"error": str(e)})
+
+
+    def apply_commands(self, user_id: int, commands: List[LineupCommand]) -> List[Outcome]:
+        """
+        Apply parsed starting eleven commands in one transaction, all of them or none.
+
+        The limit of 11 starters is checked once every command is applied, so "start Saka,
+        bench Havertz" works on a full starting eleven.
+        """
+        def update(conn):
+            summary = read_summary(conn, user_id)
+            if summary is None:
+                return [Outcome("user.not_found", {"user_id": user_id})]
+            squad = set(summary.squad)
+            starters = set(summary.starting_eleven)
+            row = conn.execute("SELECT player_id FROM user_team WHERE user_id = ? AND captain = 1", (user_id,)).fetchone()
+            captain = row[0] if row else None
+            # Set only by a captain command of this batch, an error if that player isn't starting
+            named_captain = None
+            names = {}
+            messages, errors = [], []
+
+            for command in commands:
+                missing = [name for player_id, name in zip(command.player_ids, command.names) if player_id not in squad]
+                if missing:
+                    errors.extend(Outcome("player.not_on_team", {"name": name}) for name in missing)
+                    continue
+                names.update(zip(command.player_ids, command.names))
+                player_id, name = command.player_ids[0], command.names[0]
+
+                if command.action == "add":
+                    if player_id in starters:
+                        messages.append(Outcome("lineup.already_starting", {"name": name}))
+                    else:
+                        starters.add(player_id)
+                        messages.append(Outcome("lineup.added", {"name": name}))
+                elif command.action == "remove":
+                    if player_id not in starters:
+                        messages.append(Outcome("lineup.not_starting", {"name": name}))
+                    else:
+                        starters.discard(player_id)
+                        messages.append(Outcome("lineup.removed", {"name": name}))
+                elif command.action == "swap":
+                    starting = [p for p in command.player_ids if p in starters]
+                    if len(starting) != 1:
+                        errors.append(Outcome("lineup.swap_invalid", {"first": command.names[0], "second": command.names[1]}))
+                        continue
+                    player_out = starting[0]
+                    player_in = next(p for p in command.player_ids if p != player_out)
+                    starters.discard(player_out)
+                    starters.add(player_in)
+                    messages.append(Outcome("lineup.swapped", {"player_in": names[player_in], "player_out": names[player_out]}))
+                elif command.action == "captain":
+                    captain = named_captain = player_id
+                    messages.append(Outcome("lineup.captain", {"name": name}))
+
+            if len(starters) > 11:
+                errors.append(Outcome("lineup.full"))
+            if captain is not None and captain not in starters:
+                if captain == named_captain:
+                    errors.append(Outcome("lineup.captain_not_starting", {"name": names[captain]}))
+                else:
+                    # The captain was benched by these commands
+                    captain = None
+                    messages.append(Outcome("lineup.captain_cleared"))
+            if errors:
+                return errors + [Outcome("lineup.unchanged")]
+
+            conn.executemany(
+                "UPDATE user_team SET starting_eleven = ? WHERE user_id = ? AND player_id = ?",
+                [(1, user_id, p) for p in starters - set(summary.starting_eleven)]
+                + [(0, user_id, p) for p in set(summary.starting_eleven) - starters],
+            )
+            # Cleared before it is set, the index allows one captain per user at any time
+            conn.execute("UPDATE user_team SET captain = 0 WHERE user_id = ? AND captain = 1", (user_id,))
+            if captain is not None:
+                conn.execute("UPDATE user_team SET captain = 1 WHERE user_id = ? AND player_id = ?", (user_id, captain))
+            return messages
 
+        try:
+            return get_pool(self.db_path).run(update)
         except sqlite3.OperationalError as e:
-            return f"Error: {str(e)}"
-        finally:
-            cursor.close()
-            conn.close()
+            return [Outcome("db.error", {"error": str(e)})]
 
 
 class PlayerInStarting11ChainExecutor(Runnable):
     """Chain that gets the information needed for the tool to work and allows the tool to work"""    
-    def __init__(self, llm, user_id, memory=False):
+    def __init__(self, llm, user_id, memory=False, snapshot=None):
         """Initialize the player in starting 11 executor chain."""
 
         super().__init__()
@@ -110,15 +190,11 @@ class PlayerInStarting11ChainExecutor(Runnable):
         self.tool = PuttingPlayerInStarting11()
         self.user_id = user_id
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.name_list = self.query_as_list("""
-            SELECT p.name, p.team, p.position, p.expected_points_next_game
-            FROM players_fantasy p
-            JOIN user_team ut ON p.player_id = ut.player_id
-            WHERE ut.user_id = ? AND ut.on_team = 1
-            ORDER BY p.expected_points_next_game DESC
-        """, user_id= self.user_id)
+        # The name index of every player is shared by all users, reuse the process snapshot when given
+        self.snapshot = snapshot or PlayerDataSnapshot()
+        # Messages parsed locally and by the model, to measure the calls saved
+        self.local_parses = 0
+        self.model_parses = 0
 
         prompt_template = PromptTemplate(
             system_template=""" 
@@ -148,21 +224,35 @@ class PlayerInStarting11ChainExecutor(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    def query_as_list(self, query, user_id):
+    def get_team(self):
         """
-        Executes the SQL query and formats the result as a list.
+        Retrieve the players in the user's squad as they are right now.
         """
-        cursor = self.db.cursor()
-        cursor.execute(query, (user_id,))
-        res = cursor.fetchall()
-        return res
+        return squad_players(self.user_id, ("name", "team", "position", "expected_points_next_game"))
     
-    def invoke(self, user_input) -> str:
+    def parse_locally(self, customer_input):
+        """
+        Parse the commands of the message against the user's squad, None when the model is needed.
+        """
+        summary = get_summary(self.user_id)
+        if summary is None:
+            return None
+        player_index = self.snapshot.player_index
+        return parse_lineup_commands(customer_input, squad_index(player_index, summary.squad), player_index)
+
+    def invoke(self, user_input) -> Union[Outcome, List[Outcome]]:
+        # Commands with clear names and verbs are applied without asking the model
+        commands = self.parse_locally(user_input["customer_input"])
+        if commands is not None:
+            self.local_parses += 1
+            return self.tool.apply_commands(self.user_id, commands)
+
         # Extract inputs from the user input string
+        self.model_parses += 1
         inputs = self.chain.invoke(
             {
                 "customer_input": user_input["customer_input"],
-                "names_list": self.name_list,
+                "names_list": self.get_team(),
                 "format_instructions": self.format_instructions,
             },)
         
@@ -171,18 +261,35 @@ class PlayerInStarting11ChainExecutor(Runnable):
 
         # Return the result of the operation
         return result 
+
+    async def ainvoke(self, user_input, config=None, **kwargs) -> Union[Outcome, List[Outcome]]:
+        """Like invoke, with the squad read and the starting eleven written in a thread."""
+        commands = await run_in_executor(None, self.parse_locally, user_input["customer_input"])
+        if commands is not None:
+            self.local_parses += 1
+            return await run_in_executor(None, self.tool.apply_commands, self.user_id, commands)
+
+        self.model_parses += 1
+        inputs = await self.chain.ainvoke(
+            {
+                "customer_input": user_input["customer_input"],
+                "names_list": await run_in_executor(None, self.get_team),
+                "format_instructions": self.format_instructions,
+            },)
+        return await run_in_executor(None, self.tool._run, user_id=self.user_id, player_name=inputs.player_name, action=inputs.action)
     
 class PlayerInStarting11ChainFinal(Runnable):
     """Chain that generates a message telling the user if his change in the starting team was successful or not"""    
-    def __init__(self, llm, user_id, memory=True):
-        """Initialize the player in starting 11 final chain."""
+    def __init__(self, llm, user_id, memory=True, snapshot=None, rephrase=False):
+        """Initialize the player in starting 11 final chain, the model rewrites the reply only if rephrase is set."""
 
         super().__init__()
 
         self.user_id = user_id
         self.llm = llm
+        self.rephrase = rephrase
         
-        self.chain_helper = PlayerInStarting11ChainExecutor(user_id=self.user_id, llm = self.llm)
+        self.chain_helper = PlayerInStarting11ChainExecutor(user_id=self.user_id, llm = self.llm, snapshot=snapshot)
 
         prompt_template = PromptTemplate(
             system_template=""" 
@@ -199,8 +306,6 @@ class PlayerInStarting11ChainFinal(Runnable):
             1. Rewrite the output so it's more user understandable
             2. Be friendly and informative
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -211,10 +316,45 @@ class PlayerInStarting11ChainFinal(Runnable):
         self.chain = self.prompt | self.llm | self.output_parser
         
     def invoke(self, inputs, config):
-            output = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            outcomes = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                # The reply is filled from templates, without a second call to the model
+                inputs["outcomes"] = outcomes
+                return renderer.invoke(inputs, config=config)
             with callbacks.collect_runs() as cb:
-                inputs["output"] = output
+                inputs["output"] = plain_text(outcomes)
                                 
                 result = self.chain.invoke(inputs, config=config)
                 
                 return result
+
+    def stream(self, inputs, config=None, **kwargs):
+            """Yield the reply, in one piece when it is written from the templates."""
+            outcomes = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcomes
+                yield from renderer.stream(inputs, config=config)
+                return
+            inputs["output"] = plain_text(outcomes)
+            yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+            """Invoke the chain without blocking the event loop."""
+            outcomes = await self.chain_helper.ainvoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcomes
+                return await renderer.ainvoke(inputs, config=config)
+            inputs["output"] = plain_text(outcomes)
+            return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+            """Yield the reply without blocking the event loop, in one piece when it is written from the templates."""
+            outcomes = await self.chain_helper.ainvoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcomes
+                async for chunk in renderer.astream(inputs, config=config):
+                    yield chunk
+                return
+            inputs["output"] = plain_text(outcomes)
+            async for chunk in self.chain.astream(inputs, config=config):
+                yield chunk
@@ -1,42 +1,126 @@
 import os
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.schema.runnable.base import Runnable
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from pinecone import Pinecone
-from langchain_pinecone import PineconeVectorStore
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
 from langchain import callbacks
 
 
+# Up to 2 documents with a relevance score of at least 0.5, the same for every backend
+SEARCH_KWARGS = {"k": 2, "score_threshold": 0.5}
+RETRIEVER_BACKENDS = ("local", "pinecone")
+PINECONE_EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def build_pinecone_index():
+    """
+    Connect to the Pinecone index with the fantasy rules and company documents.
+
+    Returns:
+        The Pinecone Index "capstone-project".
+    """
+    from pinecone import Pinecone
+
+    # Load environment variables
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # Initialize Pinecone
+    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    index_name = "capstone-project"
+    pinecone_client = Pinecone(api_key=pinecone_api_key, environment="us-east-1")
+    return pinecone_client.Index(index_name)
+
+
+def build_pinecone_store(index=None):
+    """
+    Build the vector store over the Pinecone index with the fantasy rules and company documents.
+
+    Args:
+        index (optional): The Pinecone Index, `build_pinecone_index()` if not given.
+
+    Returns:
+        PineconeVectorStore embedding the questions with the OpenAI embeddings.
+    """
+    from langchain_openai import OpenAIEmbeddings
+    from langchain_pinecone import PineconeVectorStore
+
+    index = index or build_pinecone_index()
+    api_key = os.getenv("api_key")
+
+    # Create a vector store for document retrieval
+    return PineconeVectorStore(
+        index=index,
+        embedding=OpenAIEmbeddings(api_key= api_key, model=PINECONE_EMBEDDING_MODEL),
+    )
+
+
+def build_pinecone_retriever():
+    """
+    Build the retriever over the Pinecone index with the fantasy rules and company documents.
+
+    Returns:
+        A retriever returning up to 2 documents with a similarity score of at least 0.5.
+    """
+    return build_pinecone_store().as_retriever(
+        search_type="similarity_score_threshold",
+        search_kwargs=SEARCH_KWARGS,
+    )
+
+
+def build_local_retriever(encoder=None, embed_query=None):
+    """
+    Build the retriever over the local index of the PDFs in `data/`, built by `python -m chatbot.document_index`.
+
+    Args:
+        encoder (optional): Encoder of the questions, the MiniLM of the router if not given.
+        embed_query (optional): Embeds the questions instead of the encoder.
+
+    Returns:
+        A retriever returning up to 2 documents with a similarity score of at least 0.5.
+    """
+    from chatbot.document_index import load_document_index
+
+    return load_document_index(encoder, embed_query).as_retriever(
+        search_type="similarity_score_threshold",
+        search_kwargs=SEARCH_KWARGS,
+    )
+
+
+def build_retriever(backend=None, encoder=None, embed_query=None):
+    """
+    Build the retriever of the RAG chains.
+
+    Args:
+        backend (str, optional): "local" or "pinecone", the `RETRIEVER_BACKEND` environment variable or "pinecone" if not given.
+        encoder (optional): Encoder of the local backend.
+        embed_query (optional): Embeds the questions of the local backend.
+
+    Returns:
+        A retriever returning up to 2 documents with a similarity score of at least 0.5.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    backend = backend or os.getenv("RETRIEVER_BACKEND", "pinecone")
+    if backend == "local":
+        return build_local_retriever(encoder, embed_query)
+    if backend == "pinecone":
+        return build_pinecone_retriever()
+    raise ValueError(f"Unknown retriever backend '{backend}', expected one of {RETRIEVER_BACKENDS}.")
+
+
 class RAGChatBot(Runnable):
     """Chain that generates a response to customer queries about Ball IQ, the company or about specific stats and fantasy points (the pdfs used have information related to this)."""
-    def __init__(self, llm, memory=True):
+    def __init__(self, llm, memory=True, retriever=None):
         """Initialize the rag chatbot chain."""
 
         super().__init__()
 
-        # Load environment variables
-        from dotenv import load_dotenv
-        load_dotenv()
-
-        # Initialize Pinecone
-        pinecone_api_key = os.getenv("PINECONE_API_KEY")
-        self.index_name = "capstone-project"
-        self.pinecone_client = Pinecone(api_key=pinecone_api_key, environment="us-east-1")
-        self.index = self.pinecone_client.Index(self.index_name)
-        api_key = os.getenv("api_key")
-
-        # Create a vector store for document retrieval
-        self.vector_store = PineconeVectorStore(
-            index=self.index,
-            embedding=OpenAIEmbeddings(api_key= api_key, model="text-embedding-3-small"),
-        )
-        self.retriever = self.vector_store.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={"k": 2, "score_threshold": 0.5},
-        )
+        # The retriever holds the index and the embeddings, reuse a shared one when given
+        self.retriever = retriever or build_retriever()
 
         # Define the RAG prompt template
         prompt_template = PromptTemplate(
@@ -48,10 +132,7 @@ class RAGChatBot(Runnable):
             {context}
 
             User Question:
-            {customer_input}
-
-            Chat History:
-            {chat_history}""",
+            {customer_input}""",
             human_template="Customer Query: {customer_input}",
         )
 
@@ -77,3 +158,25 @@ class RAGChatBot(Runnable):
             inputs["context"] = self.format_docs(self.retriever.invoke(inputs["customer_input"])) 
             result = self.chain.invoke(inputs, config=config)
             return result
+
+    def stream(self, inputs, config=None, **kwargs):
+        """
+        Process the user query through the RAG chain, yielding the answer as the model writes it.
+        """
+        inputs["context"] = self.format_docs(self.retriever.invoke(inputs["customer_input"]))
+        yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """
+        Process the user query through the RAG chain without blocking the event loop.
+        """
+        inputs["context"] = self.format_docs(await self.retriever.ainvoke(inputs["customer_input"]))
+        return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+        """
+        Process the user query through the RAG chain, yielding the answer as the model writes it.
+        """
+        inputs["context"] = self.format_docs(await self.retriever.ainvoke(inputs["customer_input"]))
+        async for chunk in self.chain.astream(inputs, config=config):
+            yield chunk
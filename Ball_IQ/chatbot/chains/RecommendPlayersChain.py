@@ -1,64 +1,63 @@
 from langchain.output_parsers import PydanticOutputParser
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
-import sqlite3
+from data.snapshot import PlayerDataSnapshot
+from data.squad_summary import get_summary, squad_players
+from chatbot.chains.recommend_filter import extract_constraints, query_candidates
+import re
 from langchain import callbacks
 from langchain.schema import StrOutputParser
 
 
+# Requests to replace a given player of the squad rather than to add new ones
+SWAP_PATTERN = re.compile(r"\b(swap|replace|replacement|instead of|sell|upgrade|substitute)\b", re.IGNORECASE)
+# Players recommended when the user doesn't say how many he wants
+DEFAULT_COUNT = 3
+
 
 class RecommendPlayers(Runnable):
     """Chain that generates a response to customer queries about recommending players to his team."""
-    def __init__(self, llm, user_id, memory=True):
+    def __init__(self, llm, user_id, memory=True, snapshot=None):
         """Initialize the recommend players chain."""
 
         super().__init__()
 
         self.user_id = user_id
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.name_list = self.query_as_list("""
-            SELECT p.name
-            FROM players_fantasy p
-            JOIN user_team ut ON p.player_id = ut.player_id
-            WHERE ut.user_id = ? AND ut.on_team = 1
-        """, user_id= self.user_id)
-        self.all_players_names = self.query_as_list_all_names("""SELECT p.name, p.team, p.position, p.price, p.expected_points_next_game 
-                                                            FROM players_fantasy p""")
+        # The name index is shared by every user, reuse the process snapshot when given
+        self.snapshot = snapshot or PlayerDataSnapshot()
 
         prompt_template = PromptTemplate(
             system_template=""" 
             You are a part of a company about fantasy football. 
-            Your task is to recommend players to the user, to recommend take into consideration the expected_points_next_game
-            You should not recommend players that already are in the users team and be careful with budget constraints made by the user
+            Your task is to recommend players to the user, the players were already chosen to get the most expected_points_next_game
+            without going over the budget and respecting the positions and number of players he asked for, you only present them
 
             Here is the list all players in the user's team:
             {names_list}
             
-            Here are all the players and their info about expected_points_next_game, and price:
+            Here is the recommendation for the user:
+            {recommendation}
+
+            Here are other good players that are not in the user's team and match the request, with their info about expected_points_next_game, and price:
             {all_players}
+
+            Here are the constraints found in the request:
+            {constraints}
             
             Here is the customer input:
             {customer_input}
             
             Focus:
-            0. In order to make the best recommendations focus on recommending the players with more expected_points_next_game
-            1. Do not recommend already in the users team
-            2. Be careful with user budget restrictions, the sum of the price of the recommended players should not be above the budget
-            3. Be careful with user number of players recommended, only recommend the number he asks for
-            4. By default recommend two or three players
-            5. Be careful with position restrictions, if a user defines a position he wants you should respect it
-            6. In the output be sure to mention, the player's name, price, team, position and expected_points_next_game
-            7. Be informal and think like you are exchanging texts with the user
-            8. Only recommend players that are in the all players list
-            9. The information provided should be done fully following the information provided in the section: all the players and their info about expected_points_next_game, and price:
-            10. The  Expected Points Next Game should be the number under the column expected_points_next_game
-            Chat History:
-            {chat_history}
+            0. Recommend exactly the players of the recommendation, only mention the other good players as alternatives
+            1. If the recommendation has swaps for a player of the user's team, present the best swap and the points it gains
+            2. If no combination fits the budget, tell the user and suggest raising the budget or asking for fewer players
+            3. In the output be sure to mention, the player's name, price, team, position and expected_points_next_game
+            4. Be informal and think like you are exchanging texts with the user
+            5. The  Expected Points Next Game should be the number under the column expected_points_next_game
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -69,25 +68,82 @@ class RecommendPlayers(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    def query_as_list(self, query, user_id):
+    def get_team(self):
+        """
+        Retrieve the names currently in the user's squad.
+        """
+        return squad_players(self.user_id)
+
+    def get_candidates(self, customer_input):
+        """
+        Retrieve the best players outside the user's squad that respect the position, budget and exclusions of the request.
+        """
+        constraints = extract_constraints(customer_input, self.snapshot.player_index)
+        return constraints, query_candidates(self.user_id, constraints)
+
+    def get_recommendation(self, customer_input, constraints):
         """
-        Executes the SQL query and formats the result as a list.
+        Choose the players to buy within the budget, or the best swaps when the user wants to replace a player of his squad.
         """
-        cursor = self.db.cursor()
-        cursor.execute(query, (user_id,))
-        res = cursor.fetchall()
-        return res
-    
-    def query_as_list_all_names(self, query):
-        """Retrieve a query as a list"""
-        cursor = self.db.cursor()
-        cursor.execute(query)
-        res = cursor.fetchall()
-        return list(set(res))
-
-    
+        # Squad and budget come from one read of the user's squad summary
+        summary = get_summary(self.user_id)
+        squad_ids = summary.squad if summary else []
+        budget = summary.budget if summary else 0.0
+        # The user may want to spend less than he has, never more
+        if constraints.budget is not None:
+            budget = min(budget, constraints.budget)
+
+        tables = self.snapshot.tables
+        recommender = tables.transfer_recommender
+        if SWAP_PATTERN.search(customer_input):
+            mentioned = [match.player_id for match in tables.player_index.search(customer_input)]
+            in_squad = [player_id for player_id in mentioned if player_id in squad_ids]
+            if in_squad:
+                player_out = recommender.players[recommender.row_by_id[in_squad[0]]]
+                swaps = recommender.best_swaps(in_squad[0], budget, exclude=squad_ids + constraints.excluded_ids)
+                if not swaps:
+                    return f"No player of the same position as {player_out.name} fits the budget of {budget:g}."
+                return f"Best swaps for {player_out.name} ({player_out.position}, {player_out.expected_points:g} expected points):\n" + "\n".join(
+                    f"{swap.player_in.name}, {swap.player_in.team}, price {swap.player_in.price:g}, "
+                    f"{swap.player_in.expected_points:g} expected points, gains {swap.points_gained:g}, budget left {swap.budget_left:g}"
+                    for swap in swaps
+                )
+
+        return recommender.recommend(
+            budget,
+            count=constraints.count or DEFAULT_COUNT,
+            positions=constraints.positions,
+            position_counts=constraints.position_counts or None,
+            exclude=squad_ids + constraints.excluded_ids,
+            max_price=constraints.max_price,
+        ).describe()
+
+    def prepare_inputs(self, inputs):
+        """
+        Add the squad, the recommendation and the candidates to the inputs of the prompt.
+        """
+        constraints, candidates = self.get_candidates(inputs["customer_input"])
+        inputs["names_list"] = self.get_team()
+        inputs["recommendation"] = self.get_recommendation(inputs["customer_input"], constraints)
+        inputs["all_players"] = candidates
+        inputs["constraints"] = constraints.describe()
+        return inputs
+
     def invoke(self, inputs, config):
         with callbacks.collect_runs() as cb:
-                inputs["names_list"] = self.name_list
-                inputs["all_players"] = self.all_players_names
-                return self.chain.invoke(inputs, config=config)
+                return self.chain.invoke(self.prepare_inputs(inputs), config=config)
+
+    def stream(self, inputs, config=None, **kwargs):
+        """Yield the answer chunk by chunk as the model writes it."""
+        yield from self.chain.stream(self.prepare_inputs(inputs), config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """Invoke the chain without blocking the event loop, the candidates are queried in a thread."""
+        inputs = await run_in_executor(config, self.prepare_inputs, inputs)
+        return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+        """Yield the answer as the model writes it without blocking the event loop."""
+        inputs = await run_in_executor(config, self.prepare_inputs, inputs)
+        async for chunk in self.chain.astream(inputs, config=config):
+            yield chunk
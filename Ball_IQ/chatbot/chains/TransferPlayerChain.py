@@ -2,9 +2,13 @@ from typing import Type, Optional, Dict
 from pydantic import BaseModel
 from langchain.tools import BaseTool
 import sqlite3
-from data.loader import get_sqlite_database_path
+from data.transfers import Transfer, TransferError, execute_transfers, resolve_player_ids
+from data.snapshot import PlayerDataSnapshot
+from data.squad_summary import squad_players
+from chatbot.chains.responses import Outcome, plain_text, renderer
 from langchain.output_parsers import PydanticOutputParser
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
 from langchain import callbacks
@@ -26,165 +30,41 @@ class TransferPlayerTool(BaseTool):
     args_schema: Type[BaseModel] = TransferPlayerInput
     return_direct: bool = True
 
-    def _run(user_id: int, player_out_name: Optional[str], player_in_name: str) -> str:
-        db_path = get_sqlite_database_path()
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+    def _run(user_id: int, player_out_name: Optional[str], player_in_name: str) -> Outcome:
+        # Names are only used to find the players, the transfer itself works on player ids
+        player_ids = resolve_player_ids([name for name in (player_out_name, player_in_name) if name])
+        if player_out_name and player_out_name not in player_ids:
+            return Outcome("player.not_found", {"name": player_out_name})
+        if player_in_name not in player_ids:
+            return Outcome("player.not_found", {"name": player_in_name})
 
+        transfer = Transfer(player_ids.get(player_out_name), player_ids[player_in_name])
         try:
-            # Get the user's current budget
-            cursor.execute(
-                "SELECT budget FROM users WHERE user_id = ?",
-                (user_id,),
-            )
-            user_budget = cursor.fetchone()
-            if user_budget is None:
-                return f"Your user does not exist."
-            user_budget = user_budget[0]
-
-            if player_out_name:
-                # Handle player out
-                # Get the price of the outgoing player
-                cursor.execute(
-                    "SELECT player_id, price FROM players_fantasy WHERE name = ?",
-                    (player_out_name,),
-                )
-                player_out_data = cursor.fetchone()
-                if player_out_data is None:
-                    return f"{player_out_name}' does not exist in the fantasy player list."
-                player_out_id, player_out_price = player_out_data
-
-                # Validate that the outgoing player is on the user's team
-                cursor.execute(
-                    "SELECT player_id FROM user_team WHERE user_id = ? AND player_id = ? AND on_team = 1",
-                    (user_id, player_out_id),
-                )
-                if cursor.fetchone() is None:
-                    return f"'{player_out_name}' is not currently on your team."
-
-                # Calculate the net budget impact of the transfer
-                cursor.execute(
-                    "SELECT price FROM players_fantasy WHERE name = ?",
-                    (player_in_name,),
-                )
-                player_in_data = cursor.fetchone()
-                if player_in_data is None:
-                    return f"'{player_in_name}' does not exist in the fantasy player list."
-                player_in_price = player_in_data[0]
-
-                budget_after_transfer = user_budget + player_out_price - player_in_price
-
-                # Validate that the user can afford the incoming player
-                if budget_after_transfer < 0:
-                    return (
-                        f"Insufficient budget to add '{player_in_name}' to the team. "
-                        f"Your budget is after selling is {(user_budget + player_out_price):.2f} and the player costs {player_in_price:.2f}."
-                    )
-
-                # Remove the outgoing player (set on_team and starting_eleven to 0)
-                cursor.execute(
-                    "UPDATE user_team SET on_team = 0, starting_eleven = 0 WHERE user_id = ? AND player_id = ?",
-                    (user_id, player_out_id),
-                )
-            else:
-                # If no player_out_name is provided, just add the incoming player
-                # Check if the user already has 15 players on the team
-                cursor.execute(
-                    "SELECT COUNT(*) FROM user_team WHERE user_id = ? AND on_team = 1",
-                    (user_id,),
-                )
-                on_team_count = cursor.fetchone()[0]
-                if on_team_count >= 15:
-                    return f"Cannot add '{player_in_name}' to the team. You already have 15 players on your team."
-
-                # Calculate the net budget impact of the transfer
-                cursor.execute(
-                    "SELECT price FROM players_fantasy WHERE name = ?",
-                    (player_in_name,),
-                )
-                player_in_data = cursor.fetchone()
-                if player_in_data is None:
-                    return f"Player '{player_in_name}' does not exist in the fantasy player list."
-                player_in_price = player_in_data[0]
-
-                budget_after_transfer = user_budget - player_in_price
-
-                # Validate that the user can afford the incoming player
-                if budget_after_transfer < 0:
-                    return (
-                        f"Insufficient budget to add '{player_in_name}' to the team. "
-                        f"Your current budget is {user_budget:.2f}, and the player costs {player_in_price:.2f}."
-                    )
-
-            # Add the incoming player to the team
-            cursor.execute(
-                "SELECT player_id FROM players_fantasy WHERE name = ?",
-                (player_in_name,),
-            )
-            player_in_id = cursor.fetchone()[0]
-
-            # Check if the player is already in the user's team
-            cursor.execute(
-                "SELECT player_id FROM user_team WHERE user_id = ? AND player_id = ?",
-                (user_id, player_in_id),
-            )
-            if cursor.fetchone() is None:
-                cursor.execute(
-                    "INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, 0)",
-                    (user_id, player_in_id),
-                )
-            else:
-                cursor.execute(
-                    "UPDATE user_team SET on_team = 1 WHERE user_id = ? AND player_id = ?",
-                    (user_id, player_in_id),
-                )
-
-            # Update the user's budget
-            cursor.execute(
-                "UPDATE users SET budget = ? WHERE user_id = ?",
-                (budget_after_transfer, user_id),
-            )
-
-            connection.commit()
-
+            result = execute_transfers(user_id, [transfer])
+        except TransferError as e:
+            return Outcome("transfer.refused", {"reason": str(e)})
         except sqlite3.OperationalError as e:
-            return f"An error occurred while processing the transfer: {e}"
-        finally:
-            cursor.close()
-            connection.close()
+            return Outcome("transfer.error", {"error": e})
 
         # Return the result
         if player_out_name:
-            return (
-                f"Player '{player_out_name}' has been removed from your team. "
-                f"Player '{player_in_name}' has been successfully added to the team. "
-                f"Remaining budget: {budget_after_transfer:.2f}"
-            )
+            return Outcome("transfer.done", {"player_out": player_out_name, "player_in": player_in_name, "budget": result.budget_after})
         else:
-            return (
-                f"Player '{player_in_name}' has been successfully added to the team. "
-                f"Remaining budget: {budget_after_transfer:.2f}"
-            )
+            return Outcome("transfer.added", {"player_in": player_in_name, "budget": result.budget_after})
+
 
 class TransferPlayerChain(Runnable):
     """Chain that gets the necessary inputs for the tool from the user query and allows the tool to work."""
 
-    def __init__(self, llm, user_id, memory = False, transfer_tool = TransferPlayerTool):
+    def __init__(self, llm, user_id, memory = False, transfer_tool = TransferPlayerTool, snapshot = None):
         """Initialize the transfer player reasoning chain."""
 
         super().__init__()
         self.transfer_tool = transfer_tool
         self.user_id = user_id
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.name_list = self.query_as_list("""
-            SELECT p.name
-            FROM players_fantasy p
-            JOIN user_team ut ON p.player_id = ut.player_id
-            WHERE ut.user_id = ? AND ut.on_team = 1
-        """, user_id= self.user_id)
-        self.all_players_names = self.query_as_list_all_names("""SELECT p.name FROM players_fantasy p""")
+        # The list of every player is shared by all users, reuse the process snapshot when given
+        self.snapshot = snapshot or PlayerDataSnapshot()
 
         prompt_template = PromptTemplate(
             system_template=""" 
@@ -195,7 +75,7 @@ class TransferPlayerChain(Runnable):
             Here is the list all players in the user's team:
             {names_list}
             
-            Here are all the players names:
+            Here are the players names that match the user input:
             {all_players}
             
             Here is the customer input:
@@ -219,24 +99,23 @@ class TransferPlayerChain(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    def query_as_list(self, query, user_id):
+    def get_team(self):
         """
-        Executes the SQL query and formats the result as a list.
+        Retrieve the names in the user's squad, queried per transfer since the squad changes with each one.
         """
-        cursor = self.db.cursor()
-        cursor.execute(query, (user_id,))
-        res = cursor.fetchall()
-        return res
-    
-    def query_as_list_all_names(self, query):
-        """Retrieve a query as a list"""
-        cursor = self.db.cursor()
-        cursor.execute(query)
-        res = cursor.fetchall()
-        return list(set(res))
+        return squad_players(self.user_id)
 
-    
-    def invoke(self, inputs, config = None) -> str:
+    def get_candidates(self, customer_input):
+        """
+        Retrieve the players whose names look like the ones in the user input, every player if none does.
+        """
+        tables = self.snapshot.tables
+        matches = tables.player_index.search(customer_input)
+        if not matches:
+            return tables.names
+        return [(match.name,) for match in matches]
+
+    def invoke(self, inputs, config = None) -> Outcome:
         """ 
         Validates and executes the transfer using the TransferPlayerTool.
         """ 
@@ -244,13 +123,13 @@ class TransferPlayerChain(Runnable):
         transfer_info = self.chain.invoke(
             {
                 "customer_input": inputs["customer_input"],
-                "names_list": self.name_list,
-                "all_players": self.all_players_names,
+                "names_list": self.get_team(),
+                "all_players": self.get_candidates(inputs["customer_input"]),
                 "format_instructions": self.format_instructions,
             },
         )
         if transfer_info.player_in_name == 'None':
-            return f"You always need to state a player to bring to your team"
+            return Outcome("transfer.no_player_in")
         # Use the TransferPlayerTool to perform the transfer 
         else:
             result = self.transfer_tool._run(user_id=self.user_id, 
@@ -258,18 +137,44 @@ class TransferPlayerChain(Runnable):
                                         player_in_name=transfer_info.player_in_name,)
             return result
 
+    async def ainvoke(self, inputs, config = None, **kwargs) -> Outcome:
+        """
+        Like invoke, with the squad read and the transfer written in a thread.
+        """
+        names_list, all_players = await run_in_executor(
+            None, lambda: (self.get_team(), self.get_candidates(inputs["customer_input"]))
+        )
+        transfer_info = await self.chain.ainvoke(
+            {
+                "customer_input": inputs["customer_input"],
+                "names_list": names_list,
+                "all_players": all_players,
+                "format_instructions": self.format_instructions,
+            },
+        )
+        if transfer_info.player_in_name == 'None':
+            return Outcome("transfer.no_player_in")
+        return await run_in_executor(
+            None,
+            self.transfer_tool._run,
+            user_id=self.user_id,
+            player_out_name=transfer_info.player_out_name,
+            player_in_name=transfer_info.player_in_name,
+        )
+
 class TransferPlayerChainFinal(Runnable):
     """Chain that generates a message to tell if the transfer was successful or not"""
 
-    def __init__(self, llm, user_id, memory=True):
-        """Initialize the transfer player response chain."""
+    def __init__(self, llm, user_id, memory=True, snapshot=None, rephrase=False):
+        """Initialize the transfer player response chain, the model rewrites the reply only if rephrase is set."""
 
         super().__init__()
 
         self.user_id = user_id
         self.llm = llm
+        self.rephrase = rephrase
         
-        self.chain_helper = TransferPlayerChain(user_id=self.user_id, llm = self.llm)
+        self.chain_helper = TransferPlayerChain(user_id=self.user_id, llm = self.llm, snapshot=snapshot)
         
         
 
@@ -288,8 +193,6 @@ class TransferPlayerChainFinal(Runnable):
             1. Rewrite the output so it's more user understandable
             2. Be friendly and informative
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -300,10 +203,45 @@ class TransferPlayerChainFinal(Runnable):
         self.chain = self.prompt | self.llm | self.output_parser
         
     def invoke(self, inputs, config):
-            output = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            outcome = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                # The reply is filled from templates, without a second call to the model
+                inputs["outcomes"] = outcome
+                return renderer.invoke(inputs, config=config)
             with callbacks.collect_runs() as cb:
-                inputs["output"] = output
+                inputs["output"] = plain_text(outcome)
                                 
                 result = self.chain.invoke(inputs, config=config)
                 
                 return result
+
+    def stream(self, inputs, config=None, **kwargs):
+            """Yield the reply, in one piece when it is written from the templates."""
+            outcome = self.chain_helper.invoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcome
+                yield from renderer.stream(inputs, config=config)
+                return
+            inputs["output"] = plain_text(outcome)
+            yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+            """Invoke the chain without blocking the event loop."""
+            outcome = await self.chain_helper.ainvoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcome
+                return await renderer.ainvoke(inputs, config=config)
+            inputs["output"] = plain_text(outcome)
+            return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+            """Yield the reply without blocking the event loop, in one piece when it is written from the templates."""
+            outcome = await self.chain_helper.ainvoke({"customer_input": inputs["customer_input"]})
+            if not self.rephrase:
+                inputs["outcomes"] = outcome
+                async for chunk in renderer.astream(inputs, config=config):
+                    yield chunk
+                return
+            inputs["output"] = plain_text(outcome)
+            async for chunk in self.chain.astream(inputs, config=config):
+                yield chunk
@@ -1,31 +1,23 @@
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 from langchain_community.utilities.sql_database import SQLDatabase
 from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
-import sqlite3
+from data.snapshot import PlayerDataSnapshot
 from langchain import callbacks
 from langchain.schema import StrOutputParser
 
 
 class ViewPlayerStats(Runnable):
     """Chain that generates a response to customer queries about the stats of a certain player."""
-    def __init__(self, llm, memory=True):
+    def __init__(self, llm, memory=True, snapshot=None):
         """Initialize the view players chain."""
         super().__init__()
 
         self.llm = llm
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
-        self.list_stats_players = self.query_as_list_all("""
-                SELECT 
-                    ps.goals, ps.assists, ps.yellow_cards, ps.red_cards, 
-                    ps.penalties_defended, ps.own_goals, ps.clean_sheets, 
-                    ps.saves, ps.starts, ps.penalties_missed, 
-                    pf.price_evolution, pf.form_rank, pf.name
-                FROM player_stats ps
-                INNER JOIN players_fantasy pf ON ps.player_id = pf.player_id""")
+        # Stats are shared by every user, reuse the process snapshot when given
+        self.snapshot = snapshot or PlayerDataSnapshot()
 
         prompt_template = PromptTemplate(
             system_template=""" 
@@ -49,8 +41,6 @@ class ViewPlayerStats(Runnable):
             8. If the user doesn't ask for a specific stat, the stats provided should be 6 out of the 10 that you think are more useful: goals, assists, yellow_cards, red_cards, penalties_defended, own_goals, clean_sheets, saves, starts, penalties_missed, 
             9. These show always: price_evolution, pf.form_rank, this values should be exactly the same as the ones provided in the list all players names and stats
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -60,17 +50,36 @@ class ViewPlayerStats(Runnable):
 
         self.chain = self.prompt | self.llm | self.output_parser
 
-    
-    def query_as_list_all(self, query):
-        """Retrieve a query as a list"""
-        cursor = self.db.cursor()
-        cursor.execute(query)
-        res = cursor.fetchall()
-        return list(set(res))
 
     
+    def get_candidates(self, customer_input):
+        """
+        Retrieve the stats of the players whose names look like the ones in the user input, of every player if none does.
+        """
+        tables = self.snapshot.tables
+        names = {match.name for match in tables.player_index.search(customer_input)}
+        if not names:
+            return tables.all_stats
+        return tables.stats_rows(names)
+
     def invoke(self, inputs, config):
         with callbacks.collect_runs() as cb:
-                inputs["stats_players"] = self.list_stats_players                                
+                inputs["stats_players"] = self.get_candidates(inputs["customer_input"])
                 return self.chain.invoke(inputs, config=config)
 
+    def stream(self, inputs, config=None, **kwargs):
+        """Yield the answer chunk by chunk as the model writes it."""
+        inputs["stats_players"] = self.get_candidates(inputs["customer_input"])
+        yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """Invoke the chain without blocking the event loop, the player tables are read in a thread."""
+        inputs["stats_players"] = await run_in_executor(config, self.get_candidates, inputs["customer_input"])
+        return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+        """Yield the answer as the model writes it without blocking the event loop."""
+        inputs["stats_players"] = await run_in_executor(config, self.get_candidates, inputs["customer_input"])
+        async for chunk in self.chain.astream(inputs, config=config):
+            yield chunk
+
@@ -2,10 +2,12 @@ from typing import Type, Optional
 from pydantic import BaseModel, Field
 from langchain.tools import BaseTool
 from langchain.schema.runnable.base import Runnable
+from langchain_core.runnables.config import run_in_executor
 import sqlite3
-from data.loader import get_sqlite_database_path
+from data.connection import get_pool
 from langchain.output_parsers import PydanticOutputParser
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
+from chatbot.chains.responses import Outcome, plain_text, renderer
 from langchain_openai import ChatOpenAI
 from langchain import callbacks
 from langchain.schema import StrOutputParser
@@ -26,22 +28,15 @@ class ViewPointsTool(BaseTool):
     args_schema: Type[BaseModel] = PointsInput
     
 
-    def _run(self, user_id: int) -> str:
-        db_path = get_sqlite_database_path()
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+    def _run(self, user_id: int) -> Outcome:
         try:
-            cursor.execute("SELECT points FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+            result = get_pool().fetch_one("SELECT points FROM users WHERE user_id = ?", (user_id,))
             if result is None:
-                return f"Error: User with ID {user_id} does not exist."
+                return Outcome("user.not_found", {"user_id": user_id})
             points = result[0]
-            return f"User {user_id} currently has {points} points."
+            return Outcome("points.view", {"user_id": user_id, "points": points})
         except sqlite3.OperationalError as e:
-            return f"Error: {str(e)}"
-        finally:
-            cursor.close()
-            connection.close()
+            return Outcome("db.error", {"error": str(e)})
 
 # Tool 2: Update Points Tool
 class UpdatePointsTool(BaseTool):
@@ -50,21 +45,17 @@ class UpdatePointsTool(BaseTool):
     args_schema: Type[BaseModel] = PointsInput
     
 
-    def _run(self, user_id: int, new_points: int) -> str:
-        db_path = get_sqlite_database_path()
-        connection = sqlite3.connect(db_path)
-        cursor = connection.cursor()
+    def _run(self, user_id: int, new_points: int) -> Outcome:
+        def update(connection):
+            cursor = connection.execute("UPDATE users SET points = ? WHERE user_id = ?", (new_points, user_id))
+            return cursor.rowcount
+
         try:
-            cursor.execute("UPDATE users SET points = ? WHERE user_id = ?", (new_points, user_id))
-            if cursor.rowcount == 0:
-                return f"Error: User with ID {user_id} does not exist."
-            connection.commit()
-            return f"Successfully updated user {user_id}'s points to {new_points}."
+            if get_pool().run(update) == 0:
+                return Outcome("user.not_found", {"user_id": user_id})
+            return Outcome("points.updated", {"user_id": user_id, "points": new_points})
         except sqlite3.OperationalError as e:
-            return f"Error: {str(e)}"
-        finally:
-            cursor.close()
-            connection.close()
+            return Outcome("db.error", {"error": str(e)})
 
 # Runnable Setup
 class PointsRunnableReasoning(Runnable):
@@ -106,13 +97,22 @@ class PointsRunnableReasoning(Runnable):
                 "customer_input": user_input["customer_input"],
                 "format_instructions": self.format_instructions,
             },)
+
+    async def ainvoke(self, user_input, config=None, **kwargs):
+        """Extract the action and the points without blocking the event loop."""
+        return await self.chain.ainvoke(
+            {
+                "customer_input": user_input["customer_input"],
+                "format_instructions": self.format_instructions,
+            },)
 class PointsRunnableResponse(Runnable):
         """Chain that tells the user their point or if the update was successful."""
 
-        def __init__(self, llm, user_id, memory=True):
-            """Initialize the product information response chain."""
+        def __init__(self, llm, user_id, memory=True, rephrase=False):
+            """Initialize the product information response chain, the model rewrites the reply only if rephrase is set."""
             super().__init__()
             self.user_id = user_id
+            self.rephrase = rephrase
             self.view_points_tool = ViewPointsTool()
             self.update_points_tool = UpdatePointsTool()
             self.llm = llm
@@ -132,8 +132,6 @@ class PointsRunnableResponse(Runnable):
             1. Be friendly and informative
             2. Be informal
 
-            Chat History:
-            {chat_history}
             """,
             human_template="Output of tool: {output_of_tool}",
         )
@@ -144,18 +142,62 @@ class PointsRunnableResponse(Runnable):
             # Chain to combine the prompt with LLM processing
             self.chain = self.prompt | self.llm | self.output_parser
 
-        def invoke(self, inputs, config):
-                """Invoke the product information response chain."""
+        def run_tool(self, inputs) -> Outcome:
+                """View or update the points as the user asked."""
                 results = self.reasoning_chain.invoke({"customer_input": inputs["customer_input"]})
                 if results.action == "view":
-                    tool_output = self.view_points_tool._run(user_id=self.user_id)
-                    with callbacks.collect_runs() as cb:
-                        inputs["output_of_tool"] = tool_output
-                        return self.chain.invoke(inputs, config=config)
-                    
+                    return self.view_points_tool._run(user_id=self.user_id)
                 elif results.action == "update":
-                    tool_output = self.update_points_tool._run(user_id=self.user_id, new_points= results.points)
-                    with callbacks.collect_runs() as cb:
-                        inputs["output_of_tool"] = tool_output
-                        return self.chain.invoke(inputs, config=config)
-    
+                    return self.update_points_tool._run(user_id=self.user_id, new_points= results.points)
+                return Outcome("points.invalid_action")
+
+        async def arun_tool(self, inputs) -> Outcome:
+                """Like run_tool, with the points read or written in a thread."""
+                results = await self.reasoning_chain.ainvoke({"customer_input": inputs["customer_input"]})
+                if results.action == "view":
+                    return await run_in_executor(None, self.view_points_tool._run, user_id=self.user_id)
+                elif results.action == "update":
+                    return await run_in_executor(None, self.update_points_tool._run, user_id=self.user_id, new_points=results.points)
+                return Outcome("points.invalid_action")
+
+        def invoke(self, inputs, config):
+                """Invoke the product information response chain."""
+                tool_output = self.run_tool(inputs)
+                if not self.rephrase:
+                    # The reply is filled from templates, without a second call to the model
+                    inputs["outcomes"] = tool_output
+                    return renderer.invoke(inputs, config=config)
+                with callbacks.collect_runs() as cb:
+                    inputs["output_of_tool"] = plain_text(tool_output)
+                    return self.chain.invoke(inputs, config=config)
+
+        def stream(self, inputs, config=None, **kwargs):
+                """Yield the reply, in one piece when it is written from the templates."""
+                tool_output = self.run_tool(inputs)
+                if not self.rephrase:
+                    inputs["outcomes"] = tool_output
+                    yield from renderer.stream(inputs, config=config)
+                    return
+                inputs["output_of_tool"] = plain_text(tool_output)
+                yield from self.chain.stream(inputs, config=config)
+
+        async def ainvoke(self, inputs, config=None, **kwargs):
+                """Invoke the chain without blocking the event loop."""
+                tool_output = await self.arun_tool(inputs)
+                if not self.rephrase:
+                    inputs["outcomes"] = tool_output
+                    return await renderer.ainvoke(inputs, config=config)
+                inputs["output_of_tool"] = plain_text(tool_output)
+                return await self.chain.ainvoke(inputs, config=config)
+
+        async def astream(self, inputs, config=None, **kwargs):
+                """Yield the reply without blocking the event loop, in one piece when it is written from the templates."""
+                tool_output = await self.arun_tool(inputs)
+                if not self.rephrase:
+                    inputs["outcomes"] = tool_output
+                    async for chunk in renderer.astream(inputs, config=config):
+                        yield chunk
+                    return
+                inputs["output_of_tool"] = plain_text(tool_output)
+                async for chunk in self.chain.astream(inputs, config=config):
+                    yield chunk
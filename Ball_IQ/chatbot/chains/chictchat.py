@@ -3,7 +3,6 @@ from langchain.schema.runnable.base import Runnable
 from pydantic import BaseModel
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
 from langchain import callbacks
 from langchain.schema import StrOutputParser
 
@@ -34,8 +33,6 @@ class Chitchat(Runnable):
             4. Try to ask the user to ask for things related to EPL fantasy football as that is what you are designed to answer
             
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -49,3 +46,16 @@ class Chitchat(Runnable):
         with callbacks.collect_runs() as cb:
             return self.chain.invoke(inputs, config=config)
 
+    def stream(self, inputs, config=None, **kwargs):
+        """Yield the answer chunk by chunk as the model writes it."""
+        yield from self.chain.stream(inputs, config=config)
+
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """Invoke the chain without blocking the event loop."""
+        return await self.chain.ainvoke(inputs, config=config)
+
+    async def astream(self, inputs, config=None, **kwargs):
+        """Yield the answer as the model writes it without blocking the event loop."""
+        async for chunk in self.chain.astream(inputs, config=config):
+            yield chunk
+
@@ -0,0 +1,167 @@
+"""
+Local parsing of starting eleven commands.
+
+A message such as "start Salah and Palmer, bench Havertz" is split into clauses, each
+clause gets its action from its verb (or from the clause before it), and the names in it
+are matched against the user's squad only, so "Son" or "Gabriel" can't be confused with a
+player of another squad. Names that match no player of the squad are looked up among
+every player, to tell the user that player is not on their team.
+
+When a message can't be parsed with confidence, `parse_lineup_commands` returns None and
+the chain asks the model to extract the player and the action instead.
+"""
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from data.player_index import STOPWORDS, PlayerNameIndex, fold
+
+# Verbs of each action, the first action found in a clause wins
+ACTION_VERBS = {
+    "captain": r"captain|captaincy|armband|skipper",
+    "swap": r"swap|switch|replace|substitute|sub|instead\s+of|in\s+for",
+    "remove": r"bench|drop|remove|take\s+out|leave\s+out|rest|sit",
+    "add": r"start|add|put|include|bring|play|field|select|pick",
+}
+ACTION_PATTERNS = {action: re.compile(rf"\b({verbs})\b") for action, verbs in ACTION_VERBS.items()}
+# Clauses end at punctuation, but not the dot of "G.Jesus", "then", or an "and" followed by a new verb
+CLAUSE_SPLIT = re.compile(r"[,;!?]|\.(?=\s|$)|\bthen\b|\band\s+(?=(?:make|" + "|".join(ACTION_VERBS.values()) + r")\b)")
+FOR_PATTERN = re.compile(r"\bfor\b")
+# Words of the commands that are never names, on top of the words of the name index
+COMMAND_WORDS = {
+    "armband", "captaincy", "drop", "field", "include", "instead", "lineup", "need", "pick",
+    "put", "rest", "select", "sit", "skipper", "start", "starter", "starters", "sub", "substitute",
+    "switch", "take", "leave", "him", "them", "both", "also", "today", "tonight", "xi",
+}
+# Share of the score of the best squad player a second one needs to make a name ambiguous
+AMBIGUOUS_SCORE = 0.9
+
+
+class LineupCommand(NamedTuple):
+    """
+    One action on the starting eleven.
+
+    player_ids holds one player, or two for a swap; the id is None for a player found
+    outside the user's squad, whose name is kept for the reply.
+    """
+
+    action: str
+    player_ids: Tuple[Optional[int], ...]
+    names: Tuple[str, ...]
+
+
+def _words(text: str) -> List[Tuple[int, str]]:
+    """The words of a text that may be names, with their position in it."""
+    return [
+        (position, word) for position, word in enumerate(fold(text).split())
+        if len(word) >= 3 and word not in STOPWORDS and word not in COMMAND_WORDS
+    ]
+
+
+def _clause_players(
+    clause: str, squad_index: PlayerNameIndex, player_index: Optional[PlayerNameIndex]
+) -> Optional[List[Tuple[Optional[int], str]]]:
+    """
+    Find the players named in a clause, in order.
+
+    Returns:
+        list: (player_id, name) of each player, the id is None outside the squad. None if a
+            name is ambiguous.
+    """
+    # The players of the squad each word may stand for, several when they score alike
+    candidates: Dict[int, Tuple[str, list]] = {}
+    for position, word in _words(clause):
+        matches = squad_index.search(word, k=3)
+        if matches:
+            candidates[position] = (word, [match for match in matches if match.score >= AMBIGUOUS_SCORE * matches[0].score])
+        elif player_index is not None:
+            # Only exact names of the other players, a loose match of any word would be noise
+            others = [match for match in player_index.search(word, k=3) if word in fold(f"{match.name} {match.web_name}").split()]
+            if others:
+                name = others[0].web_name if len(others) == 1 else word.title()
+                candidates[position] = (word, [others[0]._replace(player_id=None, name=name)])
+
+    players: List[Tuple[Optional[int], str]] = []
+    for position, (word, options) in candidates.items():
+        if len(options) > 1:
+            # "Gabriel" right next to "Jesus" is Gabriel Jesus, alone it is the player known as Gabriel
+            neighbours = {
+                candidates[other][1][0].player_id
+                for other in (position - 1, position + 1)
+                if other in candidates and len(candidates[other][1]) == 1
+            }
+            options = [option for option in options if option.player_id in neighbours] or [
+                option for option in options if fold(option.web_name) == word
+            ]
+            if len(options) != 1:
+                return None
+        player = (options[0].player_id, options[0].name)
+        # Both words of "Bruno Fernandes" stand for one player
+        if player[0] is None or all(player[0] != player_id for player_id, _ in players):
+            players.append(player)
+    return players
+
+
+def parse_lineup_commands(
+    text: str, squad_index: PlayerNameIndex, player_index: Optional[PlayerNameIndex] = None
+) -> Optional[List[LineupCommand]]:
+    """
+    Parse the starting eleven commands of a message.
+
+    Args:
+        text (str): The message from the user.
+        squad_index (PlayerNameIndex): Index of the players of the user's squad.
+        player_index (PlayerNameIndex, optional): Index of every player, to recognize the
+            players named that are not in the squad.
+
+    Returns:
+        list: The commands in the order of the message, or None when the message is ambiguous.
+    """
+    commands: List[LineupCommand] = []
+    action = None
+    for clause in CLAUSE_SPLIT.split(text.lower()):
+        clause = fold(clause)
+        found = next((name for name, pattern in ACTION_PATTERNS.items() if pattern.search(clause)), None)
+        players = _clause_players(clause, squad_index, player_index)
+        if players is None:
+            return None
+        if not players:
+            if found:
+                # A verb without a name, e.g. "bench my worst player"
+                return None
+            continue
+        action = found or action
+        if action is None:
+            return None
+        if action in ("add", "remove") and len(players) == 2 and FOR_PATTERN.search(clause):
+            # "bench Havertz for Saka"
+            action = "swap"
+        if action == "swap":
+            if len(players) != 2:
+                return None
+            commands.append(LineupCommand("swap", *map(tuple, zip(*players))))
+        elif action == "captain":
+            if len(players) != 1:
+                return None
+            commands.append(LineupCommand("captain", *map(tuple, zip(*players))))
+        else:
+            commands.extend(LineupCommand(action, (player_id,), (name,)) for player_id, name in players)
+    return commands or None
+
+
+def squad_index(player_index: PlayerNameIndex, squad: Iterable[int]) -> PlayerNameIndex:
+    """
+    Build the name index of a squad from the index of every player.
+
+    Args:
+        player_index (PlayerNameIndex): Index of every player.
+        squad (iterable): player_id of each player of the squad.
+
+    Returns:
+        PlayerNameIndex: An index of the squad only, so rare words are weighted within it.
+    """
+    return PlayerNameIndex(
+        [player_index.players[player_id] for player_id in squad if player_id in player_index.players],
+        min_similarity=player_index.min_similarity,
+        min_relative_score=player_index.min_relative_score,
+    )
@@ -3,7 +3,6 @@ from langchain.schema.runnable.base import Runnable
 from pydantic import BaseModel, ValidationError
 from langchain_openai import ChatOpenAI
 from chatbot.chains.base import PromptTemplate, generate_prompt_templates
-from data.loader import *
 from langchain import callbacks
 
 
@@ -31,8 +30,6 @@ class DealwithNoneIntention(Runnable):
             2. The output should just be one of the possible intentions, only that
             3. Don't put it in a list            
             
-            Chat History:
-            {chat_history}
             """,
             human_template="Customer Query: {customer_input}",
         )
@@ -46,3 +43,7 @@ class DealwithNoneIntention(Runnable):
         with callbacks.collect_runs() as cb:                                
             return self.chain.invoke(inputs, config=config)
 
+    async def ainvoke(self, inputs, config=None, **kwargs):
+        """Invoke the chain without blocking the event loop."""
+        return await self.chain.ainvoke(inputs, config=config)
+
@@ -0,0 +1,160 @@
+import re
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.player_index import PlayerNameIndex
+
+# Words used for each position of the players_fantasy table
+POSITION_WORDS = {
+    "Goalkeeper": r"goalkeepers?|keepers?|goalies?|gk|gkp",
+    "Defender": r"defenders?|centre[- ]backs?|center[- ]backs?|full[- ]backs?|wing[- ]backs?|def",
+    "Midfielder": r"midfielders?|midfield|mids?|wingers?|playmakers?",
+    "Forward": r"forwards?|strikers?|attackers?|fwd|centre[- ]forwards?",
+}
+POSITIONS = list(POSITION_WORDS)
+
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+COUNT_PATTERN = re.compile(
+    r"\b(\d+|a|an|one|two|three|four|five)\s+(?:\w+\s+)?(players?|"
+    + "|".join(POSITION_WORDS.values())
+    + r")\b",
+    re.IGNORECASE,
+)
+AMOUNT = r"(\d+(?:\.\d+)?)\s*(?:m\b|mil\b|million\b)?"
+BUDGET_PATTERN = re.compile(
+    rf"[$€£]\s*{AMOUNT}|{AMOUNT}\s*[$€£]|"
+    rf"\b(?:budget|under|below|less than|cheaper than|up to|at most|max(?:imum)?|spend)\s+(?:of\s+|is\s+)?{AMOUNT}",
+    re.IGNORECASE,
+)
+PER_PLAYER_PATTERN = re.compile(r"\b(each|per player|apiece|a piece)\b", re.IGNORECASE)
+EXCLUSION_PATTERN = re.compile(
+    r"\b(?:no|not|excluding|except|without|don'?t want|do not want|other than|besides)\b(.*)",
+    re.IGNORECASE,
+)
+
+# Candidates sent to the model for each requested position, fewer when any position will do
+CANDIDATES_PER_POSITION = 8
+CANDIDATES_PER_ANY_POSITION = 4
+
+class RecommendationConstraints(BaseModel):
+    positions: List[str] = []  # Positions as stored in players_fantasy, every position if empty
+    budget: Optional[float] = None  # Total money the user wants to spend
+    max_price: Optional[float] = None  # Maximum price of a single player
+    count: Optional[int] = None  # Number of players the user asked for
+    position_counts: Dict[str, int] = {}  # Number of players asked for in each position, e.g. "two defenders"
+    excluded_ids: List[int] = []  # Players the user does not want
+
+    def describe(self) -> str:
+        """Summarize the constraints for the prompt."""
+        parts = [f"positions: {', '.join(self.positions) or 'any'}"]
+        if self.count:
+            parts.append(f"number of players: {self.count}")
+        if self.budget is not None:
+            parts.append(f"total budget: {self.budget:g}")
+        if self.max_price is not None:
+            parts.append(f"maximum price per player: {self.max_price:g}")
+        return "; ".join(parts)
+
+
+def extract_constraints(customer_input: str, player_index: Optional[PlayerNameIndex] = None) -> RecommendationConstraints:
+    """
+    Extract the position, budget, count and exclusion constraints of a recommendation request.
+
+    Args:
+        customer_input (str): The message from the user.
+        player_index (PlayerNameIndex, optional): Index used to find the excluded players.
+
+    Returns:
+        RecommendationConstraints: The constraints found, unset when the user did not give them.
+    """
+    positions = [
+        position
+        for position, words in POSITION_WORDS.items()
+        if re.search(rf"\b({words})\b", customer_input, re.IGNORECASE)
+    ]
+
+    count = None
+    position_counts: Dict[str, int] = {}
+    for number, word in COUNT_PATTERN.findall(customer_input):
+        number = number.lower()
+        number = int(number) if number.isdigit() else NUMBER_WORDS[number]
+        count = (count or 0) + number
+        for position, words in POSITION_WORDS.items():
+            if re.fullmatch(words, word, re.IGNORECASE):
+                position_counts[position] = position_counts.get(position, 0) + number
+
+    budget = max_price = None
+    amounts = [float(next(group for group in match if group)) for match in BUDGET_PATTERN.findall(customer_input)]
+    if amounts:
+        if PER_PLAYER_PATTERN.search(customer_input) or count == 1:
+            max_price = min(amounts)
+        else:
+            budget = min(amounts)
+
+    excluded_ids: Set[int] = set()
+    exclusion = EXCLUSION_PATTERN.search(customer_input)
+    if exclusion and player_index is not None:
+        excluded_ids = {match.player_id for match in player_index.search(exclusion.group(1))}
+
+    return RecommendationConstraints(
+        positions=positions,
+        budget=budget,
+        max_price=max_price,
+        count=count,
+        position_counts=position_counts,
+        excluded_ids=sorted(excluded_ids),
+    )
+
+
+def query_candidates(user_id: int, constraints: RecommendationConstraints, db_path: Optional[str] = None) -> List[tuple]:
+    """
+    Retrieve the best players matching the constraints that are not in the user's squad.
+
+    Each position is a separate query that walks the (position, expected_points_next_game)
+    index from the top and stops after a few rows.
+
+    Args:
+        user_id (int): The user asking for recommendations.
+        constraints (RecommendationConstraints): Output of `extract_constraints`.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        list: Rows of (name, team, position, price, expected_points_next_game), best first per position.
+    """
+    db_path = db_path or get_sqlite_database_path()
+    positions = constraints.positions or POSITIONS
+    limit = CANDIDATES_PER_POSITION if constraints.positions else CANDIDATES_PER_ANY_POSITION
+    # Enough choice to pick the requested number of players and still respect the budget
+    limit = max(limit, 3 * (constraints.count or 0))
+
+    conditions = ["position = ?", "player_id NOT IN (SELECT player_id FROM user_team WHERE user_id = ? AND on_team = 1)"]
+    parameters = [user_id]
+    # A single player can't cost more than the whole budget
+    max_price = constraints.max_price if constraints.max_price is not None else constraints.budget
+    if max_price is not None:
+        conditions.append("price <= ?")
+        parameters.append(max_price)
+    if constraints.excluded_ids:
+        conditions.append(f"player_id NOT IN ({','.join('?' * len(constraints.excluded_ids))})")
+        parameters += constraints.excluded_ids
+
+    query = f"""
+        SELECT name, team, position, price, expected_points_next_game
+        FROM players_fantasy
+        WHERE {' AND '.join(conditions)}
+        ORDER BY expected_points_next_game DESC
+        LIMIT ?
+    """
+
+    # The (position, expected_points_next_game) index is created by the migrations
+    def read(db):
+        rows = []
+        for position in positions:
+            rows += db.execute(query, (position, *parameters, limit)).fetchall()
+        return rows
+
+    # One read transaction, so every position sees the same squad
+    return get_pool(db_path).run(read, immediate=False)
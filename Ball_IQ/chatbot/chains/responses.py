@@ -0,0 +1,180 @@
+"""
+Replies to the user built from the outcomes of the tools.
+
+The tools that change the user's team or points report what happened as an `Outcome`: a
+code such as "lineup.added" and the values of the message. `render` fills one of the
+templates of each code, picked at random so the replies don't all read the same, and the
+reply is ready as soon as the tool is done instead of after another call to the model.
+
+The first template of each code is the plain message the tools used to return. It is the
+text of the outcome, and what the model is given when a chain is asked to rephrase it.
+"""
+
+import random
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
+
+from langchain_core.runnables import RunnableLambda
+
+TEMPLATES: Dict[str, List[str]] = {
+    # Errors shared by the tools
+    "user.not_found": [
+        "Error: User with ID {user_id} does not exist.",
+    ],
+    "player.not_found": [
+        "'{name}' does not exist in the fantasy player list.",
+        "I couldn't find '{name}' among the fantasy players, could you check the name?",
+    ],
+    "player.not_on_team": [
+        "'{name}' is not currently on your team.",
+        "{name} isn't in your squad right now.",
+    ],
+    "db.error": [
+        "Error: {error}",
+        "Something went wrong while saving your change ({error}), please try again.",
+    ],
+    # Starting eleven
+    "lineup.no_player": [
+        "You didn't introduce the name of anyone in your team",
+        "I couldn't tell which player of your team you meant, could you name them?",
+    ],
+    "lineup.invalid_action": [
+        "Error: Invalid action. Use 'add' to add a player or 'remove' to remove a player.",
+        "I can only add a player to your starting eleven or take one out of it.",
+    ],
+    "lineup.full": [
+        "Error: You cannot have more than 11 players in the starting eleven.",
+        "Your starting eleven would have more than 11 players, bench someone first.",
+        "That's more than 11 starters, take a player out of the starting eleven first.",
+    ],
+    "lineup.added": [
+        "Player '{name}' has been successfully added to the starting eleven.",
+        "Done! {name} is now in your starting eleven.",
+        "{name} makes your starting eleven, fingers crossed for the points!",
+    ],
+    "lineup.already_starting": [
+        "Player '{name}' is already in the starting eleven.",
+        "{name} was already in your starting eleven, nothing to change there.",
+    ],
+    "lineup.removed": [
+        "Player '{name}' has been successfully removed from the starting eleven.",
+        "Done! {name} is on the bench now.",
+        "{name} has been benched.",
+    ],
+    "lineup.not_starting": [
+        "Player '{name}' is not in the starting eleven.",
+        "{name} wasn't in your starting eleven to begin with.",
+    ],
+    "lineup.swapped": [
+        "Player '{player_in}' replaces '{player_out}' in the starting eleven.",
+        "Swapped! {player_in} comes into your starting eleven and {player_out} goes to the bench.",
+        "{player_in} in, {player_out} out of your starting eleven.",
+    ],
+    "lineup.swap_invalid": [
+        "Error: To swap '{first}' and '{second}' one of them must be in the starting eleven and the other on the bench.",
+        "I can't swap {first} and {second}: one of them has to start and the other be on the bench.",
+    ],
+    "lineup.captain": [
+        "Player '{name}' is now the captain.",
+        "{name} wears the armband now, double points if they deliver!",
+        "Done! {name} is your captain.",
+    ],
+    "lineup.captain_not_starting": [
+        "Error: '{name}' must be in the starting eleven to be captain.",
+        "{name} has to be in the starting eleven to be your captain.",
+    ],
+    "lineup.captain_cleared": [
+        "Your captain left the starting eleven, choose a new one.",
+        "Heads up: your captain is on the bench now, pick a new one.",
+    ],
+    "lineup.unchanged": [
+        "No change was made to your starting eleven.",
+        "Your starting eleven stays as it was.",
+    ],
+    # Transfers
+    "transfer.no_player_in": [
+        "You always need to state a player to bring to your team",
+        "Which player do you want to bring into your team? I need that to make a transfer.",
+    ],
+    "transfer.done": [
+        "Player '{player_out}' has been removed from your team. Player '{player_in}' has been successfully added to the team. Remaining budget: {budget:.2f}",
+        "Transfer done! {player_out} leaves and {player_in} joins your team. You have {budget:.2f} left to spend.",
+        "{player_in} is in and {player_out} is out. Remaining budget: {budget:.2f}.",
+    ],
+    "transfer.added": [
+        "Player '{player_in}' has been successfully added to the team. Remaining budget: {budget:.2f}",
+        "Welcome {player_in} to your team! You have {budget:.2f} left to spend.",
+    ],
+    "transfer.refused": [
+        "{reason}",
+    ],
+    "transfer.error": [
+        "An error occurred while processing the transfer: {error}",
+        "The transfer couldn't be saved ({error}), please try again.",
+    ],
+    # Points
+    "points.view": [
+        "User {user_id} currently has {points} points.",
+        "You currently have {points} points.",
+        "Your team is on {points} points so far.",
+    ],
+    "points.updated": [
+        "Successfully updated user {user_id}'s points to {points}.",
+        "Done! Your points are now {points}.",
+        "Your team's points have been set to {points}.",
+    ],
+    "points.invalid_action": [
+        "I can show you your points or update them, which one would you like?",
+    ],
+}
+
+
+class Outcome(NamedTuple):
+    """What a tool did, as a code of `TEMPLATES` and the values of its message."""
+
+    code: str
+    params: Dict[str, Any] = {}
+
+    def __str__(self) -> str:
+        return TEMPLATES[self.code][0].format(**self.params)
+
+
+Outcomes = Union[Outcome, Iterable[Outcome]]
+
+_rng = random.Random()
+
+
+def _as_list(outcomes: Outcomes) -> List[Outcome]:
+    return [outcomes] if isinstance(outcomes, Outcome) else list(outcomes)
+
+
+def render(outcomes: Outcomes, rng: Optional[random.Random] = None) -> str:
+    """
+    Write the reply for the outcomes of a tool, one line each.
+
+    Args:
+        outcomes (Outcome or iterable): The outcomes, in order.
+        rng (random.Random, optional): Picks the template of each outcome.
+
+    Returns:
+        str: The reply.
+    """
+    rng = rng or _rng
+    return "\n".join(rng.choice(TEMPLATES[outcome.code]).format(**outcome.params) for outcome in _as_list(outcomes))
+
+
+def plain_text(outcomes: Outcomes) -> str:
+    """
+    Write the plain message of each outcome, one line each, as given to the model to rephrase.
+
+    Args:
+        outcomes (Outcome or iterable): The outcomes, in order.
+
+    Returns:
+        str: The messages.
+    """
+    return "\n".join(str(outcome) for outcome in _as_list(outcomes))
+
+
+# Renders the "outcomes" of the inputs of a chain. Run with the config of the chain and on
+# its inputs, so the reply is saved in the session history like the replies of the model
+renderer = RunnableLambda(lambda inputs: render(inputs["outcomes"]), name="render")
@@ -0,0 +1,574 @@
+"""
+Local index of the documents the RAG chains answer from, in place of the Pinecone index.
+
+The PDFs in `data/` are split as in `data/Pinecone.ipynb` and embedded with the MiniLM
+encoder of the router. The embeddings are written to `data/document_embeddings.npy`
+(float32, unit norm) with the chunks in `data/document_embeddings.json`. Loading them is
+a memory map and a search is one matrix product, so a question no longer waits for the
+OpenAI embeddings and a Pinecone query.
+
+The index isn't built while the bot runs: `load_document_index` only maps it, and the
+command below builds it, as a deploy step. It is kept up to date incrementally. `data/document_manifest.json` records the
+hash of each PDF and of each of its chunks: PDFs whose hash didn't change aren't read,
+and only the chunks of a changed PDF that aren't in the index yet are embedded, in
+batches. Chunks of removed PDFs are deleted. The same pipeline keeps the Pinecone index
+up to date with its own manifest.
+
+Ingest the PDFs, from the `Ball_IQ` folder (reading them needs PyMuPDF, as the notebook did):
+    python -m chatbot.document_index
+    python -m chatbot.document_index --backend pinecone
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from chatbot.router.route_index import load_encoder, read_layer
+from data.loader import BASE_DIR
+
+# PDFs of `data/` that aren't about the fantasy rules and stats, every other one is ingested
+EXCLUDED_DOCUMENTS = ("Project - 1st Delivery.pdf", "Solution_Design_Group4.pdf.pdf")
+INDEX_PATH = os.path.join(BASE_DIR, "document_embeddings.npy")
+METADATA_PATH = os.path.join(BASE_DIR, "document_embeddings.json")
+MANIFEST_PATH = os.path.join(BASE_DIR, "document_manifest.json")
+PINECONE_MANIFEST_PATH = os.path.join(BASE_DIR, "pinecone_manifest.json")
+# Bump when the way chunks or embeddings are computed or stored changes
+INDEX_VERSION = 2
+# Chunks of the text splitter of data/Pinecone.ipynb
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 250
+# Chunks embedded in one call to the encoder
+BATCH_SIZE = 64
+
+
+def _normalize(vectors) -> np.ndarray:
+    """Scale the rows of a matrix to unit norm, as float32."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _write_json(data: Dict, path: str) -> None:
+    """Write a json file, replacing it at once so a reader never sees half of it."""
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file)
+    os.replace(path + ".tmp", path)
+
+
+class EncoderEmbeddings(Embeddings):
+    """LangChain embeddings over an encoder called with a list of texts, such as the router's MiniLM."""
+
+    def __init__(self, encoder, embed_query: Optional[Callable[[str], Any]] = None):
+        """Initialize the embeddings.
+
+        Args:
+            encoder: Encoder called with a list of texts, such as the RouteLayer encoder.
+            embed_query: Embeds a question instead of the encoder, such as `IntentClassificationService.embed`
+                which already holds the embedding of the message it just classified.
+        """
+        self.encoder = encoder
+        self._embed_query = embed_query
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _normalize(self.encoder(texts)).tolist() if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        if self._embed_query is not None:
+            return list(self._embed_query(text))
+        return self.embed_documents([text])[0]
+
+
+class LocalVectorStore(VectorStore):
+    """Flat index of chunks with unit norm embeddings, searched by cosine similarity with NumPy.
+
+    The relevance score of a chunk is the one PineconeVectorStore gives on a cosine index,
+    (similarity + 1) / 2, so the `score_threshold` of a retriever means what it did with
+    Pinecone. Chunks are found by id to be replaced or deleted, as in Pinecone.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        texts: Sequence[str],
+        metadatas: Sequence[dict],
+        embedding: Embeddings,
+        ids: Optional[Sequence[str]] = None,
+    ):
+        """Initialize the store.
+
+        Args:
+            embeddings: Matrix with one unit norm row per chunk, used as is so a mapped file stays mapped.
+            texts: Text of each chunk.
+            metadatas: Metadata of each chunk.
+            embedding: Embeds the questions, with the model the chunks were embedded with.
+            ids: Id of each chunk, random ones if not given.
+        """
+        self.matrix = embeddings
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        self.ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in self.texts]
+        self._embedding = embedding
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @classmethod
+    def empty(cls, embedding: Embeddings) -> "LocalVectorStore":
+        """Store without any chunk, filled with `add_texts`."""
+        return cls(np.empty((0, 0), dtype=np.float32), [], [], embedding, [])
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """Embed the chunks and build the store.
+
+        Args:
+            texts: Text of each chunk.
+            embedding: Embeds the chunks and later the questions.
+            metadatas: Metadata of each chunk.
+            ids: Id of each chunk.
+
+        Returns:
+            LocalVectorStore with every chunk.
+        """
+        store = cls.empty(embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Embed chunks and add them at the end of the index, replacing the chunks with the same ids.
+
+        Returns:
+            The ids of the chunks.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        vectors = _normalize(self._embedding.embed_documents(texts))
+        self.delete(ids)
+        self.matrix = vectors if not self.texts else np.vstack([self.matrix, vectors])
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.ids.extend(ids)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, **kwargs: Any) -> Optional[bool]:
+        """Delete the chunks with the given ids, ignoring the ids not in the index, or every chunk.
+
+        Returns:
+            Whether any chunk was deleted.
+        """
+        dropped = set(self.ids) if delete_all else set(ids or ())
+        keep = [row for row, chunk_id in enumerate(self.ids) if chunk_id not in dropped]
+        if len(keep) == len(self.ids):
+            return False
+        self.matrix = np.asarray(self.matrix)[keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.ids = [self.ids[row] for row in keep]
+        return True
+
+    def similarity_search_by_vector_with_score(self, vector, k: int = 4) -> List[Tuple[Document, float]]:
+        """Find the `k` chunks closest to an embedding.
+
+        Returns:
+            The chunks and their cosine similarity, closest first.
+        """
+        k = min(k, len(self.texts))
+        if k <= 0:
+            return []
+        similarities = self.matrix @ _normalize(vector)[0]
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            (
+                Document(id=self.ids[index], page_content=self.texts[index], metadata=dict(self.metadatas[index])),
+                float(similarities[index]),
+            )
+            for index in top
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return lambda similarity: (similarity + 1) / 2
+
+    def save(self, index_path: str = INDEX_PATH, metadata_path: str = METADATA_PATH) -> None:
+        """Write the embeddings and chunks, replacing the files at once so a reader never maps half of them.
+
+        Args:
+            index_path: Where to write the embeddings.
+            metadata_path: Where to write the chunks.
+        """
+        with open(index_path + ".tmp", "wb") as file:
+            np.save(file, np.ascontiguousarray(self.matrix, dtype=np.float32))
+        os.replace(index_path + ".tmp", index_path)
+        _write_json(
+            {
+                "version": INDEX_VERSION,
+                "shape": list(np.shape(self.matrix)),
+                "ids": self.ids,
+                "texts": self.texts,
+                "metadatas": self.metadatas,
+            },
+            metadata_path,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        embedding: Embeddings,
+        index_path: str = INDEX_PATH,
+        metadata_path: str = METADATA_PATH,
+    ) -> Optional["LocalVectorStore"]:
+        """Memory map an index written by `save`.
+
+        Args:
+            embedding: Embeds the questions.
+            index_path: Path to the embeddings.
+            metadata_path: Path to the chunks.
+
+        Returns:
+            LocalVectorStore backed by the mapped file, or None if the files are missing or don't match.
+        """
+        if not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+            return None
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+        if metadata.get("version") != INDEX_VERSION:
+            return None
+        matrix = np.load(index_path, mmap_mode="r")
+        if list(matrix.shape) != metadata["shape"] or len(metadata["ids"]) != matrix.shape[0]:
+            return None
+        return cls(matrix, metadata["texts"], metadata["metadatas"], embedding, metadata["ids"])
+
+
+class IngestReport(NamedTuple):
+    """What an ingestion changed: the documents by state and the chunks embedded and deleted."""
+
+    unchanged: List[str]
+    changed: List[str]
+    removed: List[str]
+    added: int
+    deleted: int
+
+
+def document_paths(folder: str = BASE_DIR) -> List[str]:
+    """
+    Find the PDFs to ingest.
+
+    Args:
+        folder (str): Folder with the PDFs, `data/` by default.
+
+    Returns:
+        list: Paths to every PDF of the folder but the `EXCLUDED_DOCUMENTS`, sorted.
+    """
+    return sorted(
+        path for path in glob.glob(os.path.join(folder, "*.pdf"))
+        if os.path.basename(path) not in EXCLUDED_DOCUMENTS
+    )
+
+
+def file_hash(path: str) -> str:
+    """Hex sha256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(text: str) -> str:
+    """Id of a chunk, the hex sha256 of its text, so an unchanged chunk keeps its embedding."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_pages(pages: List[Document]) -> List[Document]:
+    """
+    Split pages as in `data/Pinecone.ipynb`.
+
+    Args:
+        pages (list): The pages of a document.
+
+    Returns:
+        list: The chunks, with the start index of each one in its metadata.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        separators="\n", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
+    )
+    return splitter.split_documents(pages)
+
+
+def load_pdf_chunks(path: str) -> List[Document]:
+    """
+    Read the pages of a PDF and split them.
+
+    Args:
+        path (str): Path to the PDF file.
+
+    Returns:
+        list: The chunks, with the source, page and start index of each one in its metadata.
+    """
+    from langchain_community.document_loaders import PyMuPDFLoader
+
+    return split_pages(PyMuPDFLoader(path).load())
+
+
+def read_manifest(path: str = MANIFEST_PATH) -> Dict:
+    """
+    Read an ingestion manifest.
+
+    Args:
+        path (str): Path to the manifest.
+
+    Returns:
+        dict: The manifest, without any document if the file doesn't exist.
+    """
+    if not os.path.exists(path):
+        return {"settings": None, "documents": {}}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def ingest_documents(
+    store: VectorStore,
+    encoder_name: str,
+    paths: Optional[Sequence[str]] = None,
+    manifest_path: str = MANIFEST_PATH,
+    batch_size: int = BATCH_SIZE,
+    load_chunks: Callable[[str], List[Document]] = load_pdf_chunks,
+    save: Optional[Callable[[], None]] = None,
+    force: bool = False,
+    count: Optional[Callable[[], int]] = None,
+    count_timeout: float = 0,
+) -> IngestReport:
+    """
+    Bring a vector store up to date with the documents, embedding only the chunks it doesn't have.
+
+    Documents whose hash is in the manifest aren't read. The chunks of the other ones are
+    found by the hash of their text: new ones are embedded and added in batches, and the
+    ones no document has any more are deleted. Kept chunks keep the metadata they were
+    added with. When the encoder or the way chunks are split changed, every chunk is
+    embedded again. The manifest is written last, so a run that stops halfway is finished
+    by the next one.
+
+    Without a manifest the vectors of the store weren't added by this pipeline, such as
+    the ones `data/Pinecone.ipynb` uploaded with the ids "0" to "N", and every one of them
+    is deleted first so no chunk is stored twice under two ids.
+
+    Args:
+        store: Vector store with `add_texts` and `delete` by id, such as LocalVectorStore or PineconeVectorStore.
+        encoder_name (str): Name of the encoder of the store.
+        paths (list, optional): Paths to the documents, `document_paths()` if not given.
+        manifest_path (str): Path to the manifest of the store.
+        batch_size (int): Chunks embedded and added at a time.
+        load_chunks (callable): Reads and splits one document.
+        save (callable, optional): Persists the store, called before the manifest is written.
+        force (bool): Embed every chunk again.
+        count (callable, optional): Returns the number of vectors in the store, checked against the manifest.
+        count_timeout (float): Seconds to wait for the count to match, for stores that apply writes later.
+
+    Returns:
+        IngestReport: What changed.
+
+    Raises:
+        RuntimeError: If the store doesn't hold one vector per chunk of the manifest.
+    """
+    paths = document_paths() if paths is None else paths
+    manifest = read_manifest(manifest_path)
+    settings = {"version": INDEX_VERSION, "encoder_name": encoder_name, "chunks": [CHUNK_SIZE, CHUNK_OVERLAP]}
+    previous = manifest["documents"]
+    # Whether the chunks in the store can be kept, they can't once the encoder or the splitting changed
+    reuse = not force and manifest["settings"] == settings
+
+    documents, unchanged, changed, chunks = {}, [], [], {}
+    for path in paths:
+        name = os.path.basename(path)
+        digest = file_hash(path)
+        if reuse and previous.get(name, {}).get("sha256") == digest:
+            documents[name] = previous[name]
+            unchanged.append(name)
+            continue
+        ids = []
+        for chunk in load_chunks(path):
+            identifier = chunk_id(chunk.page_content)
+            chunks.setdefault(identifier, chunk)
+            ids.append(identifier)
+        documents[name] = {"sha256": digest, "ids": list(dict.fromkeys(ids))}
+        changed.append(name)
+    removed = sorted(set(previous) - set(documents))
+    wanted = {identifier for document in documents.values() for identifier in document["ids"]}
+    if reuse and not changed and not removed:
+        _check_count(count, len(wanted), count_timeout)
+        return IngestReport(unchanged, [], [], 0, 0)
+
+    stored = {identifier for document in previous.values() for identifier in document["ids"]}
+    present = stored & wanted if reuse else set()
+    deleted = sorted(stored - present)
+    if manifest["settings"] is None:
+        store.delete(delete_all=True)
+    elif deleted:
+        store.delete(ids=deleted)
+    added = [identifier for identifier in chunks if identifier not in present]
+    for start in range(0, len(added), batch_size):
+        batch = added[start:start + batch_size]
+        store.add_texts(
+            [chunks[identifier].page_content for identifier in batch],
+            metadatas=[chunks[identifier].metadata for identifier in batch],
+            ids=batch,
+        )
+
+    if save is not None:
+        save()
+    _write_json({"settings": settings, "documents": documents}, manifest_path)
+    _check_count(count, len(wanted), count_timeout)
+    return IngestReport(unchanged, changed, removed, len(added), len(deleted))
+
+
+def _check_count(count: Optional[Callable[[], int]], expected: int, timeout: float) -> None:
+    """Wait up to `timeout` seconds for the store to hold `expected` vectors, raising a RuntimeError if it doesn't."""
+    if count is None:
+        return
+    deadline = time.monotonic() + timeout
+    actual = count()
+    while actual != expected and time.monotonic() < deadline:
+        time.sleep(1)
+        actual = count()
+    if actual != expected:
+        raise RuntimeError(
+            f"The index holds {actual} vectors but the manifest has {expected} chunks, "
+            "rerun the ingestion with --force to rebuild it."
+        )
+
+
+def sync_document_index(
+    encoder=None,
+    embed_query: Optional[Callable[[str], Any]] = None,
+    paths: Optional[Sequence[str]] = None,
+    force: bool = False,
+) -> Tuple[LocalVectorStore, IngestReport]:
+    """
+    Bring the local index up to date with the PDFs and write it.
+
+    Args:
+        encoder (optional): Encoder of the chunks and questions, the MiniLM of `layer.json` if not given.
+        embed_query (optional): Embeds the questions instead of the encoder.
+        paths (list, optional): Paths to the PDFs, `document_paths()` if not given.
+        force (bool): Embed every chunk again.
+
+    Returns:
+        tuple: The LocalVectorStore and what the ingestion changed.
+    """
+    layer = read_layer()
+    encoder = encoder or load_encoder(layer)
+    embeddings = EncoderEmbeddings(encoder, embed_query)
+    store = LocalVectorStore.load(embeddings)
+    if store is None:
+        # Without the index every chunk has to be embedded, whatever the manifest says
+        store, force = LocalVectorStore.empty(embeddings), True
+    report = ingest_documents(
+        store, layer["encoder_name"], paths, save=store.save, force=force, count=lambda: len(store.ids)
+    )
+    return store, report
+
+
+def load_document_index(
+    encoder=None,
+    embed_query: Optional[Callable[[str], Any]] = None,
+) -> LocalVectorStore:
+    """
+    Memory map the document index written by `python -m chatbot.document_index`.
+
+    The PDFs aren't read here: the index is built by that command, as a deploy step, so a
+    question never waits for the PDFs to be parsed and embedded.
+
+    Args:
+        encoder (optional): Encoder of the questions, the MiniLM of `layer.json` if not given.
+        embed_query (optional): Embeds the questions instead of the encoder.
+
+    Returns:
+        LocalVectorStore over every chunk of the PDFs.
+
+    Raises:
+        FileNotFoundError: If the index hasn't been built.
+        RuntimeError: If the index was built with another encoder or version than the current ones.
+    """
+    layer = read_layer()
+    settings = read_manifest()["settings"]
+    store = LocalVectorStore.load(EncoderEmbeddings(encoder or load_encoder(layer), embed_query))
+    if store is None or settings is None:
+        raise FileNotFoundError(
+            f"The document index {INDEX_PATH} is missing, build it with `python -m chatbot.document_index`."
+        )
+    if settings["version"] != INDEX_VERSION or settings["encoder_name"] != layer["encoder_name"]:
+        raise RuntimeError(
+            f"The document index {INDEX_PATH} was built with {settings['encoder_name']}, "
+            "rebuild it with `python -m chatbot.document_index --force`."
+        )
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the PDFs answered from by the RAG chains.")
+    parser.add_argument(
+        "--backend", choices=("local", "pinecone"), default="local", help="Index to bring up to date."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Embed every chunk again, even the unchanged ones."
+    )
+    args = parser.parse_args()
+
+    if args.backend == "pinecone":
+        from chatbot.chains.RAG import PINECONE_EMBEDDING_MODEL, build_pinecone_index, build_pinecone_store
+
+        index = build_pinecone_index()
+        report = ingest_documents(
+            build_pinecone_store(index),
+            PINECONE_EMBEDDING_MODEL,
+            manifest_path=PINECONE_MANIFEST_PATH,
+            force=args.force,
+            count=lambda: index.describe_index_stats().total_vector_count,
+            # Pinecone counts the upserted vectors a few seconds later
+            count_timeout=60,
+        )
+    else:
+        _, report = sync_document_index(force=args.force)
+
+    print(f"{len(report.unchanged)} documents unchanged, {len(report.changed)} added or changed, "
+          f"{len(report.removed)} removed.")
+    print(f"Embedded {report.added} chunks and deleted {report.deleted}.")
+
+
+if __name__ == "__main__":
+    main()
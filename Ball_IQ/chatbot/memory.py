@@ -1,15 +1,68 @@
 # Import necessary modules and classes
-import json
-from typing import Dict, List, Tuple
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import List, Optional, Sequence, Set, Tuple
 
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.messages.ai import AIMessage
 from langchain_core.messages.human import HumanMessage
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import ConfigurableFieldSpec
 from pydantic import BaseModel, Field
 import os
 
+from chatbot.chains.base import PromptTemplate, generate_prompt_templates
+from data.connection import get_pool
+
+# Message class of each role stored by the history backends
+MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+# Tokens the chat API adds around the content of each message
+TOKENS_PER_MESSAGE = 3
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """Tokenizer of gpt-4o-mini, or None when tiktoken can't load it (it downloads it the first time)."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(messages: Sequence[BaseMessage]) -> int:
+    """Count the prompt tokens of messages, estimated at 4 characters a token without tiktoken.
+
+    Args:
+        messages: The messages, as sent to the chat model.
+
+    Returns:
+        The number of tokens.
+    """
+    encoding = _encoding()
+    total = 0
+    for message in messages:
+        text = message.content if isinstance(message.content, str) else str(message.content)
+        total += TOKENS_PER_MESSAGE + (len(encoding.encode(text)) if encoding else len(text) // 4 + 1)
+    return total
+
+
+def _transcript(messages: Sequence[BaseMessage]) -> str:
+    """Write the messages of the user and the bot one per line, as in the saved txt files."""
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {message.content}")
+        elif isinstance(message, AIMessage):
+            lines.append(f"Bot: {message.content}")
+    return "\n".join(lines)
+
 
 class InMemoryHistory(BaseChatMessageHistory, BaseModel):
     """In-memory implementation of chat message history.
@@ -28,16 +81,359 @@ class InMemoryHistory(BaseChatMessageHistory, BaseModel):
         self.messages = []
 
 
+class HistoryBackend(ABC):
+    """Durable store of the messages of every conversation.
+
+    MemoryManager only keeps the recent sessions in memory and reads the others back from
+    its backend, so a backend must return every message ever appended to a conversation.
+    A backend must implement `load`, `append` and `clear`, the summaries are optional.
+    """
+
+    @abstractmethod
+    def load(self, user_id: str, conversation_id: str) -> List[BaseMessage]:
+        """Read the messages of a conversation, oldest first."""
+
+    @abstractmethod
+    def append(self, user_id: str, conversation_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Add new messages at the end of a conversation."""
+
+    @abstractmethod
+    def clear(self, user_id: str, conversation_id: str) -> None:
+        """Delete the messages of a conversation."""
+
+    def load_summary(self, user_id: str, conversation_id: str) -> Optional[Tuple[int, str]]:
+        """Read the summary of the older messages of a conversation and how many messages it covers.
+
+        Backends that don't store summaries return None, the summary is then written again
+        when an evicted conversation goes on.
+        """
+        return None
+
+    def save_summary(self, user_id: str, conversation_id: str, covered: int, summary: str) -> None:
+        """Replace the summary of the first `covered` messages of a conversation."""
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """History backend on the chat_messages table of the SQLite database.
+
+    Messages are only ever inserted, one row each, and read back in order through the
+    index on the user, conversation and message id.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """Initialize the backend.
+
+        Args:
+            db_path: Path to the database, defaults to `get_sqlite_database_path()`.
+        """
+        self.db_path = db_path
+
+    def load(self, user_id: str, conversation_id: str) -> List[BaseMessage]:
+        rows = get_pool(self.db_path).fetch_all(
+            """SELECT role, content FROM chat_messages
+            WHERE user_id = ? AND conversation_id = ? ORDER BY message_id""",
+            (str(user_id), str(conversation_id)),
+        )
+        return [MESSAGE_TYPES[role](content=content) for role, content in rows]
+
+    def append(self, user_id: str, conversation_id: str, messages: Sequence[BaseMessage]) -> None:
+        rows = [(str(user_id), str(conversation_id), message.type, message.content) for message in messages]
+        get_pool(self.db_path).run(
+            lambda db: db.executemany(
+                "INSERT INTO chat_messages (user_id, conversation_id, role, content) VALUES (?, ?, ?, ?)", rows
+            )
+        )
+
+    def clear(self, user_id: str, conversation_id: str) -> None:
+        key = (str(user_id), str(conversation_id))
+
+        def delete(db):
+            db.execute("DELETE FROM chat_messages WHERE user_id = ? AND conversation_id = ?", key)
+            db.execute("DELETE FROM chat_summaries WHERE user_id = ? AND conversation_id = ?", key)
+
+        get_pool(self.db_path).run(delete)
+
+    def load_summary(self, user_id: str, conversation_id: str) -> Optional[Tuple[int, str]]:
+        row = get_pool(self.db_path).fetch_one(
+            "SELECT covered_messages, summary FROM chat_summaries WHERE user_id = ? AND conversation_id = ?",
+            (str(user_id), str(conversation_id)),
+        )
+        return None if row is None else (row[0], row[1])
+
+    def save_summary(self, user_id: str, conversation_id: str, covered: int, summary: str) -> None:
+        get_pool(self.db_path).run(
+            lambda db: db.execute(
+                """INSERT INTO chat_summaries (user_id, conversation_id, covered_messages, summary)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, conversation_id)
+                DO UPDATE SET covered_messages = excluded.covered_messages, summary = excluded.summary""",
+                (str(user_id), str(conversation_id), covered, summary),
+            )
+        )
+
+
+class StoredHistory(BaseChatMessageHistory):
+    """History of one conversation, kept in memory and written through to a backend.
+
+    Only the new messages are appended to the backend, the ones already there are never
+    written again.
+    """
+
+    def __init__(self, backend: HistoryBackend, user_id: str, conversation_id: str, messages: List[BaseMessage]):
+        """Initialize the history of a conversation.
+
+        Args:
+            backend: Where the messages are stored.
+            user_id: Identifier for the user.
+            conversation_id: Identifier for the conversation.
+            messages: The messages already stored, oldest first.
+        """
+        self.backend = backend
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.messages = messages
+        self.last_used = time.monotonic()
+        # Summary of the older messages, read from the backend the first time it is needed
+        self._summary: Optional[Tuple[int, str]] = None
+        self._summary_loaded = False
+        # Held while a summary is written, so two replies at once don't both ask the model for it
+        self.summary_lock = threading.Lock()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append messages to the backend, then to the messages in memory."""
+        messages = list(messages)
+        self.backend.append(self.user_id, self.conversation_id, messages)
+        self.messages.extend(messages)
+
+    def clear(self) -> None:
+        """Delete the messages of the conversation."""
+        self.backend.clear(self.user_id, self.conversation_id)
+        self.messages = []
+        self._summary = None
+        self._summary_loaded = True
+
+    def get_summary(self) -> Optional[Tuple[int, str]]:
+        """The number of older messages summarized and their summary, None if there is none yet."""
+        if not self._summary_loaded:
+            self._summary = self.backend.load_summary(self.user_id, self.conversation_id)
+            self._summary_loaded = True
+        return self._summary
+
+    def set_summary(self, covered: int, summary: str) -> None:
+        """Store the summary of the first `covered` messages."""
+        self.backend.save_summary(self.user_id, self.conversation_id, covered, summary)
+        self._summary = (covered, summary)
+        self._summary_loaded = True
+
+
+class HistoryCompactor:
+    """Shortens the chat history given to the chains as a conversation grows.
+
+    The last turns are kept word for word, as many as fit in `max_tokens` and at most
+    `max_turns` of them. The turns before are folded into a rolling summary written by the
+    model and stored with the history, which is only extended with the turns that left the
+    window since it was written. Those are folded `fold_turns` at a time, so the model isn't
+    asked for a new summary on every message, and stay word for word until then.
+
+    The summary is written in a background thread once a reply is saved, so the user never
+    waits for it: building the prompt only reads the summary already stored.
+    """
+
+    def __init__(
+        self,
+        summarizer=None,
+        max_tokens: int = 1000,
+        max_turns: int = 6,
+        fold_turns: int = 2,
+        summary_words: int = 120,
+        max_workers: int = 2,
+    ):
+        """Initialize the compactor.
+
+        Args:
+            summarizer: Chat model writing the summaries, the older turns are dropped if not given.
+            max_tokens: Most tokens of the turns kept word for word.
+            max_turns: Most turns, a message of the user and the replies to it, kept word for word.
+            fold_turns: Turns out of the window it takes to write the summary again.
+            summary_words: Length the summary is asked to keep under.
+            max_workers: Most summaries written at the same time.
+        """
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.fold_turns = fold_turns
+        self.summary_words = summary_words
+        self.max_workers = max_workers
+        self.summary_chain = None
+        # Started with the first summary to write
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Set[Future] = set()
+        self._lock = threading.Lock()
+        if summarizer is not None:
+            prompt_template = PromptTemplate(
+                system_template="""
+                You keep the summary of a conversation between a fantasy football assistant and a user.
+                Add the new messages to the summary so far and answer with the new summary only.
+
+                Focus:
+                1. Keep the players, teams and gameweeks mentioned and the changes made to the user's team
+                2. Keep what the user said they like, want or plan to do
+                3. Use at most {summary_words} words
+                """,
+                human_template="Summary so far:\n{summary}\n\nNew messages:\n{messages}",
+            )
+            self.summary_chain = generate_prompt_templates(prompt_template, memory=False) | summarizer | StrOutputParser()
+
+    def _window_start(self, messages: List[BaseMessage], first: int) -> int:
+        """Index of the oldest message kept word for word, at the start of a turn and not before `first`."""
+        start = len(messages)
+        tokens = 0
+        turns = 0
+        for index in range(len(messages) - 1, first - 1, -1):
+            tokens += count_tokens([messages[index]])
+            if isinstance(messages[index], HumanMessage):
+                if turns == self.max_turns or tokens > self.max_tokens:
+                    break
+                turns += 1
+                start = index
+        return start
+
+    def compact(self, history: StoredHistory) -> List[BaseMessage]:
+        """Build the chat history to give the model from the stored summary, without calling the model.
+
+        Args:
+            history: The whole history of the conversation.
+
+        Returns:
+            The summary of the older turns as a system message, if there is one, then the last turns.
+        """
+        messages = list(history.messages)
+        covered, summary = history.get_summary() or (0, "")
+        if self.summary_chain is None:
+            return messages[self._window_start(messages, covered):]
+
+        # The turns out of the window but not folded yet are still given word for word
+        window = messages[covered:]
+        if summary:
+            window.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        return window
+
+    def refresh(self, history: StoredHistory) -> None:
+        """Write the summary again if `fold_turns` turns left the window since it was written.
+
+        Args:
+            history: The whole history of the conversation.
+        """
+        if self.summary_chain is None:
+            return
+        messages = list(history.messages)
+        covered, _ = history.get_summary() or (0, "")
+        start = self._window_start(messages, covered)
+        if sum(isinstance(message, HumanMessage) for message in messages[covered:start]) < self.fold_turns:
+            return
+        with history.summary_lock:
+            # Another reply may have folded these turns while we waited
+            covered, summary = history.get_summary() or (0, "")
+            if covered < start:
+                summary = self.summary_chain.invoke(
+                    {
+                        "summary": summary or "Nothing yet.",
+                        "messages": _transcript(messages[covered:start]),
+                        "summary_words": self.summary_words,
+                    }
+                )
+                history.set_summary(start, summary)
+
+    def schedule(self, history: StoredHistory) -> None:
+        """Refresh the summary of a conversation in a background thread, after its reply is saved.
+
+        Args:
+            history: The whole history of the conversation.
+        """
+        if self.summary_chain is None:
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="history-summary")
+            future = self._executor.submit(self.refresh, history)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future: Future) -> None:
+        """Forget a finished summary, reporting its error since nobody waits for it."""
+        with self._lock:
+            self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            # The prompts keep the unfolded turns word for word, the next reply tries again
+            print(f"Couldn't summarize the chat history: {future.exception()}")
+
+    def wait(self) -> None:
+        """Block until the summaries being written are stored."""
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+
+
+class CompactedHistory(BaseChatMessageHistory):
+    """The history of a conversation as given to the chains, compacted by a HistoryCompactor.
+
+    RunnableWithMessageHistory reads the compacted messages and adds the new ones, which go
+    to the whole history underneath and then start the refresh of its summary.
+    """
+
+    def __init__(self, history: StoredHistory, compactor: HistoryCompactor):
+        """Initialize the view.
+
+        Args:
+            history: The whole history of the conversation.
+            compactor: Builds the messages given to the chains.
+        """
+        self.history = history
+        self.compactor = compactor
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.compactor.compact(self.history)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add messages to the whole history, then fold the older turns into its summary in the background."""
+        self.history.add_messages(messages)
+        self.compactor.schedule(self.history)
+
+    def clear(self) -> None:
+        """Delete the messages of the conversation."""
+        self.history.clear()
+
+
 class MemoryManager:
     """Manages session history and configuration for user interactions.
 
-    Stores session-specific configurations and provides access to
-    session histories.
+    Every message is stored by the backend as soon as it is added. The histories of the
+    most recently used sessions are also kept in memory, up to `max_sessions` of them and
+    none idle for longer than `idle_seconds`, and the others are read back from the
+    backend when their conversation goes on.
     """
 
-    def __init__(self):
-        """Initialize session manager."""
-        self.store: Dict[Tuple[str, str], InMemoryHistory] = {}
+    def __init__(
+        self,
+        backend: Optional[HistoryBackend] = None,
+        max_sessions: int = 1024,
+        idle_seconds: float = 1800,
+        compactor: Optional[HistoryCompactor] = None,
+    ):
+        """Initialize session manager.
+
+        Args:
+            backend: Durable store of the messages, the chat_messages table of `balliq.db` by default.
+            max_sessions: Most sessions kept in memory, the least recently used ones are dropped first.
+            idle_seconds: Time after which an unused session is dropped from memory.
+            compactor: Shortens the histories given to the chains, they get every message if not given.
+        """
+        self.backend = backend or SQLiteHistoryBackend()
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.compactor = compactor
+        self.store: "OrderedDict[Tuple[str, str], StoredHistory]" = OrderedDict()
+        self._lock = threading.Lock()
         self.history_factory_config = [
             ConfigurableFieldSpec(
                 id="user_id",
@@ -57,6 +453,15 @@ class MemoryManager:
             ),
         ]
 
+    def _evict(self, now: float) -> None:
+        """Drop the least recently used sessions over the limit and the idle ones, under the lock."""
+        while self.store:
+            key, history = next(iter(self.store.items()))
+            if len(self.store) <= self.max_sessions and now - history.last_used <= self.idle_seconds:
+                break
+            # The least recently used session is first, once it is kept every other one is too
+            del self.store[key]
+
     def get_session_history(
         self, user_id: str, conversation_id: str
     ) -> BaseChatMessageHistory:
@@ -69,11 +474,38 @@ class MemoryManager:
         Returns:
             An instance of BaseChatMessageHistory for managing the chat history.
         """
-        if (user_id, conversation_id) not in self.store:
-            # Initialize new in-memory history if not already stored
-            self.store[(user_id, conversation_id)] = InMemoryHistory()
+        key = (user_id, conversation_id)
+        now = time.monotonic()
+        with self._lock:
+            history = self.store.get(key)
+            if history is not None:
+                history.last_used = now
+                self.store.move_to_end(key)
+                self._evict(now)
+                return history
+
+        # Read outside the lock so a slow read doesn't block every other session
+        history = StoredHistory(self.backend, user_id, conversation_id, self.backend.load(user_id, conversation_id))
+        with self._lock:
+            # Another thread may have loaded it meanwhile, both must share one history
+            history = self.store.setdefault(key, history)
+            history.last_used = now
+            self.store.move_to_end(key)
+            self._evict(now)
+            return history
+
+    def get_prompt_history(self, user_id: str, conversation_id: str) -> BaseChatMessageHistory:
+        """Retrieve the session history as given to the chains, compacted if there is a compactor.
+
+        Args:
+            user_id: Identifier for the user.
+            conversation_id: Identifier for the conversation.
 
-        return self.store[(user_id, conversation_id)]
+        Returns:
+            An instance of BaseChatMessageHistory whose new messages are added to the session history.
+        """
+        history = self.get_session_history(user_id, conversation_id)
+        return CompactedHistory(history, self.compactor) if self.compactor else history
 
     def get_history_factory_config(self) -> List[ConfigurableFieldSpec]:
         """Retrieve configuration settings for history factory.
@@ -86,6 +518,9 @@ class MemoryManager:
     def save_session_history(self, user_id: str, conversation_id: str) -> None:
         """Save the session history as a txt file.
 
+        The messages are already stored by the backend, the file is a readable copy that
+        is written again as a whole, so calling it several times doesn't repeat them.
+
         Args:
             user_id: Identifier for the user.
             conversation_id: Identifier for the conversation.
@@ -97,16 +532,15 @@ class MemoryManager:
 
         # Iterate over messages in the session history
         # and save them to a text file
-        file_path = f"Ball_IQ/BallIQ/chat_history/{user_id}_{conversation_id}_history.txt" 
-        
-        # Check if the directory exists, if not, create it 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True) 
-        
-        # Open the file in append mode if it exists, otherwise create and write to it 
-        with open(file_path, "a") as file:
+        file_path = f"Ball_IQ/BallIQ/chat_history/{user_id}_{conversation_id}_history.txt"
+
+        # Check if the directory exists, if not, create it
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        with open(file_path, "w") as file:
             for message in session_history.messages:
                 # Check if is HumanMessage or AIMessage
                 if isinstance(message, HumanMessage):
                     file.write(f"User: {message.content}\n")
                 elif isinstance(message, AIMessage):
-                    file.write(f"Bot: {message.content}\n")
\ No newline at end of file
+                    file.write(f"Bot: {message.content}\n")
@@ -0,0 +1,56 @@
+import statistics
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class ResponseMetrics:
+    """Thread-safe record of how fast the replies are streamed, per intent.
+
+    For each reply it keeps the time to the first chunk, which is what the user waits
+    before text starts to appear, and the time to the last one. Only the latest replies
+    of each intent are kept, so the percentiles follow the current behaviour.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        """Initialize the metrics without any reply.
+
+        Args:
+            max_samples: Replies kept per intent.
+        """
+        self._lock = threading.Lock()
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {}
+
+    def record(self, intent: Optional[str], first_chunk: float, total: float) -> None:
+        """Record one streamed reply.
+
+        Args:
+            intent: Intent the reply was routed to, None for replies given before routing.
+            first_chunk: Seconds from the message to the first chunk of the reply.
+            total: Seconds from the message to the end of the reply.
+        """
+        key = intent or "none"
+        with self._lock:
+            samples = self._samples.setdefault(key, deque(maxlen=self.max_samples))
+            samples.append((first_chunk, total))
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        """Return the count and the median and 95th percentile times in ms of each intent."""
+        with self._lock:
+            samples = {intent: list(values) for intent, values in self._samples.items()}
+
+        def percentile(values, share):
+            values = sorted(values)
+            return values[min(int(share * len(values)), len(values) - 1)] * 1000
+
+        return {
+            intent: {
+                "replies": len(values),
+                "first_chunk_ms_p50": statistics.median(first for first, _ in values) * 1000,
+                "first_chunk_ms_p95": percentile([first for first, _ in values], 0.95),
+                "total_ms_p50": statistics.median(total for _, total in values) * 1000,
+                "total_ms_p95": percentile([total for _, total in values], 0.95),
+            }
+            for intent, values in sorted(samples.items())
+        }
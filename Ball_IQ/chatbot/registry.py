@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+
+from chatbot.bot import MainChatbot
+from chatbot.resources import SharedResources
+
+
+class ChatbotRegistry:
+    """Process-wide, thread-safe factory of MainChatbot instances.
+
+    The user-independent parts (language model, router, retriever, player tables and
+    session memory) are built once in a SharedResources object and every bot handed out
+    by the registry is a light view on top of them. Bots are cached per user and
+    conversation, so Streamlit reruns get the same instance back instead of rebuilding it.
+    """
+
+    def __init__(self, resources=None, max_bots=1024):
+        """Initialize the registry.
+
+        Args:
+            resources: SharedResources used by every bot, built lazily if not given.
+            max_bots: Maximum number of bots kept, the least recently used ones are dropped first.
+        """
+        self.resources = resources or SharedResources()
+        self.max_bots = max_bots
+        self._bots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_chatbot(self, user_id, conversation_id) -> MainChatbot:
+        """Retrieve the bot of a user and conversation, creating it on the first call.
+
+        Args:
+            user_id: Identifier for the user.
+            conversation_id: Identifier for the conversation.
+
+        Returns:
+            A MainChatbot already logged in with the given identifiers.
+        """
+        key = (user_id, conversation_id)
+        with self._lock:
+            bot = self._bots.get(key)
+            if bot is not None:
+                self._bots.move_to_end(key)
+                return bot
+
+        # Build outside the lock so one slow construction doesn't block every other user
+        bot = MainChatbot(user_id, conversation_id, resources=self.resources)
+        bot.user_login(user_id, conversation_id)
+
+        with self._lock:
+            # Keep the first bot if another thread created one for the same key meanwhile
+            bot = self._bots.setdefault(key, bot)
+            self._bots.move_to_end(key)
+            while len(self._bots) > self.max_bots:
+                self._bots.popitem(last=False)
+        return bot
+
+    def discard(self, user_id, conversation_id) -> None:
+        """Drop the cached bot of a user and conversation, if there is one.
+
+        Args:
+            user_id: Identifier for the user.
+            conversation_id: Identifier for the conversation.
+        """
+        with self._lock:
+            self._bots.pop((user_id, conversation_id), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._bots)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ChatbotRegistry:
+    """Retrieve the registry shared by the whole process, creating it on the first call.
+
+    Returns:
+        The process-wide ChatbotRegistry.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ChatbotRegistry()
+    return _registry
+
+
+def get_chatbot(user_id, conversation_id) -> MainChatbot:
+    """Retrieve a bot for a user and conversation from the process-wide registry.
+
+    Args:
+        user_id: Identifier for the user.
+        conversation_id: Identifier for the conversation.
+
+    Returns:
+        A MainChatbot already logged in with the given identifiers.
+    """
+    return get_registry().get_chatbot(user_id, conversation_id)
@@ -0,0 +1,162 @@
+import os
+import threading
+
+from langchain_openai import ChatOpenAI
+
+from chatbot.chains.RAG import build_retriever
+from chatbot.memory import HistoryCompactor, MemoryManager
+from chatbot.metrics import ResponseMetrics
+from chatbot.response_cache import ResponseCache
+from chatbot.router.fast_path import FastPathRouter
+from chatbot.router.intent_service import IntentClassificationService
+from chatbot.router.loader import load_intention_classifier
+from chatbot.router.route_index import load_route_index
+from data.snapshot import PlayerDataSnapshot
+
+
+class SharedResources:
+    """Objects that do not depend on the user and can be shared by every chatbot in the process.
+
+    Each resource is built the first time it is requested and kept afterwards. Any of them
+    can be passed in already built, which is how the benchmarks swap in stub models.
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        intention_classifier=None,
+        retriever=None,
+        snapshot=None,
+        memory=None,
+        intent_service=None,
+        fast_router=None,
+        rephrase_responses=False,
+        response_cache=None,
+        retriever_backend=None,
+    ):
+        """Initialize the shared resources.
+
+        Args:
+            llm: Chat model used by every chain, defaults to gpt-4o-mini.
+            intention_classifier: RouteLayer used to classify the user intents.
+            retriever: Retriever used by the RAG chains.
+            snapshot: PlayerDataSnapshot with the player and fixture tables.
+            memory: MemoryManager holding the session histories of every user, compacted with the llm if not given.
+            intent_service: Object with `retrieve_multiple_routes`, built from the classifier if not given.
+            fast_router: Object with `classify`, tried before the intent service.
+            rephrase_responses: Whether the model rewrites the replies of the tools instead of the templates.
+            response_cache: ResponseCache of the replies that don't depend on the user.
+            retriever_backend: "local" or "pinecone", the `RETRIEVER_BACKEND` environment variable or "pinecone" if not given.
+        """
+        self._lock = threading.RLock()
+        self._llm = llm
+        self._intention_classifier = intention_classifier
+        self._retriever = retriever
+        self._snapshot = snapshot
+        self._memory = memory
+        self._intent_service = intent_service
+        self._fast_router = fast_router
+        # Replies from templates come back as soon as the tool is done, rephrasing costs a call to the model
+        self.rephrase_responses = rephrase_responses
+        self._response_metrics = None
+        self._response_cache = response_cache
+        self.retriever_backend = retriever_backend or os.getenv("RETRIEVER_BACKEND", "pinecone")
+
+    def _get_or_build(self, attribute, builder):
+        """Return a resource, building it under the lock if it does not exist yet.
+
+        Args:
+            attribute: Name of the attribute holding the resource.
+            builder: Callable without arguments that builds the resource.
+
+        Returns:
+            The shared resource.
+        """
+        value = getattr(self, attribute)
+        if value is None:
+            with self._lock:
+                # Another thread may have built it while we waited for the lock
+                value = getattr(self, attribute)
+                if value is None:
+                    value = builder()
+                    setattr(self, attribute, value)
+        return value
+
+    @property
+    def llm(self):
+        """Chat model shared by every chain."""
+        return self._get_or_build(
+            "_llm",
+            lambda: ChatOpenAI(
+                temperature=0.0, model="gpt-4o-mini", api_key=os.getenv("api_key")
+            ),
+        )
+
+    @property
+    def intention_classifier(self):
+        """RouteLayer loaded from `chatbot/router/layer.json`."""
+        return self._get_or_build("_intention_classifier", load_intention_classifier)
+
+    @property
+    def intent_service(self):
+        """Cached and batched intent classification over the RouteLayer routes."""
+        return self._get_or_build(
+            "_intent_service",
+            lambda: IntentClassificationService(
+                self.intention_classifier.encoder,
+                # Memory mapped from the precomputed sidecar of layer.json
+                load_route_index(encoder=self.intention_classifier.encoder),
+            ),
+        )
+
+    @property
+    def fast_router(self):
+        """Keyword router learned from the utterances of `chatbot/router/layer.json`."""
+        return self._get_or_build(
+            "_fast_router",
+            # Transfers and stats are only decided by a pattern when the message names a player or team
+            lambda: FastPathRouter.from_layer_json(name_index=lambda: self.snapshot.player_index),
+        )
+
+    @property
+    def retriever(self):
+        """Retriever over the documents used by the RAG chains."""
+        if self.retriever_backend != "local":
+            return self._get_or_build("_retriever", lambda: build_retriever(self.retriever_backend))
+        # The index is embedded with the router's MiniLM, and the questions come from the cache of the intent service
+        return self._get_or_build(
+            "_retriever",
+            lambda: build_retriever(
+                "local",
+                encoder=self.intention_classifier.encoder,
+                embed_query=self.intent_service.embed,
+            ),
+        )
+
+    @property
+    def snapshot(self):
+        """Snapshot of the player and fixture tables."""
+        return self._get_or_build("_snapshot", PlayerDataSnapshot)
+
+    @property
+    def memory(self):
+        """Session histories of every user and conversation, summarized by the chat model as they grow."""
+        return self._get_or_build("_memory", lambda: MemoryManager(compactor=HistoryCompactor(self.llm)))
+
+    @property
+    def response_metrics(self):
+        """Times to the first and last chunk of the replies streamed by every chatbot."""
+        return self._get_or_build("_response_metrics", ResponseMetrics)
+
+    @property
+    def response_cache(self):
+        """Replies of the intents that don't depend on the user, found by the embedding of the message and the names in it."""
+        return self._get_or_build(
+            "_response_cache",
+            lambda: ResponseCache(
+                self.intent_service.embed,
+                lambda: self.snapshot.version,
+                # Teams and players found like the entity patterns of the fast path find them
+                names=lambda text: self.snapshot.player_index.mentioned_names(text),
+            ),
+        )
@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from chatbot.router.intent_service import normalize_utterance
+
+# Intents whose replies are the same for every user until the player data changes
+STATELESS_INTENTS = ("know_information_about_stats", "chit_chat_about_company", "check_upcoming_fixtures")
+
+
+class CachedReply(NamedTuple):
+    """A reply kept by the cache, the embedding of its message, the names in it and when it stops being served."""
+
+    vector: np.ndarray
+    names: Tuple[str, ...]
+    reply: str
+    expires_at: float
+
+
+class CacheLookup(NamedTuple):
+    """The result of a lookup, passed back to `store` when the reply had to be written."""
+
+    intent: str
+    key: str
+    vector: Optional[np.ndarray]
+    names: Tuple[str, ...]
+    data_version: Hashable
+    reply: Optional[str]
+
+
+class ResponseCacheMetrics:
+    """Thread-safe counters of the response cache, per intent."""
+
+    def __init__(self):
+        """Initialize every counter at zero."""
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+
+    def record(self, intent: str, outcome: str) -> None:
+        """Count one lookup of an intent, `outcome` being "exact_hits", "similar_hits" or "misses"."""
+        with self._lock:
+            counts = self._counts.setdefault(intent, {"exact_hits": 0, "similar_hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    def record_evictions(self, count: int) -> None:
+        """Count replies dropped for lack of room."""
+        with self._lock:
+            self.evictions += count
+
+    def as_dict(self) -> Dict:
+        """Return a copy of the counters with the hit rate of each intent and of all of them."""
+        with self._lock:
+            intents = {intent: dict(counts) for intent, counts in sorted(self._counts.items())}
+            evictions = self.evictions
+        for counts in intents.values():
+            lookups = sum(counts.values())
+            counts["hit_rate"] = (counts["exact_hits"] + counts["similar_hits"]) / lookups if lookups else 0.0
+        lookups = sum(counts["exact_hits"] + counts["similar_hits"] + counts["misses"] for counts in intents.values())
+        hits = sum(counts["exact_hits"] + counts["similar_hits"] for counts in intents.values())
+        return {
+            "intents": intents,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": evictions,
+        }
+
+
+class ResponseCache:
+    """Replies of the intents that don't depend on the user, served again for similar messages.
+
+    A reply is found by the intent, the message and the version of the player data it was
+    written from. The same message, once normalized, is found without being embedded. Any
+    other message is embedded and matched with the replies of its intent whose embedding is
+    at least `similarity_threshold` close. Replies expire after `ttl_seconds`, the least
+    recently used ones are dropped past `max_entries`, and every reply is dropped when the
+    player data changes.
+
+    Only the intents of `STATELESS_INTENTS` can be cached, the others are bypassed. A
+    message only matches the replies of messages naming the same teams and players, as
+    "when does Liverpool play next" and "when does Arsenal play next" embed close to each
+    other. The replies also depend on the chat history the chains read, so the chatbot
+    only looks up the first message of a conversation, see `MainChatbot.lookup_cached_reply`.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], np.ndarray],
+        data_version: Callable[[], Hashable],
+        names: Optional[Callable[[str], Iterable[str]]] = None,
+        intents: Iterable[str] = STATELESS_INTENTS,
+        similarity_threshold: float = 0.92,
+        ttl_seconds: float = 3600,
+        max_entries: int = 1024,
+    ):
+        """Initialize an empty cache.
+
+        Args:
+            embed: Embeds a message, such as `IntentClassificationService.embed`.
+            data_version: Returns the current version of the player data, such as `PlayerDataSnapshot.version`.
+            names: Returns the teams and players a message names, such as `PlayerNameIndex.mentioned_names`.
+                Without it only the embeddings tell messages apart.
+            intents: Intents cached, each one of `STATELESS_INTENTS`.
+            similarity_threshold: Lowest cosine similarity of a message to a cached one to serve its reply.
+            ttl_seconds: Time a reply is served for.
+            max_entries: Most replies kept across every intent.
+        """
+        self.embed = embed
+        self.data_version = data_version
+        self.names = names
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.metrics = ResponseCacheMetrics()
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], CachedReply]" = OrderedDict()
+        self._version: Hashable = None
+        # Embeddings of the replies of each intent stacked in a matrix, rebuilt after a change
+        self._matrices: Dict[str, Tuple[List[Tuple[str, str]], np.ndarray, List[Tuple[str, ...]]]] = {}
+
+        self.intents = set()
+        for intent in intents:
+            self.enable(intent)
+
+    def enable(self, intent: str) -> None:
+        """Cache the replies of an intent.
+
+        Raises:
+            ValueError: If the replies of the intent depend on the user.
+        """
+        if intent not in STATELESS_INTENTS:
+            raise ValueError(f"The replies of '{intent}' depend on the user and can't be cached.")
+        self.intents.add(intent)
+
+    def disable(self, intent: str) -> None:
+        """Stop serving and storing the replies of an intent."""
+        self.intents.discard(intent)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == intent]:
+                del self._entries[key]
+            self._matrices.pop(intent, None)
+
+    def _check_version(self, version: Hashable) -> None:
+        """Drop every reply written from older player data, under the lock."""
+        if version != self._version:
+            self._entries.clear()
+            self._matrices.clear()
+            self._version = version
+
+    def _matrix(self, intent: str) -> Tuple[List[Tuple[str, str]], np.ndarray, List[Tuple[str, ...]]]:
+        """The keys, embeddings and names of the replies of an intent, under the lock."""
+        if intent not in self._matrices:
+            keys = [key for key in self._entries if key[0] == intent]
+            vectors = np.stack([self._entries[key].vector for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
+            self._matrices[intent] = (keys, vectors, [self._entries[key].names for key in keys])
+        return self._matrices[intent]
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        """Drop one reply, under the lock."""
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def _serve(self, key: Tuple[str, str], now: float) -> Optional[str]:
+        """Return a reply that hasn't expired and mark it as the most recently used, under the lock."""
+        entry = self._entries[key]
+        if entry.expires_at <= now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.reply
+
+    def lookup(self, intent: str, text: str) -> Optional[CacheLookup]:
+        """Find the cached reply to a message.
+
+        Args:
+            intent: Intent the message was routed to.
+            text: The message from the user.
+
+        Returns:
+            None if the intent isn't cached, else a CacheLookup whose reply is None on a miss.
+        """
+        if intent not in self.intents:
+            return None
+        version = self.data_version()
+        key = (intent, normalize_utterance(text))
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                reply = self._serve(key, now)
+                if reply is not None:
+                    self.metrics.record(intent, "exact_hits")
+                    return CacheLookup(intent, key[1], None, (), version, reply)
+
+        # Embedded outside of the lock, it may wait for the encoder
+        vector = np.asarray(self.embed(key[1]), dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        names = tuple(sorted(self.names(text))) if self.names else ()
+        with self._lock:
+            self._check_version(version)
+            keys, vectors, key_names = self._matrix(intent)
+            if keys:
+                # Only the replies to messages naming the same teams and players can match
+                similarities = np.where([other == names for other in key_names], vectors @ vector, -np.inf)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold and keys[best] in self._entries:
+                    reply = self._serve(keys[best], now)
+                    if reply is not None:
+                        self.metrics.record(intent, "similar_hits")
+                        return CacheLookup(intent, key[1], vector, names, version, reply)
+        self.metrics.record(intent, "misses")
+        return CacheLookup(intent, key[1], vector, names, version, None)
+
+    def store(self, lookup: CacheLookup, reply: str) -> None:
+        """Keep the reply written after a miss.
+
+        The reply isn't kept if the player data changed while it was written, or if it is empty.
+
+        Args:
+            lookup: The lookup that missed.
+            reply: The reply the chain wrote.
+        """
+        if lookup.intent not in self.intents or lookup.vector is None or not reply:
+            return
+        key = (lookup.intent, lookup.key)
+        version = self.data_version()
+        with self._lock:
+            self._check_version(version)
+            if lookup.data_version != version:
+                return
+            self._entries[key] = CachedReply(lookup.vector, lookup.names, reply, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._matrices.pop(lookup.intent, None)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._matrices.pop(oldest[0], None)
+                evicted += 1
+        if evicted:
+            self.metrics.record_evictions(evicted)
+
+    def clear(self) -> None:
+        """Drop every reply."""
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
@@ -0,0 +1,202 @@
+"""
+Evaluate the fast path router on the labelled messages of the router folder.
+
+Reports how many messages the fast path decides alone (coverage), how many of those
+it gets right, and how long a decision takes, overall and per route. Messages close to
+an intent without having it, in NEGATIVE_MESSAGES, are added to the held out messages so
+a wrong route they are sent to counts against the accuracy. The keywords are
+learned from `layer.json`, which shares its messages with `synthetic_intetions.json`,
+so use `--folds` for an estimate on messages the router has not seen.
+
+From the `Ball_IQ` folder:
+    python -m chatbot.router.evaluate_fast_path --folds 5
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from chatbot.router.fast_path import FastPathRouter
+from chatbot.router.loader import BASE_DIR
+from data.player_index import PlayerNameIndex
+
+SYNTHETIC_PATH = os.path.join(BASE_DIR, "synthetic_intetions.json")
+NEW_PATH = os.path.join(BASE_DIR, "new_intentions.json")
+# Messages that share words with an intent but must not be routed to it by the fast path
+NEGATIVE_MESSAGES = [
+    ("I want to buy a new car", "None"),
+    ("buy me a coffee", "None"),
+    ("sign me up for the newsletter", "None"),
+    ("what is my budget", "None"),
+    ("how much budget do I have left", "None"),
+    ("I recommend you try again later", "None"),
+    ("how are my team points calculated", "know_information_about_stats"),
+    ("how do team points work", "know_information_about_stats"),
+    ("what are the stats for a clean sheet", "know_information_about_stats"),
+    ("what formation do you like", "None"),
+    ("when does the season end", "None"),
+    ("is ball iq free", "chit_chat_about_company"),
+]
+
+
+def read_messages(file_path: str) -> List[Tuple[str, str]]:
+    """
+    Read a file of labelled messages, as written by `generate_intentions.ipynb`.
+
+    Args:
+        file_path (str): Path to the json file.
+
+    Returns:
+        list: Pairs of (message, intention), with "None" for messages without intention.
+    """
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    return [(row["Message"], str(row["Intention"])) for row in data]
+
+
+def evaluate(router: FastPathRouter, messages: List[Tuple[str, str]]) -> Dict:
+    """
+    Classify every message with the fast path router.
+
+    Args:
+        router (FastPathRouter): The router to evaluate.
+        messages (list): Pairs of (message, intention).
+
+    Returns:
+        dict: Counts of messages, covered messages and correct decisions, overall and per
+            route, the latency of each decision in milliseconds and the mistakes made.
+    """
+    per_route = defaultdict(lambda: {"messages": 0, "covered": 0, "correct": 0})
+    latencies, mistakes = [], []
+    for text, intention in messages:
+        start = time.perf_counter()
+        choice = router.classify(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        per_route[intention]["messages"] += 1
+        if choice is None:
+            continue
+        per_route[intention]["covered"] += 1
+        if choice.name == intention:
+            per_route[intention]["correct"] += 1
+        else:
+            mistakes.append((text, intention, choice.name))
+
+    return {
+        "messages": len(messages),
+        "covered": sum(route["covered"] for route in per_route.values()),
+        "correct": sum(route["correct"] for route in per_route.values()),
+        "per_route": dict(per_route),
+        "latencies": latencies,
+        "mistakes": mistakes,
+    }
+
+
+def cross_validate(messages: List[Tuple[str, str]], folds: int, seed: int = 0, **kwargs) -> Dict:
+    """
+    Learn the keywords on all folds but one and evaluate on the remaining one, in turn.
+
+    Args:
+        messages (list): Pairs of (message, intention).
+        folds (int): Number of folds.
+        seed (int): Seed of the shuffle that splits the folds.
+        **kwargs: Options passed to `FastPathRouter.from_examples`.
+
+    Returns:
+        dict: The results of `evaluate` added up over the folds.
+    """
+    shuffled = list(messages)
+    random.Random(seed).shuffle(shuffled)
+
+    total = None
+    for fold in range(folds):
+        test = shuffled[fold::folds]
+        train = [message for index, message in enumerate(shuffled) if index % folds != fold]
+        # Messages without intention are not a route, they only teach what to leave alone
+        router = FastPathRouter.from_examples(
+            [(text, intention) for text, intention in train if intention != "None"], **kwargs
+        )
+        result = evaluate(router, test)
+        if total is None:
+            total = result
+            continue
+        for key in ("messages", "covered", "correct"):
+            total[key] += result[key]
+        total["latencies"] += result["latencies"]
+        total["mistakes"] += result["mistakes"]
+        for route, counts in result["per_route"].items():
+            target = total["per_route"].setdefault(
+                route, {"messages": 0, "covered": 0, "correct": 0}
+            )
+            for key in counts:
+                target[key] += counts[key]
+    return total
+
+
+def print_report(title: str, result: Dict, show_mistakes: bool = False) -> None:
+    """
+    Print coverage, accuracy and latency of an evaluation.
+
+    Args:
+        title (str): Name of the evaluated data.
+        result (dict): Output of `evaluate` or `cross_validate`.
+        show_mistakes (bool): Whether to list the wrongly routed messages.
+    """
+    covered, correct, messages = result["covered"], result["correct"], result["messages"]
+    latencies = sorted(result["latencies"])
+    print(f"\n{title}")
+    print(f"  messages: {messages}")
+    print(f"  coverage: {covered / messages:.1%} ({covered} decided by the fast path)")
+    print(f"  accuracy on covered: {correct / covered if covered else 0:.1%}")
+    print(
+        f"  latency: mean {sum(latencies) / len(latencies):.3f} ms, "
+        f"p99 {latencies[int(0.99 * (len(latencies) - 1))]:.3f} ms"
+    )
+    print(f"  {'route':<32}{'messages':>10}{'coverage':>10}{'accuracy':>10}")
+    for route, counts in sorted(result["per_route"].items()):
+        coverage = counts["covered"] / counts["messages"]
+        accuracy = counts["correct"] / counts["covered"] if counts["covered"] else 0
+        print(f"  {route:<32}{counts['messages']:>10}{coverage:>10.1%}{accuracy:>10.1%}")
+    if show_mistakes:
+        for text, intention, predicted in result["mistakes"]:
+            print(f"  ! {predicted} instead of {intention}: {text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the fast path router.")
+    parser.add_argument(
+        "--folds", type=int, default=0,
+        help="Cross-validate on the synthetic messages with this many folds.",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.9, help="Minimum confidence of every route."
+    )
+    parser.add_argument(
+        "--mistakes", action="store_true", help="List the messages routed to the wrong intent."
+    )
+    args = parser.parse_args()
+
+    synthetic, new = read_messages(SYNTHETIC_PATH), read_messages(NEW_PATH)
+    name_index = PlayerNameIndex.from_database()
+    router = FastPathRouter.from_layer_json(default_threshold=args.threshold, name_index=lambda: name_index)
+    print_report("synthetic_intetions.json (keywords learned from layer.json)",
+                 evaluate(router, synthetic), args.mistakes)
+    print_report("new_intentions.json and NEGATIVE_MESSAGES (held out)",
+                 evaluate(router, new + NEGATIVE_MESSAGES), args.mistakes)
+    # Every negative message the fast path decides is listed, right or wrong
+    print_report("NEGATIVE_MESSAGES", evaluate(router, NEGATIVE_MESSAGES), show_mistakes=True)
+
+    if args.folds > 1:
+        print_report(
+            f"synthetic_intetions.json, {args.folds}-fold cross-validation",
+            cross_validate(synthetic, args.folds, default_threshold=args.threshold, name_index=lambda: name_index),
+            args.mistakes,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from semantic_router.schema import RouteChoice
+
+from chatbot.router.loader import FILE_PATH
+from data.player_index import PlayerNameIndex
+
+# Phrasings that leave no doubt about the intent: an action and what it applies to. A
+# pattern only decides the route when no pattern of another route matches the same message.
+PATTERNS = {
+    "transfer_players": [
+        r"\b(transfer|swap|sell|replace|trade)\b.+\b(for|with|and (buy|bring|sign|get))\b",
+        r"\bbring in\b.+\b(take|send|sell) out\b",
+        r"\b(take|send|sell) out\b.+\bbring in\b",
+        r"\bremove\b.+\band (get|bring) in\b",
+        r"^(please |i want to |i'd like to |i’d like to )?add\b.+\bto my (team|squad)\b",
+    ],
+    "view_or_update_team_points": [
+        r"\b(show|see|check|view|update|set|change|what('s| is| are)|how many)\b.*"
+        r"\b(my|team's|team)\s+(current\s+|total\s+|team\s+|fantasy\s+)?points\b"
+        r"(?!.*\b(calculated?|calculations?|work|works|mean|means|explain|rules?|scored|scoring)\b)",
+    ],
+    "check_upcoming_fixtures": [
+        r"\bwhen (does|do|is|are|will)\b.+\b(play|playing|face|facing|match|game)\b",
+        r"\bwho (will|does|do|is)\b.+\b(play|playing|face|facing)\b",
+        r"\b(next|upcoming) (fixtures?|games?|matches?|opponents?)\b",
+    ],
+    "putting_players_in_starting11": [
+        r"\b(put|add|move|bring|take|remove|drop)\b.+\b(starting (eleven|11|xi|lineup|line-up|team)|starters)\b",
+        r"^(please |can you |i want to )?bench\b.+\b(from|out of|in)\b",
+        r"\bmake\b.+\ba starter\b",
+    ],
+    "optimize_lineup": [
+        r"\b(use|play|switch to|change to|set|optimi[sz]e|best)\b.*\b\d-\d-\d(-\d)?\b",
+        r"\b(best|optimal|optimi[sz]e|change|switch|set)\b.*\b(formation|tactic)\b",
+    ],
+    "chit_chat_about_company": [
+        r"\b(what|who|tell me about|how)\b.*\bball ?iq\b",
+        r"\b(your|this|the) company\b",
+    ],
+    "recommend_players": [
+        r"\b(recommend|suggest)\b.*\b(players?|goalkeepers?|keepers?|defenders?|midfielders?|forwards?|strikers?|attackers?|signings?|transfers?)\b",
+        r"\b(recommend|suggest|best|good|cheap)\b.*\b(under|below|for|within)\s*([$€£]\s?\d|\d+(\.\d+)?\s?(m|[$€£]))",
+    ],
+}
+
+# Actions whose object, the named group "object", must name a player or a team from the
+# player name index, so "buy Saka" is a transfer and "buy a new car" is not
+ENTITY_PATTERNS = {
+    "transfer_players": [
+        r"^(please |can you |i want to |i'd like to |i’d like to )?(buy|sign)\b(?!.*\b(best|recommend|should)\b)(?P<object>.+)",
+    ],
+    "view_players_stats": [
+        r"\b(stats|statistics) (for|of|on)\b(?P<object>.+)",
+    ],
+}
+
+# Confidence of a pattern hit, checked against the route thresholds like a keyword decision
+PATTERN_CONFIDENCE = 0.95
+
+# Words that appear in every route and only add noise to the keyword statistics
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "you", "your", "to", "of", "for", "in", "on",
+    "is", "are", "and", "or", "can", "could", "please", "what", "how", "do", "does",
+    "it", "this", "that", "be", "with", "about", "tell", "want", "would", "like",
+    "i'd", "he", "his", "him", "will", "should",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a message into lower case words, with numbers and prices replaced by placeholders.
+
+    Args:
+        text: The message from the user.
+
+    Returns:
+        The list of words of the message.
+    """
+    text = text.lower()
+    text = re.sub(r"\b\d-\d-\d(-\d)?\b", " <formation> ", text)
+    text = re.sub(r"[$€£]\s?\d+(\.\d+)?|\d+(\.\d+)?\s?[$€£]", " <money> ", text)
+    text = re.sub(r"\b\d+(\.\d+)?\b", " <number> ", text)
+    return re.findall(r"<\w+>|[a-z][a-z']*", text)
+
+
+def extract_features(text: str) -> List[str]:
+    """Extract the unigrams and bigrams of a message, ignoring stopwords in unigrams.
+
+    Args:
+        text: The message from the user.
+
+    Returns:
+        The unique features of the message.
+    """
+    tokens = tokenize(text)
+    features = {token for token in tokens if token not in STOPWORDS}
+    features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+    return list(features)
+
+
+class FastPathRouter:
+    """First-stage router that decides obvious intents without running the encoder.
+
+    A message is routed by the hand-written PATTERNS when exactly one route matches, with
+    a confidence of `pattern_confidence` that must clear the route threshold, unless the
+    keywords clearly point to another route. Otherwise the unigrams and bigrams learned from the route utterances are weighed:
+    each feature votes for the routes it appeared in, proportionally to how often, and
+    the confidence is the share of the votes won by the best route. Below the route
+    threshold the message is left to the semantic router.
+    """
+
+    def __init__(
+        self,
+        feature_routes: Dict[str, Dict[str, float]],
+        thresholds: Optional[Dict[str, float]] = None,
+        default_threshold: float = 0.9,
+        min_evidence: float = 2.0,
+        min_keywords: int = 2,
+        patterns: Optional[Dict[str, List[str]]] = None,
+        entity_patterns: Optional[Dict[str, List[str]]] = None,
+        name_index: Optional[Callable[[], PlayerNameIndex]] = None,
+        pattern_confidence: float = PATTERN_CONFIDENCE,
+    ):
+        """Initialize the fast path router.
+
+        Args:
+            feature_routes: For each feature, the probability of each route and the key
+                "__weight__" with the weight of the feature's vote.
+            thresholds: Minimum confidence of each route, `default_threshold` if missing.
+            default_threshold: Minimum confidence for routes without their own threshold.
+            min_evidence: Minimum total vote weight of the best route.
+            min_keywords: Minimum number of known single words in the message, so one
+                domain word in an off-topic message is not enough.
+            patterns: Regular expressions of each route, defaults to PATTERNS.
+            entity_patterns: Regular expressions of each route whose "object" group must name
+                a player or team, defaults to ENTITY_PATTERNS.
+            name_index: Returns the current PlayerNameIndex, such as `lambda: snapshot.player_index`.
+                Without it the entity patterns never match.
+            pattern_confidence: Confidence of a route decided by a pattern.
+        """
+        self.feature_routes = feature_routes
+        self.thresholds = thresholds or {}
+        self.default_threshold = default_threshold
+        self.min_evidence = min_evidence
+        self.min_keywords = min_keywords
+        self.patterns = {
+            route: [re.compile(pattern, re.IGNORECASE) for pattern in route_patterns]
+            for route, route_patterns in (patterns if patterns is not None else PATTERNS).items()
+        }
+        self.entity_patterns = {
+            route: [re.compile(pattern, re.IGNORECASE) for pattern in route_patterns]
+            for route, route_patterns in (entity_patterns if entity_patterns is not None else ENTITY_PATTERNS).items()
+        }
+        self.name_index = name_index
+        self.pattern_confidence = pattern_confidence
+
+    @classmethod
+    def from_examples(
+        cls,
+        examples: Iterable[Tuple[str, str]],
+        min_support: int = 2,
+        min_purity: float = 0.75,
+        **kwargs,
+    ) -> "FastPathRouter":
+        """Learn the keyword statistics from labelled messages.
+
+        Args:
+            examples: Pairs of (message, route).
+            min_support: Minimum number of messages a feature must appear in.
+            min_purity: Minimum share of those messages that belong to a single route.
+            **kwargs: Options passed to the router.
+
+        Returns:
+            FastPathRouter with the learned keywords.
+        """
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        for text, route in examples:
+            for feature in extract_features(text):
+                counts[feature][route] += 1
+
+        feature_routes = {}
+        for feature, route_counts in counts.items():
+            support = sum(route_counts.values())
+            if support < min_support or max(route_counts.values()) / support < min_purity:
+                continue
+            votes = {route: count / support for route, count in route_counts.items()}
+            votes["__weight__"] = math.log1p(support)
+            feature_routes[feature] = votes
+        return cls(feature_routes, **kwargs)
+
+    @classmethod
+    def from_layer_json(cls, file_path: str = FILE_PATH, **kwargs) -> "FastPathRouter":
+        """Learn the keyword statistics from the utterances of a RouteLayer json file.
+
+        Args:
+            file_path: Path to the json file, defaults to `chatbot/router/layer.json`.
+            **kwargs: Options passed to `from_examples`.
+
+        Returns:
+            FastPathRouter with the learned keywords.
+        """
+        with open(file_path, "r") as file:
+            layer = json.load(file)
+        examples = [
+            (utterance, route["name"])
+            for route in layer["routes"]
+            for utterance in route["utterances"]
+        ]
+        return cls.from_examples(examples, **kwargs)
+
+    def match_patterns(self, text: str) -> List[str]:
+        """List the routes with at least one pattern matching the message."""
+        matched = [
+            route
+            for route, patterns in self.patterns.items()
+            if any(pattern.search(text) for pattern in patterns)
+        ]
+        if self.name_index is None:
+            return matched
+        for route, patterns in self.entity_patterns.items():
+            if route in matched:
+                continue
+            for pattern in patterns:
+                match = pattern.search(text)
+                if match and self.name_index().mentions(match.group("object")):
+                    matched.append(route)
+                    break
+        return matched
+
+    def score(self, text: str) -> Tuple[Dict[str, float], int]:
+        """Add up the keyword votes of each route for a message.
+
+        Args:
+            text: The message from the user.
+
+        Returns:
+            The vote weight of each route and the number of known single words.
+        """
+        evidence: Dict[str, float] = defaultdict(float)
+        keywords = 0
+        for feature in extract_features(text):
+            votes = self.feature_routes.get(feature)
+            if votes is None:
+                continue
+            keywords += " " not in feature
+            weight = votes["__weight__"]
+            for route, share in votes.items():
+                if route != "__weight__":
+                    evidence[route] += weight * share
+        return evidence, keywords
+
+    def classify(self, text: str) -> Optional[RouteChoice]:
+        """Route a message if the intent is obvious.
+
+        Args:
+            text: The message from the user.
+
+        Returns:
+            RouteChoice with the route and its confidence as similarity score, or None
+            when the message should go through the semantic router.
+        """
+        matched = self.match_patterns(text)
+        evidence, keywords = self.score(text)
+        keyword_choice = self._keyword_choice(evidence, keywords)
+        if len(matched) == 1:
+            route = matched[0]
+            # Keywords sure of another route overrule the pattern
+            if keyword_choice is not None and keyword_choice.name != route:
+                return None
+            if self.pattern_confidence >= self.thresholds.get(route, self.default_threshold):
+                return RouteChoice(name=route, similarity_score=self.pattern_confidence)
+
+        # Conflicting patterns are a strong hint the keywords will disagree too
+        if len(matched) > 1:
+            return None
+        return keyword_choice
+
+    def _keyword_choice(self, evidence: Dict[str, float], keywords: int) -> Optional[RouteChoice]:
+        """The route the keyword votes decide, or None when they aren't clear enough."""
+        if keywords < self.min_keywords or not evidence:
+            return None
+        route, best = max(evidence.items(), key=lambda item: item[1])
+        confidence = best / sum(evidence.values())
+        if best < self.min_evidence or confidence < self.thresholds.get(route, self.default_threshold):
+            return None
+        return RouteChoice(name=route, similarity_score=confidence)
@@ -0,0 +1,378 @@
+import json
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from semantic_router.schema import RouteChoice
+
+from chatbot.router.loader import FILE_PATH
+
+
+def normalize_utterance(text: str) -> str:
+    """Normalize a message so trivially different spellings share a cache entry.
+
+    The MiniLM tokenizer is uncased, so lower casing doesn't change the embedding.
+
+    Args:
+        text: The message from the user.
+
+    Returns:
+        The message in lower case, with collapsed whitespace and no trailing punctuation.
+    """
+    text = " ".join(text.lower().split())
+    return re.sub(r"[\s.!?]+$", "", text)
+
+
+class RouteMatrix:
+    """Normalized embeddings of every route utterance, scored with plain NumPy.
+
+    Reproduces `RouteLayer.retrieve_multiple_routes` with the "max" aggregation: the
+    `top_k` closest utterances are grouped by route, each route keeps its best score
+    and only routes above their threshold are returned. Unlike the RouteLayer the
+    choices are sorted by score, best first.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        route_names: List[str],
+        thresholds: Dict[str, float],
+        top_k: int = 5,
+        normalized: bool = False,
+        utterances: Optional[List[str]] = None,
+    ):
+        """Initialize the route matrix.
+
+        Args:
+            embeddings: Matrix with one row per utterance.
+            route_names: Route of each row of the matrix.
+            thresholds: Minimum score of each route.
+            top_k: Number of closest utterances considered per message.
+            normalized: Whether the rows are already float32 with unit norm, in which
+                case the matrix is used as is (a memory-mapped file stays mapped).
+            utterances: Text of each row of the matrix, if known.
+        """
+        if normalized:
+            self.embeddings = embeddings
+        else:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            self.embeddings = (embeddings / np.where(norms == 0, 1, norms)).astype(np.float32)
+        self.route_names = np.asarray(route_names)
+        self.utterances = np.asarray(utterances) if utterances is not None else None
+        self.thresholds = thresholds
+        self.top_k = min(top_k, len(route_names))
+
+    @classmethod
+    def from_layer_json(cls, encoder, file_path: str = FILE_PATH, top_k: int = 5) -> "RouteMatrix":
+        """Encode every utterance in a RouteLayer json file.
+
+        Args:
+            encoder: Encoder called with a list of texts, such as the RouteLayer encoder.
+            file_path: Path to the json file, defaults to `chatbot/router/layer.json`.
+            top_k: Number of closest utterances considered per message.
+
+        Returns:
+            RouteMatrix with the embeddings of every utterance.
+        """
+        with open(file_path, "r") as file:
+            layer = json.load(file)
+
+        route_names, utterances, thresholds = [], [], {}
+        for route in layer["routes"]:
+            thresholds[route["name"]] = route.get("score_threshold") or 0.5
+            for utterance in route["utterances"]:
+                route_names.append(route["name"])
+                utterances.append(utterance)
+
+        embeddings = np.asarray(encoder(utterances), dtype=np.float32)
+        return cls(embeddings, route_names, thresholds, top_k=top_k, utterances=utterances)
+
+    @classmethod
+    def from_route_layer(cls, route_layer) -> "RouteMatrix":
+        """Reuse the embeddings a RouteLayer already holds in its local index.
+
+        Args:
+            route_layer: A RouteLayer with a populated LocalIndex.
+
+        Returns:
+            RouteMatrix with the same utterances as the RouteLayer.
+        """
+        thresholds = {
+            route.name: route.score_threshold
+            if route.score_threshold is not None
+            else route_layer.score_threshold
+            for route in route_layer.routes
+        }
+        return cls(
+            np.asarray(route_layer.index.index, dtype=np.float32),
+            list(route_layer.index.routes),
+            thresholds,
+            top_k=route_layer.top_k,
+            utterances=route_layer.index.utterances,
+        )
+
+    def score(self, vectors: np.ndarray) -> List[List[RouteChoice]]:
+        """Score a batch of message embeddings against every route.
+
+        Args:
+            vectors: Matrix with one embedding per message.
+
+        Returns:
+            For each message, the routes above their threshold sorted by score.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        # One matrix product scores every message against every utterance
+        similarities = vectors @ self.embeddings.T
+        top = np.argpartition(similarities, -self.top_k, axis=1)[:, -self.top_k:]
+
+        results = []
+        for row, indexes in zip(similarities, top):
+            best: Dict[str, float] = {}
+            for index in indexes:
+                route = str(self.route_names[index])
+                best[route] = max(best.get(route, -1.0), float(row[index]))
+            choices = [
+                RouteChoice(name=route, similarity_score=score)
+                for route, score in best.items()
+                if score > self.thresholds.get(route, 0.5)
+            ]
+            choices.sort(key=lambda choice: choice.similarity_score, reverse=True)
+            results.append(choices)
+        return results
+
+
+class IntentServiceMetrics:
+    """Thread-safe counters of the intent classification service."""
+
+    def __init__(self):
+        """Initialize every counter at zero."""
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches = 0
+        self.encoded_messages = 0
+        self.max_batch_size = 0
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    def record_cache(self, hit: bool) -> None:
+        """Count one cache lookup."""
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_batch(self, size: int) -> None:
+        """Count one forward pass of the encoder with `size` messages."""
+        with self._lock:
+            self.batches += 1
+            self.encoded_messages += size
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+
+    def as_dict(self) -> Dict:
+        """Return a copy of the counters, plus the hit rate and mean batch size."""
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "cache_hit_rate": self.cache_hits / lookups if lookups else 0.0,
+                "batches": self.batches,
+                "encoded_messages": self.encoded_messages,
+                "mean_batch_size": self.encoded_messages / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            }
+
+
+class IntentClassificationService:
+    """Classify user intents with a cache, a micro-batching encoder and a NumPy scorer.
+
+    Repeated messages are answered from an LRU cache. New messages are queued and a
+    background thread encodes whatever is waiting in a single forward pass, so
+    concurrent sessions share the cost of the encoder. The embeddings are then scored
+    against a RouteMatrix.
+
+    It exposes `retrieve_multiple_routes`, so it can be used in place of the RouteLayer,
+    and `embed`, which gives the embedding of a message already classified from the cache.
+    """
+
+    def __init__(
+        self,
+        encoder,
+        route_matrix: RouteMatrix,
+        cache_size: int = 4096,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2.0,
+    ):
+        """Initialize the intent classification service.
+
+        Args:
+            encoder: Encoder called with a list of texts, such as the RouteLayer encoder.
+            route_matrix: Embeddings of the route utterances.
+            cache_size: Maximum number of messages kept in the cache.
+            max_batch_size: Maximum number of messages encoded in one forward pass.
+            max_wait_ms: How long the first message of a batch waits for others to join it.
+        """
+        self.encoder = encoder
+        self.route_matrix = route_matrix
+        self.cache_size = cache_size
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = IntentServiceMetrics()
+
+        # Routes of each normalized message and its embedding with unit norm
+        self._cache: "OrderedDict[str, Tuple[List[RouteChoice], np.ndarray]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def from_route_layer(cls, route_layer, **kwargs) -> "IntentClassificationService":
+        """Create the service from a loaded RouteLayer, reusing its encoder and embeddings.
+
+        Args:
+            route_layer: The RouteLayer returned by `load_intention_classifier`.
+            **kwargs: Options passed to the service.
+
+        Returns:
+            IntentClassificationService with the routes of the RouteLayer.
+        """
+        return cls(route_layer.encoder, RouteMatrix.from_route_layer(route_layer), **kwargs)
+
+    def retrieve_multiple_routes(self, text: str) -> List[RouteChoice]:
+        """Classify one message, blocking until its batch has been encoded.
+
+        Args:
+            text: The message from the user.
+
+        Returns:
+            The routes above their threshold sorted by score, best first.
+        """
+        choices, _ = self._lookup(text)
+        return list(choices)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed one message, with the same encoder and cache as the classification.
+
+        A message just classified is found in the cache, so it isn't encoded again.
+
+        Args:
+            text: The message from the user.
+
+        Returns:
+            The embedding of the normalized message, with unit norm.
+        """
+        _, vector = self._lookup(text, record=False)
+        return vector
+
+    def _lookup(self, text: str, record: bool = True) -> Tuple[List[RouteChoice], np.ndarray]:
+        """Find the routes and embedding of a message in the cache or queue it, blocking until it is encoded."""
+        key = normalize_utterance(text)
+        cached = self._cache_get(key, record)
+        if cached is not None:
+            return cached
+
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((key, future))
+        return future.result()
+
+    def classify_batch(self, texts: List[str]) -> List[List[RouteChoice]]:
+        """Classify several messages at once, encoding only the ones not cached.
+
+        Args:
+            texts: The messages to classify.
+
+        Returns:
+            The route choices of each message, in the same order.
+        """
+        keys = [normalize_utterance(text) for text in texts]
+        results = {key: self._cache_get(key) for key in set(keys)}
+        missing = [key for key, value in results.items() if value is None]
+        for start in range(0, len(missing), self.max_batch_size):
+            chunk = missing[start:start + self.max_batch_size]
+            results.update(zip(chunk, self._encode_and_score(chunk)))
+        return [list(results[key][0]) for key in keys]
+
+    def _cache_get(self, key: str, record: bool = True) -> Optional[Tuple[List[RouteChoice], np.ndarray]]:
+        """Look a normalized message up in the LRU cache, counting the hit or miss if `record` is set."""
+        with self._cache_lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+        if record:
+            self.metrics.record_cache(value is not None)
+        return value
+
+    def _cache_put(self, key: str, value: Tuple[List[RouteChoice], np.ndarray]) -> None:
+        """Store the routes and embedding of a normalized message, evicting the oldest entries."""
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _encode_and_score(self, keys: List[str]) -> List[Tuple[List[RouteChoice], np.ndarray]]:
+        """Encode unique messages in one forward pass, score them and cache the routes and embeddings."""
+        vectors = np.asarray(self.encoder(keys), dtype=np.float32)
+        self.metrics.record_batch(len(keys))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        results = list(zip(self.route_matrix.score(vectors), vectors))
+        for key, result in zip(keys, results):
+            self._cache_put(key, result)
+        return results
+
+    def _ensure_worker(self) -> None:
+        """Start the batching thread the first time a message is queued."""
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run, name="intent-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        """Block for one message, then gather the ones that arrive within `max_wait`."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                # Messages already waiting are taken even after the deadline
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        """Encode queued messages batch by batch for as long as the process lives."""
+        while True:
+            batch = self._collect_batch()
+            # The same message from two sessions is only encoded once
+            pending: Dict[str, List[Future]] = {}
+            for key, future in batch:
+                pending.setdefault(key, []).append(future)
+            try:
+                keys = list(pending)
+                for key, result in zip(keys, self._encode_and_score(keys)):
+                    for future in pending[key]:
+                        future.set_result(result)
+            except Exception as e:
+                for futures in pending.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
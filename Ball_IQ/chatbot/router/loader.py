@@ -1,6 +1,7 @@
 import os
 
 from semantic_router import RouteLayer
+from semantic_router.layer import LayerConfig
 
 FILENAME = "layer.json"
 BASE_DIR = os.path.dirname(__file__)
@@ -11,6 +12,9 @@ def load_intention_classifier() -> RouteLayer:
     """
     Load json a file in the `router` folder.
 
+    The utterance embeddings come from the precomputed sidecar next to the json file,
+    so the encoder is only run if the sidecar is missing or out of date.
+
     Returns:
         RouteLayer object to classify user intentions.
 
@@ -18,9 +22,24 @@ def load_intention_classifier() -> RouteLayer:
         ValueError: If the file type is not supported.
 
     """
+    # Imported here as route_index depends on the constants of this module
+    from chatbot.router.route_index import load_encoder, load_route_index, read_layer
+
     if not os.path.exists(FILE_PATH):
         raise FileNotFoundError(f"File not found: {FILE_PATH}")
 
-    rl = RouteLayer.from_json(FILE_PATH)
-
-    return rl
\ No newline at end of file
+    config = LayerConfig.from_file(FILE_PATH)
+    encoder = load_encoder(read_layer(FILE_PATH))
+    route_matrix = load_route_index(encoder=encoder)
+
+    # Passing the routes to RouteLayer would encode them again, fill the index ourselves
+    rl = RouteLayer(encoder=encoder)
+    for route in config.routes:
+        if route.score_threshold is None:
+            route.score_threshold = rl.score_threshold
+    rl.routes = config.routes
+    rl.index.index = route_matrix.embeddings
+    rl.index.routes = route_matrix.route_names
+    rl.index.utterances = route_matrix.utterances
+
+    return rl
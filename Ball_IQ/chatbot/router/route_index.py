@@ -0,0 +1,198 @@
+"""
+Precomputed embeddings of the route utterances, stored next to `layer.json`.
+
+Encoding the ~450 utterances with MiniLM is the slowest part of loading the router, and
+the result only changes when `layer.json` or the encoder change. The embeddings are
+written once to `layer_embeddings.npy` (float32, unit norm) with their route labels and
+a fingerprint in `layer_embeddings.json`; loading them is then a memory map.
+
+The sidecar isn't kept in git. Build or refresh it as a build step, from the `Ball_IQ`
+folder, otherwise the first start encodes the utterances and writes it:
+    python -m chatbot.router.route_index
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+from chatbot.router.intent_service import RouteMatrix
+from chatbot.router.loader import BASE_DIR, FILE_PATH
+
+INDEX_PATH = os.path.join(BASE_DIR, "layer_embeddings.npy")
+METADATA_PATH = os.path.join(BASE_DIR, "layer_embeddings.json")
+# Bump when the way embeddings are computed or stored changes
+INDEX_VERSION = 1
+
+
+def read_layer(file_path: str = FILE_PATH) -> Dict:
+    """
+    Read a RouteLayer json file.
+
+    Args:
+        file_path (str): Path to the json file, defaults to `chatbot/router/layer.json`.
+
+    Returns:
+        dict: The layer configuration.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def layer_fingerprint(layer: Dict) -> str:
+    """
+    Fingerprint of everything the embeddings depend on: the encoder and the utterances.
+
+    Args:
+        layer (dict): The layer configuration.
+
+    Returns:
+        str: Hex digest that changes whenever the embeddings would.
+    """
+    content = {
+        "version": INDEX_VERSION,
+        "encoder_type": layer["encoder_type"],
+        "encoder_name": layer["encoder_name"],
+        "routes": [[route["name"], route["utterances"]] for route in layer["routes"]],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_encoder(layer: Dict):
+    """
+    Create the encoder named in the layer configuration.
+
+    Args:
+        layer (dict): The layer configuration.
+
+    Returns:
+        The semantic_router encoder, e.g. HuggingFaceEncoder for MiniLM.
+    """
+    from semantic_router.encoders import AutoEncoder
+
+    return AutoEncoder(type=layer["encoder_type"], name=layer["encoder_name"]).model
+
+
+def build_route_index(
+    encoder=None,
+    file_path: str = FILE_PATH,
+    index_path: str = INDEX_PATH,
+    metadata_path: str = METADATA_PATH,
+) -> RouteMatrix:
+    """
+    Encode every utterance and write the sidecar files.
+
+    Args:
+        encoder (optional): Encoder to use, created from the layer configuration if not given.
+        file_path (str): Path to the layer json file.
+        index_path (str): Where to write the embeddings.
+        metadata_path (str): Where to write the route labels and fingerprint.
+
+    Returns:
+        RouteMatrix: The freshly built route matrix.
+    """
+    layer = read_layer(file_path)
+    encoder = encoder or load_encoder(layer)
+    route_matrix = RouteMatrix.from_layer_json(encoder, file_path=file_path)
+
+    metadata = {
+        "fingerprint": layer_fingerprint(layer),
+        "encoder_type": layer["encoder_type"],
+        "encoder_name": layer["encoder_name"],
+        "shape": list(route_matrix.embeddings.shape),
+        "route_names": route_matrix.route_names.tolist(),
+    }
+
+    # Write to temporary files first so a reader never maps a half written index
+    index_tmp, metadata_tmp = index_path + ".tmp", metadata_path + ".tmp"
+    with open(index_tmp, "wb") as file:
+        np.save(file, np.ascontiguousarray(route_matrix.embeddings, dtype=np.float32))
+    with open(metadata_tmp, "w") as file:
+        json.dump(metadata, file)
+    os.replace(index_tmp, index_path)
+    os.replace(metadata_tmp, metadata_path)
+
+    return route_matrix
+
+
+def read_route_index(
+    file_path: str = FILE_PATH,
+    index_path: str = INDEX_PATH,
+    metadata_path: str = METADATA_PATH,
+) -> Optional[RouteMatrix]:
+    """
+    Memory map the sidecar if it exists and matches the current layer configuration.
+
+    Args:
+        file_path (str): Path to the layer json file.
+        index_path (str): Path to the embeddings.
+        metadata_path (str): Path to the route labels and fingerprint.
+
+    Returns:
+        RouteMatrix backed by the mapped file, or None if the sidecar is missing or stale.
+    """
+    if not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+        return None
+
+    layer = read_layer(file_path)
+    with open(metadata_path, "r") as file:
+        metadata = json.load(file)
+    if metadata.get("fingerprint") != layer_fingerprint(layer):
+        return None
+
+    embeddings = np.load(index_path, mmap_mode="r")
+    if list(embeddings.shape) != metadata["shape"]:
+        return None
+
+    thresholds = {
+        route["name"]: route.get("score_threshold") or 0.5 for route in layer["routes"]
+    }
+    # Same fingerprint means same routes in the same order, so the texts line up with the rows
+    utterances = [utterance for route in layer["routes"] for utterance in route["utterances"]]
+    return RouteMatrix(
+        embeddings, metadata["route_names"], thresholds, normalized=True, utterances=utterances
+    )
+
+
+def load_route_index(encoder=None, file_path: str = FILE_PATH) -> RouteMatrix:
+    """
+    Load the route matrix from the sidecar, rebuilding the sidecar when it is stale.
+
+    Args:
+        encoder (optional): Encoder used only if the sidecar has to be rebuilt.
+        file_path (str): Path to the layer json file.
+
+    Returns:
+        RouteMatrix with the embeddings of every utterance.
+    """
+    route_matrix = read_route_index(file_path)
+    if route_matrix is None:
+        build_route_index(encoder=encoder, file_path=file_path)
+        route_matrix = read_route_index(file_path)
+    return route_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the route embedding sidecar of layer.json.")
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild even if the sidecar is up to date."
+    )
+    args = parser.parse_args()
+
+    if not args.force and read_route_index() is not None:
+        print(f"{INDEX_PATH} is up to date.")
+        return
+
+    route_matrix = build_route_index()
+    rows, dimensions = route_matrix.embeddings.shape
+    print(f"Wrote {rows} utterance embeddings of {dimensions} dimensions to {INDEX_PATH}.")
+
+
+if __name__ == "__main__":
+    main()
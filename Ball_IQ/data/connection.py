@@ -0,0 +1,265 @@
+"""
+Shared access to the SQLite database.
+
+Every thread borrows at most one connection from a bounded pool and gives it back when it
+is done, so Streamlit's threads never share a connection and never open more than
+`max_connections` of them. Connections are opened once with WAL journaling, so readers
+don't wait for writers, and with tuned pragmas and a statement cache that keeps the
+prepared statements of the queries run on them.
+
+Writes run in explicit transactions. When the database stays locked for longer than the
+busy timeout, the whole transaction is retried with exponential backoff.
+"""
+
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Mapping, Optional, Sequence, TypeVar, Union
+
+from data.loader import get_sqlite_database_path
+
+T = TypeVar("T")
+Parameters = Union[Sequence, Mapping[str, object]]
+
+# Applied to every new connection. journal_mode is stored in the database file itself.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    # With WAL a commit is still atomic and durable up to the last checkpoint
+    "synchronous": "NORMAL",
+    # Negative values are KiB: 16 MiB of page cache per connection
+    "cache_size": -16000,
+    # Read the file through a memory map, the database is far smaller than this
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# Prepared statements kept by each connection
+STATEMENT_CACHE_SIZE = 256
+# Messages of the errors raised when another connection holds the lock
+BUSY_ERRORS = ("database is locked", "database is busy", "database table is locked")
+
+
+def is_busy_error(error: Exception) -> bool:
+    """Tell whether an error comes from the database being locked by another connection."""
+    return isinstance(error, sqlite3.OperationalError) and any(message in str(error) for message in BUSY_ERRORS)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection is given back to the pool in time."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections, with at most one connection per thread.
+
+    Borrowing again from a thread that already holds a connection returns the same
+    connection, so helpers can nest without deadlocking the pool. The pool lends each
+    thread its own connection, so the chains and tools using it work from any thread.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_connections: int = 8,
+        busy_timeout: float = 5.0,
+        acquire_timeout: float = 30.0,
+        retries: int = 5,
+        retry_delay: float = 0.02,
+        pragmas: Optional[Dict[str, object]] = None,
+    ):
+        """
+        Initialize the pool, connections are only opened when needed.
+
+        Args:
+            db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+            max_connections (int): Maximum number of open connections.
+            busy_timeout (float): Seconds SQLite waits for a lock before raising.
+            acquire_timeout (float): Seconds a thread waits for a free connection.
+            retries (int): Times a transaction is retried when the database stays locked.
+            retry_delay (float): Wait before the first retry, doubled on each one.
+            pragmas (dict, optional): Pragmas of the new connections, `PRAGMAS` if not given.
+        """
+        self.db_path = db_path or get_sqlite_database_path()
+        self.max_connections = max_connections
+        self.busy_timeout = busy_timeout
+        self.acquire_timeout = acquire_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the pool settings."""
+        db = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            # Transactions are opened explicitly by `transaction`
+            isolation_level=None,
+            # The connection moves between threads, but only one thread holds it at a time
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma, value in self.pragmas.items():
+            db.execute(f"PRAGMA {pragma} = {value}")
+        return db
+
+    def _acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, open a new one while under the bound, or wait for one."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._opened) < self.max_connections:
+                db = self._connect()
+                self._opened.append(db)
+                return db
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No connection to {self.db_path} was free after {self.acquire_timeout:g} s") from None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow the connection of the current thread.
+
+        Yields:
+            sqlite3.Connection: Connection in autocommit mode, given back on exit.
+        """
+        held = getattr(self._local, "db", None)
+        if held is not None:
+            yield held
+            return
+        db = self._acquire()
+        self._local.db = db
+        try:
+            yield db
+        finally:
+            self._local.db = None
+            # Never give back a connection in the middle of a transaction
+            if db.in_transaction:
+                db.rollback()
+            self._idle.put(db)
+
+    @contextmanager
+    def transaction(self, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Run statements in one transaction, committed on success and rolled back on error.
+
+        Args:
+            immediate (bool): Take the write lock at the start, so the reads of the
+                transaction can't be invalidated by another writer before it writes.
+
+        Yields:
+            sqlite3.Connection: Connection inside the transaction.
+        """
+        with self.connection() as db:
+            if db.in_transaction:
+                # Nested in a transaction of the same thread, which commits for both
+                yield db
+                return
+            db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield db
+            except BaseException:
+                db.rollback()
+                raise
+            db.commit()
+
+    def _retry(self, attempt_once: Callable[[], T]) -> T:
+        """Call a function again, with exponential backoff, while it fails on a locked database."""
+        held = getattr(self._local, "db", None)
+        if held is not None and held.in_transaction:
+            # Only the outermost transaction can be retried as a whole
+            return attempt_once()
+        for attempt in range(self.retries + 1):
+            try:
+                return attempt_once()
+            except sqlite3.OperationalError as error:
+                if not is_busy_error(error) or attempt == self.retries:
+                    raise
+                # Jitter keeps the threads that collided from retrying in lockstep
+                time.sleep(self.retry_delay * 2 ** attempt * (0.5 + random.random()))
+        raise AssertionError("unreachable")
+
+    def run(self, work: Callable[[sqlite3.Connection], T], immediate: bool = True) -> T:
+        """
+        Run a function in a transaction, retrying it while the database is locked.
+
+        Args:
+            work (callable): Receives the connection, its return value is returned. It may
+                run more than once, so it should only touch the database.
+            immediate (bool): See `transaction`.
+
+        Returns:
+            The value returned by `work`.
+        """
+
+        def attempt_once():
+            with self.transaction(immediate=immediate) as db:
+                return work(db)
+
+        return self._retry(attempt_once)
+
+    def fetch_all(self, query: str, parameters: Parameters = ()) -> List[tuple]:
+        """
+        Run a read query, retrying it while the database is locked.
+
+        Args:
+            query (str): The SQL query.
+            parameters (sequence or dict): Values of its placeholders.
+
+        Returns:
+            list: Rows of the result.
+        """
+
+        def attempt_once():
+            with self.connection() as db:
+                return db.execute(query, parameters).fetchall()
+
+        return self._retry(attempt_once)
+
+    def fetch_one(self, query: str, parameters: Parameters = ()) -> Optional[tuple]:
+        """Run a read query and return its first row, None if there is none."""
+        rows = self.fetch_all(query, parameters)
+        return rows[0] if rows else None
+
+    def close(self) -> None:
+        """Close every connection of the pool, idle or not."""
+        with self._lock:
+            for db in self._opened:
+                db.close()
+            self._opened.clear()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """
+    Get the process-wide pool of a database, created on first use after migrating its schema.
+
+    Args:
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        ConnectionPool: The same pool for every caller of the same database.
+    """
+    # Imported here, the migrations use modules that depend on this one
+    from data.migrations import migrate
+
+    db_path = db_path or get_sqlite_database_path()
+    with _pools_lock:
+        if db_path not in _pools:
+            migrate(db_path)
+            _pools[db_path] = ConnectionPool(db_path)
+        return _pools[db_path]
@@ -0,0 +1,291 @@
+"""
+Load `players.csv` and the fixtures CSV into the database.
+
+This replaces the cells of `data/database/create_database.ipynb` that filled
+`players_fantasy`, `player_stats` and `fixtures`, so the data of a new gameweek is loaded
+with one command. Run from the `Ball_IQ` folder:
+    python -m data.etl --players data/database/players.csv --fixtures data/database/epl-fixtures-2025.csv
+
+The CSV files are read row by row and each row is compared with the one already stored:
+only new and changed rows are written, in chunked `executemany` upserts, and the whole load
+is a single transaction, so the app never sees half a gameweek. Players missing from the
+CSV are kept, since user squads still point at them.
+"""
+
+import argparse
+import csv
+import os
+import sqlite3
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from data.connection import get_pool
+from data.loader import BASE_DIR
+from data.migrations import name_key
+
+# Rows written by each executemany
+CHUNK_SIZE = 500
+# Gameweek given to new players when the database has none yet, as in the notebook
+DEFAULT_NEXT_WEEK = 20
+
+# Team names of players.csv and the names used in the fixtures
+TEAMS = {
+    "Arsenal": "Arsenal",
+    "Aston Villa": "Aston Villa",
+    "Bournemouth": "Bournemouth",
+    "Brentford": "Brentford",
+    "Brighton": "Brighton",
+    "Chelsea": "Chelsea",
+    "Crystal Palace": "Crystal Palace",
+    "Everton": "Everton",
+    "Fulham": "Fulham",
+    "Ipswich": "Ipswich Town",
+    "Leicester": "Leicester City",
+    "Liverpool": "Liverpool",
+    "Man City": "Manchester City",
+    "Man Utd": "Manchester United",
+    "Newcastle": "Newcastle United",
+    "Nott'm Forest": "Nottingham Forest",
+    "Southampton": "Southampton",
+    "Spurs": "Tottenham",
+    "West Ham": "West Ham",
+    "Wolves": "Wolves",
+}
+POSITIONS = {"GKP": "Goalkeeper", "DEF": "Defender", "MID": "Midfielder", "FWD": "Forward"}
+
+
+class Table(NamedTuple):
+    """How the rows of a CSV file map to a table."""
+
+    name: str
+    key: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    # Columns only written when the row is inserted, later loads leave them as they are
+    insert_only: Tuple[str, ...] = ()
+
+
+PLAYERS = Table(
+    "players_fantasy",
+    key=("player_id",),
+    columns=(
+        "name", "name_key", "team", "position", "price", "price_evolution", "points_per_game",
+        "form_rank", "total_fantasy_points", "expected_points_next_game",
+    ),
+    # Moved forward by the gameweek rollover, not by the CSV
+    insert_only=("next_week",),
+)
+STATS = Table(
+    "player_stats",
+    key=("player_id",),
+    columns=(
+        "goals", "assists", "yellow_cards", "red_cards", "penalties_defended", "own_goals",
+        "clean_sheets", "saves", "starts", "penalties_missed",
+    ),
+)
+FIXTURES = Table("fixtures", key=("week", "home_team", "away_team"), columns=("date",))
+
+
+class LoadReport(NamedTuple):
+    """What a load did to one table."""
+
+    table: str
+    read: int
+    inserted: int
+    updated: int
+    seconds: float
+
+    @property
+    def unchanged(self) -> int:
+        return self.read - self.inserted - self.updated
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.read / self.seconds if self.seconds else float("inf")
+
+
+def read_csv(path: str) -> Iterator[Dict[str, str]]:
+    """Stream the rows of a CSV file as dicts."""
+    with open(path, newline="", encoding="utf-8") as handle:
+        yield from csv.DictReader(handle)
+
+
+def player_rows(row: Dict[str, str]) -> Tuple[tuple, tuple]:
+    """
+    Map a row of players.csv to its players_fantasy and player_stats rows.
+
+    Returns:
+        tuple: The players_fantasy row, in the order of PLAYERS, and the player_stats row.
+    """
+    player_id = int(row["id"])
+    player = (
+        player_id,
+        row["name"],
+        name_key(row["name"]),
+        TEAMS.get(row["team"], row["team"]),
+        POSITIONS.get(row["position"], row["position"]),
+        # Prices are stored in millions, the CSV has tenths of a million
+        int(row["now_cost"]) / 10,
+        int(row["cost_change_start"]) / 10,
+        float(row["points_per_game"]),
+        int(row["form_rank_type"]),
+        int(row["total_points"]),
+        float(row["ep_next"]),
+    )
+    stats = (
+        player_id,
+        int(row["goals_scored"]),
+        int(row["assists"]),
+        int(row["yellow_cards"]),
+        int(row["red_cards"]),
+        int(row["penalties_saved"]),
+        int(row["own_goals"]),
+        int(row["clean_sheets"]),
+        int(row["saves"]),
+        int(row["starts"]),
+        int(row["penalties_missed"]),
+    )
+    return player, stats
+
+
+def fixture_row(row: Dict[str, str]) -> tuple:
+    """Map a row of the fixtures CSV to its fixtures row, in the order of FIXTURES."""
+    return int(row["week"]), row["home"], row["away"], row["date"]
+
+
+def _chunks(rows: Iterable[tuple], size: int) -> Iterator[List[tuple]]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _upsert_statement(table: Table) -> str:
+    columns = table.key + table.columns + table.insert_only
+    updates = ", ".join(f"{column} = excluded.{column}" for column in table.columns)
+    return f"""INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT({', '.join(table.key)}) DO UPDATE SET {updates}"""
+
+
+def upsert(
+    db: sqlite3.Connection,
+    table: Table,
+    rows: Iterable[tuple],
+    insert_only: Sequence = (),
+    chunk_size: int = CHUNK_SIZE,
+) -> LoadReport:
+    """
+    Write the new and changed rows of a table, in chunks.
+
+    Args:
+        db (sqlite3.Connection): Connection inside the transaction of the load.
+        table (Table): The table written.
+        rows (iterable): Rows with the key then the columns of the table, in its order.
+        insert_only (sequence): Values of the insert-only columns of new rows.
+        chunk_size (int): Rows written by each executemany.
+
+    Returns:
+        LoadReport: Rows read, inserted and updated.
+    """
+    start = time.perf_counter()
+    width = len(table.key)
+    stored = {
+        row[:width]: row[width:]
+        for row in db.execute(f"SELECT {', '.join(table.key + table.columns)} FROM {table.name}")
+    }
+    counts = {"read": 0, "inserted": 0, "updated": 0}
+
+    def changed() -> Iterator[tuple]:
+        for row in rows:
+            counts["read"] += 1
+            current = stored.get(row[:width])
+            if current is None:
+                counts["inserted"] += 1
+            elif current != row[width:]:
+                counts["updated"] += 1
+            else:
+                continue
+            yield (*row, *insert_only)
+
+    statement = _upsert_statement(table)
+    for chunk in _chunks(changed(), chunk_size):
+        db.executemany(statement, chunk)
+    return LoadReport(table.name, **counts, seconds=time.perf_counter() - start)
+
+
+def load(
+    players_path: Optional[str] = None,
+    fixtures_path: Optional[str] = None,
+    db_path: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> List[LoadReport]:
+    """
+    Load the players and fixtures CSV files into the database in a single transaction.
+
+    Args:
+        players_path (str, optional): Path to players.csv, skipped when missing.
+        fixtures_path (str, optional): Path to the fixtures CSV, skipped when missing.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+        chunk_size (int): Rows written by each executemany.
+
+    Returns:
+        list: A LoadReport for each table loaded.
+    """
+
+    def work(db: sqlite3.Connection) -> List[LoadReport]:
+        reports = []
+        if players_path:
+            next_week = db.execute("SELECT MAX(next_week) FROM players_fantasy").fetchone()[0] or DEFAULT_NEXT_WEEK
+            # Stats are kept aside while the players are written, their rows point at the players
+            stats = []
+
+            def players() -> Iterator[tuple]:
+                for row in read_csv(players_path):
+                    player, player_stats = player_rows(row)
+                    stats.append(player_stats)
+                    yield player
+
+            reports.append(upsert(db, PLAYERS, players(), (next_week,), chunk_size))
+            reports.append(upsert(db, STATS, stats, chunk_size=chunk_size))
+        if fixtures_path:
+            rows = (fixture_row(row) for row in read_csv(fixtures_path))
+            reports.append(upsert(db, FIXTURES, rows, chunk_size=chunk_size))
+        return reports
+
+    return get_pool(db_path).run(work)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> List[LoadReport]:
+    folder = os.path.join(BASE_DIR, "database")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--players", default=os.path.join(folder, "players.csv"), help="Path to players.csv.")
+    parser.add_argument(
+        "--fixtures", default=os.path.join(folder, "epl-fixtures-2025.csv"), help="Path to the fixtures CSV."
+    )
+    parser.add_argument("--db", default=None, help="Path to the database, balliq.db by default.")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows written by each executemany.")
+    parser.add_argument("--skip-players", action="store_true", help="Don't load players.csv.")
+    parser.add_argument("--skip-fixtures", action="store_true", help="Don't load the fixtures.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    reports = load(
+        None if args.skip_players else args.players,
+        None if args.skip_fixtures else args.fixtures,
+        args.db,
+        args.chunk_size,
+    )
+    elapsed = time.perf_counter() - start
+
+    print(f"{'table':<17}{'read':>7}{'inserted':>10}{'updated':>9}{'unchanged':>11}{'rows/s':>10}")
+    for table in reports:
+        print(
+            f"{table.table:<17}{table.read:>7}{table.inserted:>10}{table.updated:>9}"
+            f"{table.unchanged:>11}{table.rows_per_second:>10.0f}"
+        )
+    read = sum(table.read for table in reports)
+    print(f"{read} rows in {elapsed * 1000:.0f} ms, {read / elapsed:.0f} rows/s")
+    return reports
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Gameweek rollover: score every user and apply the new prices in one batch job.
+
+Once a gameweek is played, the points of each player in it and the new prices are read
+from a feed with the columns of `players.csv` (`id`, `event_points`, `now_cost`). They
+are copied into temporary tables, then set-based statements do the rest:
+
+    users.points                    += points of the user's starting eleven, never below 0
+    players_fantasy.price_evolution += new price - old price
+    players_fantasy.next_week        = the following gameweek
+
+Users are scored in batches of user ids, to report progress, inside one transaction, so
+the app sees the whole rollover or none of it. Each scored gameweek is recorded in
+`gameweek_rollovers` and can't be scored twice. Run from the `Ball_IQ` folder:
+    python -m data.gameweek --feed data/database/players.csv --week 20
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+from data.connection import get_pool
+from data.etl import read_csv
+from data.loader import BASE_DIR
+
+# Users scored by each UPDATE, by range of user ids
+BATCH_SIZE = 20000
+
+
+class RolloverError(Exception):
+    """Raised when a gameweek can't be rolled over, with the reason."""
+
+
+class GameweekFeed(NamedTuple):
+    """Points scored by each player in the gameweek and the new prices, by player_id."""
+
+    points: Dict[int, int]
+    prices: Dict[int, float]
+
+
+class RolloverReport(NamedTuple):
+    """What a rollover changed."""
+
+    week: int
+    users_scored: int
+    prices_changed: int
+    seconds: float
+
+
+def read_feed(path: str, points_column: str = "event_points", price_column: str = "now_cost") -> GameweekFeed:
+    """
+    Read the gameweek points and prices of every player from a CSV file.
+
+    Args:
+        path (str): CSV file with an `id` column, e.g. players.csv.
+        points_column (str): Column with the points of the gameweek.
+        price_column (str): Column with the price, in tenths of a million as in players.csv.
+
+    Returns:
+        GameweekFeed: The points and prices by player_id.
+    """
+    points, prices = {}, {}
+    for row in read_csv(path):
+        player_id = int(row["id"])
+        points[player_id] = int(row[points_column])
+        prices[player_id] = int(row[price_column]) / 10
+    return GameweekFeed(points, prices)
+
+
+def _fill_temp_table(db: sqlite3.Connection, name: str, value: str, rows: Iterable[Tuple[int, float]]) -> None:
+    """Replace a temporary table of (player_id, value) rows, seen only by this connection."""
+    db.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    db.execute(f"CREATE TEMP TABLE {name} (player_id INTEGER PRIMARY KEY, {value} REAL NOT NULL)")
+    db.executemany(f"INSERT INTO temp.{name} (player_id, {value}) VALUES (?, ?)", rows)
+
+
+def score_users(
+    db: sqlite3.Connection,
+    batch_size: int = BATCH_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Add the points of temp.gameweek_points scored by their starting eleven to every user,
+    the points of the captain counting twice.
+
+    Args:
+        db (sqlite3.Connection): Connection inside the transaction of the rollover.
+        batch_size (int): Range of user ids scored by each UPDATE.
+        progress (callable, optional): Called with the users scored so far and the total.
+
+    Returns:
+        int: Number of users whose points were updated.
+    """
+    first, last, total = db.execute("SELECT MIN(user_id), MAX(user_id), COUNT(*) FROM users").fetchone()
+    if not total:
+        return 0
+    scored = 0
+    for start in range(first, last + 1, batch_size):
+        end = start + batch_size - 1
+        # One pass over the starters of the batch, through the primary key of user_team
+        scored += db.execute(
+            """
+            UPDATE users SET points = MAX(users.points + gameweek.points, 0)
+            FROM (
+                SELECT ut.user_id, SUM(g.points * (1 + ut.captain)) AS points
+                FROM user_team ut
+                JOIN temp.gameweek_points g ON g.player_id = ut.player_id
+                WHERE ut.user_id BETWEEN ? AND ? AND ut.on_team = 1 AND ut.starting_eleven = 1
+                GROUP BY ut.user_id
+            ) AS gameweek
+            WHERE users.user_id = gameweek.user_id AND gameweek.points != 0
+            """,
+            (start, end),
+        ).rowcount
+        if progress:
+            done = db.execute("SELECT COUNT(*) FROM users WHERE user_id <= ?", (end,)).fetchone()[0]
+            progress(done, total)
+    return scored
+
+
+def update_prices(db: sqlite3.Connection) -> int:
+    """
+    Set the prices of temp.gameweek_prices and add their change to price_evolution.
+
+    Returns:
+        int: Number of players whose price changed.
+    """
+    return db.execute(
+        """
+        UPDATE players_fantasy
+        SET price_evolution = ROUND(players_fantasy.price_evolution + p.price - players_fantasy.price, 1),
+            price = p.price
+        FROM temp.gameweek_prices p
+        WHERE p.player_id = players_fantasy.player_id AND p.price != players_fantasy.price
+        """
+    ).rowcount
+
+
+def rollover(
+    feed: GameweekFeed,
+    week: Optional[int] = None,
+    update_price: bool = True,
+    db_path: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> RolloverReport:
+    """
+    Score a gameweek for every user and apply its prices, in a single transaction.
+
+    Args:
+        feed (GameweekFeed): Points and prices of the gameweek, see `read_feed`.
+        week (int, optional): The gameweek scored, by default the next_week of the players.
+        update_price (bool): Whether to apply the prices of the feed.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+        batch_size (int): Range of user ids scored by each UPDATE.
+        progress (callable, optional): Called with the users scored so far and the total.
+
+    Returns:
+        RolloverReport: The users scored and the prices changed.
+
+    Raises:
+        RolloverError: If the gameweek was already scored.
+    """
+    start = time.perf_counter()
+
+    def work(db: sqlite3.Connection) -> RolloverReport:
+        scored_week = week
+        if scored_week is None:
+            scored_week = db.execute("SELECT MAX(next_week) FROM players_fantasy").fetchone()[0]
+        if db.execute("SELECT 1 FROM gameweek_rollovers WHERE week = ?", (scored_week,)).fetchone():
+            raise RolloverError(f"Gameweek {scored_week} was already scored.")
+
+        _fill_temp_table(db, "gameweek_points", "points", feed.points.items())
+        users_scored = score_users(db, batch_size, progress)
+        prices_changed = 0
+        if update_price:
+            _fill_temp_table(db, "gameweek_prices", "price", feed.prices.items())
+            prices_changed = update_prices(db)
+        db.execute("UPDATE players_fantasy SET next_week = ?", (scored_week + 1,))
+        db.execute(
+            "INSERT INTO gameweek_rollovers (week, users_scored, prices_changed) VALUES (?, ?, ?)",
+            (scored_week, users_scored, prices_changed),
+        )
+        db.execute("DROP TABLE IF EXISTS temp.gameweek_points")
+        db.execute("DROP TABLE IF EXISTS temp.gameweek_prices")
+        return RolloverReport(scored_week, users_scored, prices_changed, time.perf_counter() - start)
+
+    return get_pool(db_path).run(work)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> RolloverReport:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--feed", default=os.path.join(BASE_DIR, "database", "players.csv"), help="CSV with the gameweek points and prices."
+    )
+    parser.add_argument("--week", type=int, default=None, help="Gameweek scored, the players' next_week by default.")
+    parser.add_argument("--db", default=None, help="Path to the database, balliq.db by default.")
+    parser.add_argument("--points-column", default="event_points", help="Column of the feed with the gameweek points.")
+    parser.add_argument("--price-column", default="now_cost", help="Column of the feed with the prices.")
+    parser.add_argument("--no-prices", action="store_true", help="Only score the users.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Users scored by each UPDATE.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    feed = read_feed(args.feed, args.points_column, args.price_column)
+    print(f"read {len(feed.points)} players from the feed in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def progress(done, total):
+        print(f"  scored {done}/{total} users, {time.perf_counter() - start:.2f} s")
+
+    report = rollover(feed, args.week, not args.no_prices, args.db, args.batch_size, progress)
+    print(
+        f"gameweek {report.week}: {report.users_scored} users scored, {report.prices_changed} prices changed "
+        f"in {report.seconds:.2f} s"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Versioned schema migrations of `balliq.db`.
+
+The schema version is stored in `PRAGMA user_version`. Each migration has the version it
+brings the database to and runs in its own BEGIN IMMEDIATE transaction together with the
+update of that version, so a migration is either fully applied or not at all, and two
+processes starting at the same time don't apply it twice. Every statement is also written
+to be harmless when repeated, so a database migrated by hand is left as it is. A new,
+empty database first gets the tables of `create_database.ipynb`.
+
+The committed `balliq.db` is kept migrated and in WAL mode, so starting the app leaves it
+as it is. After adding a migration, migrate it as a build step and commit it, from the
+`Ball_IQ` folder:
+    python -m data.migrations
+The migrations also run when the connection pool of a database is created, see
+`data.connection.get_pool`, so a database that is behind, such as a new one, is brought up
+to date before any query of the app.
+"""
+
+import sqlite3
+from contextlib import closing
+from typing import Callable, List, NamedTuple, Optional
+
+from data.loader import get_sqlite_database_path
+from data.player_index import fold
+
+
+def name_key(name: str) -> str:
+    """
+    Normalized form of a player name stored in players_fantasy.name_key.
+
+    Code inserting or renaming players sets the column with this function.
+
+    Args:
+        name (str): Name as written in players_fantasy.name.
+
+    Returns:
+        str: Case-folded name without accents or punctuation, e.g. "martin odegaard".
+    """
+    return fold(name)
+
+
+def _column_exists(db: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in db.execute(f"PRAGMA table_info({table})"))
+
+
+# The tables of data/database/create_database.ipynb, created when a new database is migrated
+BASE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        team_name TEXT NOT NULL,
+        budget REAL NOT NULL CHECK(budget >= 0 AND budget <= 100),
+        points INTEGER DEFAULT 0 CHECK(points >= 0)
+    )""",
+    """CREATE TABLE IF NOT EXISTS players_fantasy (
+        player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        team TEXT NOT NULL,
+        position TEXT NOT NULL CHECK(position IN ('Goalkeeper', 'Defender', 'Midfielder', 'Forward')),
+        price REAL NOT NULL CHECK(price >= 0),
+        price_evolution REAL DEFAULT 0,
+        points_per_game REAL DEFAULT 0,
+        form_rank INTEGER CHECK(form_rank >= 0),
+        total_fantasy_points INTEGER DEFAULT 0,
+        next_week INTEGER DEFAULT 0 CHECK(next_week >= 0),
+        expected_points_next_game REAL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS player_stats (
+        player_id INTEGER PRIMARY KEY,
+        goals INTEGER DEFAULT 0 CHECK(goals >= 0),
+        assists INTEGER DEFAULT 0 CHECK(assists >= 0),
+        yellow_cards INTEGER DEFAULT 0 CHECK(yellow_cards >= 0),
+        red_cards INTEGER DEFAULT 0 CHECK(red_cards >= 0),
+        penalties_defended INTEGER DEFAULT 0 CHECK(penalties_defended >= 0),
+        own_goals INTEGER DEFAULT 0 CHECK(own_goals >= 0),
+        clean_sheets INTEGER DEFAULT 0 CHECK(clean_sheets >= 0),
+        saves INTEGER DEFAULT 0 CHECK(saves >= 0),
+        starts INTEGER DEFAULT 0 CHECK(starts >= 0),
+        penalties_missed INTEGER DEFAULT 0 CHECK(penalties_missed >= 0),
+        FOREIGN KEY (player_id) REFERENCES players_fantasy(player_id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_team (
+        user_id INTEGER NOT NULL,
+        player_id INTEGER NOT NULL,
+        starting_eleven INTEGER DEFAULT 0 CHECK(starting_eleven IN (0, 1)),
+        on_team INTEGER DEFAULT 0 CHECK(on_team IN (0, 1)),
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+        FOREIGN KEY (player_id) REFERENCES players_fantasy(player_id) ON DELETE CASCADE,
+        PRIMARY KEY (user_id, player_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS fixtures (
+        week INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        home_team TEXT NOT NULL,
+        away_team TEXT NOT NULL,
+        PRIMARY KEY (week, home_team, away_team)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_user_team_user_id ON user_team(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_user_team_player_id ON user_team(player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_player_stats_player_id ON player_stats(player_id)",
+    "CREATE INDEX IF NOT EXISTS idx_players_fantasy_next_week ON players_fantasy(next_week)",
+    "CREATE INDEX IF NOT EXISTS idx_fixtures_week ON fixtures(week)",
+]
+
+
+def _create_tables(db: sqlite3.Connection) -> None:
+    """Create the tables of the notebook that are missing, the base every migration builds on."""
+    for statement in BASE_SCHEMA:
+        db.execute(statement)
+
+
+def _add_name_indexes(db: sqlite3.Connection) -> None:
+    """Index the exact names and a normalized copy of them for the lookups of the tools."""
+    if not _column_exists(db, "players_fantasy", "name_key"):
+        db.execute("ALTER TABLE players_fantasy ADD COLUMN name_key TEXT")
+    rows = db.execute("SELECT player_id, name FROM players_fantasy").fetchall()
+    db.executemany(
+        "UPDATE players_fantasy SET name_key = ? WHERE player_id = ?",
+        [(name_key(name), player_id) for player_id, name in rows],
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_players_fantasy_name ON players_fantasy(name)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_players_fantasy_name_key ON players_fantasy(name_key)")
+
+
+def _add_recommendation_index(db: sqlite3.Connection) -> None:
+    """Index the best players of each position, walked by the top-N candidate query."""
+    db.execute(
+        """CREATE INDEX IF NOT EXISTS idx_players_fantasy_position_points
+        ON players_fantasy(position, expected_points_next_game)"""
+    )
+
+
+def _add_gameweek_rollovers(db: sqlite3.Connection) -> None:
+    """Record the gameweeks already scored, so a rollover is never applied twice."""
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS gameweek_rollovers (
+            week INTEGER PRIMARY KEY,
+            users_scored INTEGER NOT NULL,
+            prices_changed INTEGER NOT NULL,
+            finished_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+
+
+# Rebuilds the summary rows of the users picked by {users}, from at most a squad of rows each.
+# An upsert rather than INSERT OR REPLACE, whose conflict clause the statement firing the trigger would override.
+SUMMARY_REFRESH = """
+    INSERT INTO user_squad_summary (
+        user_id, squad, starting_eleven, squad_size, starters, goalkeepers, defenders,
+        midfielders, forwards, squad_value, budget, expected_xi_points
+    )
+    SELECT
+        u.user_id,
+        json_group_array(ut.player_id) FILTER (WHERE p.player_id IS NOT NULL),
+        json_group_array(ut.player_id) FILTER (WHERE ut.starting_eleven = 1),
+        COUNT(p.player_id),
+        COUNT(p.player_id) FILTER (WHERE ut.starting_eleven = 1),
+        COUNT(p.player_id) FILTER (WHERE p.position = 'Goalkeeper'),
+        COUNT(p.player_id) FILTER (WHERE p.position = 'Defender'),
+        COUNT(p.player_id) FILTER (WHERE p.position = 'Midfielder'),
+        COUNT(p.player_id) FILTER (WHERE p.position = 'Forward'),
+        ROUND(TOTAL(p.price), 2),
+        u.budget,
+        ROUND(TOTAL(p.expected_points_next_game) FILTER (WHERE ut.starting_eleven = 1), 2)
+    FROM users u
+    LEFT JOIN user_team ut ON ut.user_id = u.user_id AND ut.on_team = 1
+    LEFT JOIN players_fantasy p ON p.player_id = ut.player_id
+    WHERE {users}
+    GROUP BY u.user_id
+    ON CONFLICT(user_id) DO UPDATE SET
+        squad = excluded.squad, starting_eleven = excluded.starting_eleven,
+        squad_size = excluded.squad_size, starters = excluded.starters,
+        goalkeepers = excluded.goalkeepers, defenders = excluded.defenders,
+        midfielders = excluded.midfielders, forwards = excluded.forwards,
+        squad_value = excluded.squad_value, budget = excluded.budget,
+        expected_xi_points = excluded.expected_xi_points
+"""
+# The users owning a changed player, by the index on user_team(player_id)
+_OWNERS = "user_id IN (SELECT user_id FROM user_team WHERE player_id = NEW.player_id AND on_team = 1)"
+
+
+def _add_squad_summary(db: sqlite3.Connection) -> None:
+    """
+    Keep a summary of each user's squad, maintained by triggers on every write.
+
+    Changes of a squad rebuild the summary of its user only; changes of a player's price
+    or expected points are added to the summaries of the users owning him.
+    """
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS user_squad_summary (
+            user_id INTEGER PRIMARY KEY,
+            squad TEXT NOT NULL DEFAULT '[]',
+            starting_eleven TEXT NOT NULL DEFAULT '[]',
+            squad_size INTEGER NOT NULL DEFAULT 0,
+            starters INTEGER NOT NULL DEFAULT 0,
+            goalkeepers INTEGER NOT NULL DEFAULT 0,
+            defenders INTEGER NOT NULL DEFAULT 0,
+            midfielders INTEGER NOT NULL DEFAULT 0,
+            forwards INTEGER NOT NULL DEFAULT 0,
+            squad_value REAL NOT NULL DEFAULT 0,
+            budget REAL NOT NULL DEFAULT 0,
+            expected_xi_points REAL NOT NULL DEFAULT 0
+        )"""
+    )
+    triggers = {
+        "user_squad_summary_users_insert": f"""AFTER INSERT ON users BEGIN
+            {SUMMARY_REFRESH.format(users="u.user_id = NEW.user_id")};
+        END""",
+        "user_squad_summary_users_budget": """AFTER UPDATE OF budget ON users BEGIN
+            UPDATE user_squad_summary SET budget = NEW.budget WHERE user_id = NEW.user_id;
+        END""",
+        "user_squad_summary_users_delete": """AFTER DELETE ON users BEGIN
+            DELETE FROM user_squad_summary WHERE user_id = OLD.user_id;
+        END""",
+        "user_squad_summary_team_insert": f"""AFTER INSERT ON user_team BEGIN
+            {SUMMARY_REFRESH.format(users="u.user_id = NEW.user_id")};
+        END""",
+        "user_squad_summary_team_update": f"""AFTER UPDATE ON user_team
+        WHEN OLD.on_team IS NOT NEW.on_team OR OLD.starting_eleven IS NOT NEW.starting_eleven
+            OR OLD.user_id != NEW.user_id OR OLD.player_id != NEW.player_id
+        BEGIN
+            {SUMMARY_REFRESH.format(users="u.user_id IN (OLD.user_id, NEW.user_id)")};
+        END""",
+        "user_squad_summary_team_delete": f"""AFTER DELETE ON user_team BEGIN
+            {SUMMARY_REFRESH.format(users="u.user_id = OLD.user_id")};
+        END""",
+        "user_squad_summary_player_price": f"""AFTER UPDATE OF price ON players_fantasy
+        WHEN OLD.price != NEW.price
+        BEGIN
+            UPDATE user_squad_summary SET squad_value = ROUND(squad_value + NEW.price - OLD.price, 2)
+            WHERE {_OWNERS};
+        END""",
+        "user_squad_summary_player_points": """AFTER UPDATE OF expected_points_next_game ON players_fantasy
+        WHEN OLD.expected_points_next_game IS NOT NEW.expected_points_next_game
+        BEGIN
+            UPDATE user_squad_summary
+            SET expected_xi_points = ROUND(
+                expected_xi_points + IFNULL(NEW.expected_points_next_game, 0) - IFNULL(OLD.expected_points_next_game, 0), 2
+            )
+            WHERE user_id IN (
+                SELECT user_id FROM user_team WHERE player_id = NEW.player_id AND on_team = 1 AND starting_eleven = 1
+            );
+        END""",
+        "user_squad_summary_player_position": f"""AFTER UPDATE OF position ON players_fantasy
+        WHEN OLD.position != NEW.position
+        BEGIN
+            {SUMMARY_REFRESH.format(users="u." + _OWNERS)};
+        END""",
+    }
+    for name, body in triggers.items():
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    db.execute(SUMMARY_REFRESH.format(users="1"))
+
+
+def _add_captain(db: sqlite3.Connection) -> None:
+    """Let a user pick the captain of the starting eleven, at most one per user."""
+    if not _column_exists(db, "user_team", "captain"):
+        db.execute("ALTER TABLE user_team ADD COLUMN captain INTEGER NOT NULL DEFAULT 0 CHECK(captain IN (0, 1))")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_team_captain ON user_team(user_id) WHERE captain = 1")
+
+
+def _add_chat_messages(db: sqlite3.Connection) -> None:
+    """Keep the messages of every conversation, appended in order and read back by conversation."""
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS chat_messages (
+            message_id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_messages_conversation ON chat_messages(user_id, conversation_id, message_id)"
+    )
+
+
+def _add_chat_summaries(db: sqlite3.Connection) -> None:
+    """Keep the rolling summary of the older messages of each conversation and how many it covers."""
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            covered_messages INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            PRIMARY KEY (user_id, conversation_id)
+        )"""
+    )
+
+
+# Tables read by every user, whose changes move the player data version
+PLAYER_DATA_TABLES = ("players_fantasy", "player_stats", "fixtures")
+
+
+def _add_player_data_version(db: sqlite3.Connection) -> None:
+    """Count the changes to the player, stats and fixture tables in one row kept by triggers.
+
+    PRAGMA data_version also moves when a chat message or a user's team is written, this
+    version only when the data shared by every user does.
+    """
+    db.execute(
+        """CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+    db.execute("INSERT OR IGNORE INTO data_versions (name) VALUES ('player_data')")
+    for table in PLAYER_DATA_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            db.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS data_versions_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = 'player_data';
+                END"""
+            )
+
+
+class Migration(NamedTuple):
+    """A change of the schema and the version it brings the database to."""
+
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+# In order, the version of each migration is one more than the previous one
+MIGRATIONS: List[Migration] = [
+    Migration(1, "index player names and their normalized form", _add_name_indexes),
+    Migration(2, "index players by position and expected points", _add_recommendation_index),
+    Migration(3, "record the gameweek rollovers", _add_gameweek_rollovers),
+    Migration(4, "summarize each user's squad", _add_squad_summary),
+    Migration(5, "add the captain of the starting eleven", _add_captain),
+    Migration(6, "store the messages of the conversations", _add_chat_messages),
+    Migration(7, "store the summaries of the older messages", _add_chat_summaries),
+    Migration(8, "count the changes to the player data", _add_player_data_version),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(db: sqlite3.Connection) -> int:
+    """Read the schema version of a database."""
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: Optional[str] = None, target: int = LATEST_VERSION) -> List[Migration]:
+    """
+    Apply the migrations a database is missing.
+
+    Args:
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+        target (int): Version to migrate to, the latest by default.
+
+    Returns:
+        list: The migrations applied, empty when the database was up to date.
+    """
+    applied = []
+    with closing(sqlite3.connect(db_path or get_sqlite_database_path(), timeout=30, isolation_level=None)) as db:
+        if schema_version(db) >= target:
+            return applied
+        for migration in MIGRATIONS:
+            if migration.version > target:
+                break
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Read again under the lock, another process may have just migrated
+                version = schema_version(db)
+                if version < migration.version:
+                    if version == 0:
+                        _create_tables(db)
+                    migration.apply(db)
+                    db.execute(f"PRAGMA user_version = {migration.version}")
+                    applied.append(migration)
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+    return applied
+
+
+if __name__ == "__main__":
+    # Imported here, data.connection imports this module
+    from data.connection import PRAGMAS
+
+    for migration in migrate():
+        print(f"migrated to version {migration.version}: {migration.description}")
+    with closing(sqlite3.connect(get_sqlite_database_path())) as db:
+        # Stored in the file, so the pool opening it doesn't write the header again
+        db.execute(f"PRAGMA journal_mode = {PRAGMAS['journal_mode']}")
+        print(f"schema version {schema_version(db)}")
@@ -0,0 +1,328 @@
+import bisect
+import csv
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from data.connection import get_pool
+from data.loader import BASE_DIR
+
+PLAYERS_CSV_PATH = os.path.join(BASE_DIR, "database", "players.csv")
+
+# Names used by the users and by players.csv for the teams stored in the database
+TEAM_ALIASES = {
+    "arsenal": "Arsenal",
+    "gunners": "Arsenal",
+    "aston villa": "Aston Villa",
+    "villa": "Aston Villa",
+    "bournemouth": "Bournemouth",
+    "brentford": "Brentford",
+    "brighton": "Brighton",
+    "chelsea": "Chelsea",
+    "crystal palace": "Crystal Palace",
+    "palace": "Crystal Palace",
+    "everton": "Everton",
+    "fulham": "Fulham",
+    "ipswich": "Ipswich Town",
+    "ipswich town": "Ipswich Town",
+    "leicester": "Leicester City",
+    "leicester city": "Leicester City",
+    "liverpool": "Liverpool",
+    "man city": "Manchester City",
+    "manchester city": "Manchester City",
+    "man utd": "Manchester United",
+    "man united": "Manchester United",
+    "manchester united": "Manchester United",
+    "newcastle": "Newcastle United",
+    "newcastle united": "Newcastle United",
+    "nott m forest": "Nottingham Forest",
+    "nottingham forest": "Nottingham Forest",
+    "forest": "Nottingham Forest",
+    "southampton": "Southampton",
+    "spurs": "Tottenham",
+    "tottenham": "Tottenham",
+    "west ham": "West Ham",
+    "wolves": "Wolves",
+}
+
+# Words of the messages that are never player names, even if a player is called Will or Max
+STOPWORDS = {
+    "about", "add", "added", "against", "and", "any", "are", "assists", "bench", "best",
+    "bring", "buy", "can", "captain", "cards", "clean", "did", "does", "eleven", "fixture",
+    "fixtures", "for", "form", "from", "game", "games", "get", "give", "goals", "has",
+    "have", "his", "how", "into", "like", "lineup", "made", "many", "match", "matches",
+    "max", "me", "next", "out", "play", "player", "players", "playing", "plays", "please",
+    "points", "price", "remove", "replace", "sell", "sheets", "show", "squad", "starting",
+    "stats", "swap", "team", "tell", "the", "this", "transfer", "upcoming", "want", "week",
+    "what", "when", "who", "will", "with", "would", "you", "your",
+}
+
+# Letters that NFKD does not split into a base letter and an accent
+SPECIAL_LETTERS = str.maketrans({"ø": "o", "æ": "ae", "ß": "ss", "ł": "l", "đ": "d", "ı": "i"})
+
+
+def fold(text: str) -> str:
+    """
+    Fold a name for matching: no accents, lower case, only letters, digits and single spaces.
+
+    Args:
+        text (str): The text to fold.
+
+    Returns:
+        str: The folded text, e.g. "Ødegaard" becomes "odegaard".
+    """
+    text = unicodedata.normalize("NFKD", text.lower().translate(SPECIAL_LETTERS))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+def load_web_names(csv_path: str = PLAYERS_CSV_PATH) -> Dict[int, str]:
+    """
+    Read the short name of each player from players.csv.
+
+    Args:
+        csv_path (str): Path to players.csv.
+
+    Returns:
+        dict: The `web_name` of each player id, empty if the file is missing.
+    """
+    if not os.path.exists(csv_path):
+        return {}
+    with open(csv_path, newline="", encoding="utf-8") as file:
+        return {int(row["id"]): row["web_name"] for row in csv.DictReader(file)}
+
+
+def trigrams(token: str) -> Set[str]:
+    """
+    Character trigrams of a token, padded so the start and end of the word count.
+
+    Args:
+        token (str): A folded word.
+
+    Returns:
+        set: The trigrams of the word.
+    """
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlayerMatch(NamedTuple):
+    """A player found in a message, with the columns the chains show the model."""
+
+    player_id: int
+    name: str
+    web_name: str
+    team: str
+    position: str
+    price: float
+    score: float
+
+
+class PlayerNameIndex:
+    """
+    In-memory index to find which players a message talks about.
+
+    Every word of the full name and of the short name (`web_name` in players.csv) is
+    indexed after folding accents. A word of the message matches a player exactly, as the
+    prefix of one of the player's words ("haal"), or by trigram similarity for typos
+    ("halland"). Matches are weighted by how rare the word is, so "Salah" outweighs "Mohamed".
+    """
+
+    def __init__(self, players: List[Dict], min_similarity: float = 0.6, min_relative_score: float = 0.35):
+        """
+        Build the index.
+
+        Args:
+            players (list): Dicts with player_id, name, web_name, team, position and price.
+            min_similarity (float): Minimum trigram similarity of a misspelled word.
+            min_relative_score (float): Players scoring below this share of the best match are dropped.
+        """
+        self.players = {player["player_id"]: player for player in players}
+        self.min_similarity = min_similarity
+        self.min_relative_score = min_relative_score
+
+        self.token_players: Dict[str, Set[int]] = defaultdict(set)
+        for player in players:
+            for token in set(fold(player["name"]).split() + fold(player["web_name"]).split()):
+                self.token_players[token].add(player["player_id"])
+
+        self.idf = {
+            token: math.log(1 + len(players) / len(ids)) for token, ids in self.token_players.items()
+        }
+        self.trigram_tokens: Dict[str, Set[str]] = defaultdict(set)
+        self.token_trigrams: Dict[str, Set[str]] = {}
+        for token in self.token_players:
+            self.token_trigrams[token] = trigrams(token)
+            for trigram in self.token_trigrams[token]:
+                self.trigram_tokens[trigram].add(token)
+        self.sorted_tokens = sorted(self.token_players)
+
+        self.team_pattern = re.compile(
+            r"\b(" + "|".join(sorted(map(re.escape, TEAM_ALIASES), key=len, reverse=True)) + r")\b"
+        )
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple], csv_path: str = PLAYERS_CSV_PATH, **kwargs) -> "PlayerNameIndex":
+        """
+        Build the index from players_fantasy rows and the short names of players.csv.
+
+        Args:
+            rows (iterable): Tuples of (player_id, name, team, position, price).
+            csv_path (str): Path to players.csv, whose `id` is the `player_id` of the database.
+            **kwargs: Options passed to the index.
+
+        Returns:
+            PlayerNameIndex: The index of the players.
+        """
+        web_names = load_web_names(csv_path)
+        players = [
+            {
+                "player_id": player_id,
+                "name": name,
+                "web_name": web_names.get(player_id, name),
+                "team": team,
+                "position": position,
+                "price": price,
+            }
+            for player_id, name, team, position, price in rows
+        ]
+        return cls(players, **kwargs)
+
+    @classmethod
+    def from_database(cls, db_path: Optional[str] = None, csv_path: str = PLAYERS_CSV_PATH, **kwargs) -> "PlayerNameIndex":
+        """
+        Build the index from the players_fantasy table and the short names of players.csv.
+
+        Args:
+            db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+            csv_path (str): Path to players.csv, whose `id` is the `player_id` of the database.
+            **kwargs: Options passed to the index.
+
+        Returns:
+            PlayerNameIndex: The index of every player.
+        """
+        rows = get_pool(db_path).fetch_all("SELECT player_id, name, team, position, price FROM players_fantasy")
+        return cls.from_rows(rows, csv_path, **kwargs)
+
+    def _match_token(self, token: str) -> Dict[str, float]:
+        """
+        Find the indexed words a word of the message stands for.
+
+        Args:
+            token (str): A folded word of the message.
+
+        Returns:
+            dict: Indexed words with the strength of the match, between 0 and 1.
+        """
+        if token in self.token_players:
+            return {token: 1.0}
+
+        matches = {}
+        # Beginning of a name, e.g. "haal" or "trent"
+        if len(token) >= 4:
+            start = bisect.bisect_left(self.sorted_tokens, token)
+            for candidate in self.sorted_tokens[start:]:
+                if not candidate.startswith(token):
+                    break
+                matches[candidate] = 0.8
+        if matches:
+            return matches
+
+        # Misspelled name, compared on the trigrams it shares with the indexed words
+        query = trigrams(token)
+        shared = defaultdict(int)
+        for trigram in query:
+            for candidate in self.trigram_tokens.get(trigram, ()):
+                shared[candidate] += 1
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(query) + len(self.token_trigrams[candidate]))
+            if similarity >= self.min_similarity:
+                matches[candidate] = 0.8 * similarity
+        return matches
+
+    def search(self, text: str, k: int = 5) -> List[PlayerMatch]:
+        """
+        Find the players mentioned in a message.
+
+        Args:
+            text (str): The message from the user.
+            k (int): Maximum number of players kept per word of the message.
+
+        Returns:
+            list: The candidate players, best match first.
+        """
+        folded = self.team_pattern.sub(" ", fold(text))
+        scores: Dict[int, float] = defaultdict(float)
+        kept: Set[int] = set()
+        for token in set(folded.split()):
+            if len(token) < 3 or token in STOPWORDS:
+                continue
+            token_scores: Dict[int, float] = {}
+            for candidate, strength in self._match_token(token).items():
+                for player_id in self.token_players[candidate]:
+                    score = strength * self.idf[candidate]
+                    token_scores[player_id] = max(token_scores.get(player_id, 0.0), score)
+            for player_id, score in token_scores.items():
+                scores[player_id] += score
+            # Each word keeps its own best players, so two names in one message both survive
+            kept.update(sorted(token_scores, key=token_scores.get, reverse=True)[:k])
+
+        if not scores:
+            return []
+        best = max(scores.values())
+        matches = [
+            PlayerMatch(score=scores[player_id], **self.players[player_id])
+            for player_id in kept
+            if scores[player_id] >= self.min_relative_score * best
+        ]
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches
+
+    def mentions(self, text: str) -> bool:
+        """
+        Whether a message names a team, or a player by one of the exact words of his name.
+
+        Unlike `search`, prefixes and typos don't count, so an ordinary word is never taken for a name.
+
+        Args:
+            text (str): The message from the user.
+
+        Returns:
+            bool: True if a team or player is named.
+        """
+        return bool(self.mentioned_names(text))
+
+    def mentioned_names(self, text: str) -> Tuple[str, ...]:
+        """
+        The teams and player names a message mentions, found as in `mentions`.
+
+        Args:
+            text (str): The message from the user.
+
+        Returns:
+            tuple: The team names as stored in the database and the folded words of player
+                names, sorted, empty when the message names no one.
+        """
+        folded = fold(text)
+        teams = {TEAM_ALIASES[alias] for alias in self.team_pattern.findall(folded)}
+        words = {
+            token for token in folded.split()
+            if len(token) >= 3 and token not in STOPWORDS and token in self.token_players
+        }
+        return tuple(sorted(teams | words))
+
+    def search_teams(self, text: str) -> List[str]:
+        """
+        Find the teams mentioned in a message, by name or nickname.
+
+        Args:
+            text (str): The message from the user.
+
+        Returns:
+            list: The team names as stored in the database.
+        """
+        return sorted({TEAM_ALIASES[alias] for alias in self.team_pattern.findall(fold(text))})
+
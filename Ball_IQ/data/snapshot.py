@@ -0,0 +1,281 @@
+from data.connection import get_pool
+from data.loader import get_sqlite_database_path
+from data.player_index import PlayerNameIndex
+from data.transfer_recommender import Candidate, TransferRecommender
+from functools import cached_property
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+
+# Columns loaded from each table, in the order of the columnar arrays
+PLAYER_COLUMNS = (
+    "player_id", "name", "team", "position", "price", "price_evolution", "points_per_game",
+    "form_rank", "total_fantasy_points", "next_week", "expected_points_next_game",
+)
+STATS_COLUMNS = (
+    "player_id", "goals", "assists", "yellow_cards", "red_cards", "penalties_defended",
+    "own_goals", "clean_sheets", "saves", "starts", "penalties_missed",
+)
+FIXTURE_COLUMNS = ("week", "date", "home_team", "away_team")
+
+
+def load_columns(db, table, columns, order_by):
+    """
+    Read a table into one NumPy array per column.
+
+    Args:
+        db (sqlite3.Connection): Connection to the database.
+        table (str): Name of the table.
+        columns (tuple): Columns to read.
+        order_by (str): Columns that fix the order of the rows.
+
+    Returns:
+        dict: Array of each column, all with one entry per row.
+    """
+    rows = db.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order_by}").fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {column: np.asarray(value) for column, value in zip(columns, values)}
+
+
+class SnapshotTables:
+    """
+    Immutable copy of players_fantasy, player_stats and fixtures at one data version.
+
+    Each table is a dict of NumPy arrays. The row lists pasted in prompts and the indexes
+    built on top of the tables are derived on first use and live as long as the tables.
+    """
+
+    def __init__(self, version, players, stats, fixtures):
+        """
+        Initialize the tables.
+
+        Args:
+            version (tuple): Data version the tables were read at.
+            players (dict): Columns of players_fantasy, ordered by player_id.
+            stats (dict): Columns of player_stats, ordered by player_id.
+            fixtures (dict): Columns of fixtures, ordered by week and date.
+        """
+        self.version = version
+        self.players = players
+        self.stats = stats
+        self.fixtures = fixtures
+        self.row_by_id = {player_id: row for row, player_id in enumerate(players["player_id"].tolist())}
+        self.row_by_name = {name: row for row, name in enumerate(players["name"].tolist())}
+
+    def player_rows(self, rows, columns):
+        """
+        Build row tuples of players_fantasy.
+
+        Args:
+            rows (array): Rows of the players, every player if None.
+            columns (tuple): Columns of the tuples.
+
+        Returns:
+            list: One tuple per player.
+        """
+        arrays = [self.players[column] if rows is None else self.players[column][rows] for column in columns]
+        return list(zip(*(array.tolist() for array in arrays)))
+
+    def stats_rows(self, names=None):
+        """
+        Build the rows of stats shown to the model, for some players or all of them.
+
+        Args:
+            names (iterable, optional): Names of the players, every player with stats if not given.
+
+        Returns:
+            list: Tuples of (goals, assists, yellow_cards, red_cards, penalties_defended,
+                own_goals, clean_sheets, saves, starts, penalties_missed, price_evolution,
+                form_rank, name).
+        """
+        stat_rows = np.arange(len(self.stats["player_id"]))
+        if names is not None:
+            wanted = [self.row_by_name[name] for name in names if name in self.row_by_name]
+            stat_rows = np.flatnonzero(np.isin(self.stats["player_id"], self.players["player_id"][wanted]))
+        player_rows = [self.row_by_id[player_id] for player_id in self.stats["player_id"][stat_rows].tolist()]
+        columns = [self.stats[column][stat_rows] for column in STATS_COLUMNS[1:]]
+        columns += [self.players[column][player_rows] for column in ("price_evolution", "form_rank", "name")]
+        return list(zip(*(column.tolist() for column in columns)))
+
+    def fixture_rows(self, teams=None):
+        """
+        Build the fixture rows, for some teams or all of them.
+
+        Args:
+            teams (iterable, optional): Teams playing home or away, every fixture if not given.
+
+        Returns:
+            list: Tuples of (week, date, home_team, away_team) in calendar order.
+        """
+        columns = [self.fixtures[column] for column in FIXTURE_COLUMNS]
+        if teams is not None:
+            teams = list(teams)
+            mask = np.isin(self.fixtures["home_team"], teams) | np.isin(self.fixtures["away_team"], teams)
+            columns = [column[mask] for column in columns]
+        return list(zip(*(column.tolist() for column in columns)))
+
+    @cached_property
+    def names_and_teams(self):
+        """(name, team) of every player."""
+        return self.player_rows(None, ("name", "team"))
+
+    @cached_property
+    def names(self):
+        """(name,) of every player."""
+        return self.player_rows(None, ("name",))
+
+    @cached_property
+    def market(self):
+        """(name, team, position, price, expected_points_next_game) of every player."""
+        return self.player_rows(None, ("name", "team", "position", "price", "expected_points_next_game"))
+
+    @cached_property
+    def all_stats(self):
+        """Stats rows of every player, see `stats_rows`."""
+        return self.stats_rows()
+
+    @cached_property
+    def all_fixtures(self):
+        """Every fixture, see `fixture_rows`."""
+        return self.fixture_rows()
+
+    @cached_property
+    def player_index(self):
+        """Index of the player names, to send the model only the players a message talks about."""
+        return PlayerNameIndex.from_rows(self.player_rows(None, ("player_id", "name", "team", "position", "price")))
+
+    @cached_property
+    def transfer_recommender(self):
+        """Recommender of the players to buy under a budget."""
+        columns = ("player_id", "name", "team", "position", "price", "expected_points_next_game")
+        return TransferRecommender(Candidate(*row) for row in self.player_rows(None, columns))
+
+
+class PlayerDataSnapshot:
+    """
+    Read-only columnar copy of the player, stats and fixture tables shared by every chain.
+
+    The snapshot is reloaded when its tables change: the player data version, moved by
+    triggers on every write to them, is read on a dedicated connection, and the file's
+    inode sees the database being rebuilt. Writes to the users' teams or the chat messages
+    don't cause a reload. The check runs at most every `check_interval` seconds. A reload builds new tables and swaps them in at once,
+    so readers see either the old data or the new data, never a mix.
+
+    Anything that depends on a user's team is not stored here.
+    """
+
+    def __init__(self, db_path=None, check_interval=1.0):
+        """
+        Load the snapshot from the SQLite database.
+
+        Args:
+            db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+            check_interval (float): Minimum number of seconds between two checks of the data version.
+        """
+        self.db_path = db_path or get_sqlite_database_path()
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watched_inode = None
+        self._last_check = 0.0
+        # The migrations add the player data version
+        get_pool(self.db_path)
+        self._tables = self._load(self._data_version())
+
+    def _data_version(self):
+        """
+        Identify the current content of the database.
+
+        Returns:
+            tuple: File inode and player data version.
+        """
+        stat = os.stat(self.db_path)
+        # A connection of its own, outside of any transaction, always reads the latest version.
+        # A rebuilt database is a new file, the old connection would keep reading the old one
+        if self._watcher is None or stat.st_ino != self._watched_inode:
+            if self._watcher is not None:
+                self._watcher.close()
+            self._watcher = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._watched_inode = stat.st_ino
+        data_version = self._watcher.execute(
+            "SELECT version FROM data_versions WHERE name = 'player_data'"
+        ).fetchone()[0]
+        return stat.st_ino, data_version
+
+    def _load(self, version):
+        """Read the three tables at once, in a single read transaction."""
+
+        def read(db):
+            players = load_columns(db, "players_fantasy", PLAYER_COLUMNS, "player_id")
+            stats = load_columns(db, "player_stats", STATS_COLUMNS, "player_id")
+            fixtures = load_columns(db, "fixtures", FIXTURE_COLUMNS, "week, date, home_team")
+            return SnapshotTables(version, players, stats, fixtures)
+
+        return get_pool(self.db_path).run(read, immediate=False)
+
+    def refresh(self, force=False):
+        """
+        Reload the tables if the database changed since they were read.
+
+        Args:
+            force (bool): Check the data version even if the last check was recent.
+
+        Returns:
+            SnapshotTables: The current tables.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return self._tables
+        with self._lock:
+            self._last_check = now
+            version = self._data_version()
+            if version != self._tables.version:
+                self._tables = self._load(version)
+        return self._tables
+
+    @property
+    def tables(self):
+        """The current tables, reloaded first if the database changed."""
+        return self.refresh()
+
+    @property
+    def version(self):
+        """Data version of the current tables."""
+        return self.tables.version
+
+    @property
+    def names_and_teams(self):
+        """(name, team) of every player."""
+        return self.tables.names_and_teams
+
+    @property
+    def names(self):
+        """(name,) of every player."""
+        return self.tables.names
+
+    @property
+    def market(self):
+        """(name, team, position, price, expected_points_next_game) of every player."""
+        return self.tables.market
+
+    @property
+    def stats(self):
+        """Stats, price evolution, form rank and name of every player."""
+        return self.tables.all_stats
+
+    @property
+    def fixtures(self):
+        """(week, date, home_team, away_team) of every fixture."""
+        return self.tables.all_fixtures
+
+    @property
+    def player_index(self):
+        """Index of the player names of the current tables."""
+        return self.tables.player_index
+
+    @property
+    def transfer_recommender(self):
+        """Recommender over the players of the current tables."""
+        return self.tables.transfer_recommender
@@ -0,0 +1,96 @@
+"""
+Per-user summary of the squad, read with a single primary key lookup.
+
+The `user_squad_summary` table holds, for every user, the ids of the squad and of the
+starting eleven, the number of players of each position, the value of the squad, the
+remaining budget and the expected points of the starting eleven. It is kept up to date
+by triggers created in `data.migrations`, so every writer (the tools, the transfer
+engine, the ETL and the gameweek rollover) updates it in the same transaction as its
+change, and readers never see it out of step with user_team.
+"""
+
+import json
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from data.connection import get_pool
+
+SUMMARY_COLUMNS = (
+    "user_id", "squad", "starting_eleven", "squad_size", "starters", "goalkeepers", "defenders",
+    "midfielders", "forwards", "squad_value", "budget", "expected_xi_points",
+)
+_SELECT_SUMMARY = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM user_squad_summary WHERE user_id = ?"
+
+
+class SquadSummary(NamedTuple):
+    """A user's squad as stored in user_squad_summary."""
+
+    user_id: int
+    squad: List[int]
+    starting_eleven: List[int]
+    squad_size: int
+    starters: int
+    positions: Dict[str, int]
+    squad_value: float
+    budget: float
+    expected_xi_points: float
+
+    @classmethod
+    def from_row(cls, row: Sequence) -> "SquadSummary":
+        user_id, squad, starting_eleven, squad_size, starters, goalkeepers, defenders, midfielders, forwards, *rest = row
+        positions = {"Goalkeeper": goalkeepers, "Defender": defenders, "Midfielder": midfielders, "Forward": forwards}
+        return cls(user_id, json.loads(squad), json.loads(starting_eleven), squad_size, starters, positions, *rest)
+
+
+def read_summary(db: sqlite3.Connection, user_id: int) -> Optional[SquadSummary]:
+    """
+    Read the summary of a user's squad on a connection, e.g. inside a transaction.
+
+    Args:
+        db (sqlite3.Connection): Connection to the database.
+        user_id (int): The user.
+
+    Returns:
+        SquadSummary: The summary, or None if the user does not exist.
+    """
+    row = db.execute(_SELECT_SUMMARY, (user_id,)).fetchone()
+    return None if row is None else SquadSummary.from_row(row)
+
+
+def get_summary(user_id: int, db_path: Optional[str] = None) -> Optional[SquadSummary]:
+    """
+    Read the summary of a user's squad.
+
+    Args:
+        user_id (int): The user.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        SquadSummary: The summary, or None if the user does not exist.
+    """
+    row = get_pool(db_path).fetch_one(_SELECT_SUMMARY, (user_id,))
+    return None if row is None else SquadSummary.from_row(row)
+
+
+def squad_players(user_id: int, columns: Sequence[str] = ("name",), db_path: Optional[str] = None) -> List[tuple]:
+    """
+    Read columns of players_fantasy for the players of a user's squad, best expected points first.
+
+    The squad comes from the summary and each player is found by its primary key.
+
+    Args:
+        user_id (int): The user.
+        columns (sequence): Columns of players_fantasy in each row.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        list: One tuple per player of the squad.
+    """
+    return get_pool(db_path).fetch_all(
+        f"""SELECT {', '.join(f'p.{column}' for column in columns)}
+        FROM user_squad_summary s, json_each(s.squad) j
+        JOIN players_fantasy p ON p.player_id = j.value
+        WHERE s.user_id = ?
+        ORDER BY p.expected_points_next_game DESC""",
+        (user_id,),
+    )
@@ -0,0 +1,297 @@
+"""
+Exact selection of the players to buy under a budget.
+
+Choosing k players that maximise expected points without exceeding a budget is a 0/1
+knapsack with a cardinality constraint. Prices have one decimal, so the budget is counted
+in tenths and the knapsack is solved exactly by dynamic programming over NumPy arrays.
+
+Before the dynamic programming each position bucket is pruned: when n players are needed
+from a bucket, a player that is beaten on price and points by n others can never be part
+of the best choice. This leaves a few dozen candidates out of several hundred.
+"""
+
+import bisect
+import csv
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from data.connection import get_pool
+
+POSITIONS = ("Goalkeeper", "Defender", "Midfielder", "Forward")
+# Position codes of players.csv
+CSV_POSITIONS = {"GKP": "Goalkeeper", "DEF": "Defender", "MID": "Midfielder", "FWD": "Forward"}
+# Prices are stored with one decimal
+PRICE_UNITS = 10
+
+
+def to_units(money: float) -> int:
+    """Convert an amount of money to whole tenths, rounding down so the budget is never exceeded."""
+    return int(np.floor(money * PRICE_UNITS + 1e-9))
+
+
+class Candidate(NamedTuple):
+    """A player that can be bought."""
+
+    player_id: int
+    name: str
+    team: str
+    position: str
+    price: float
+    expected_points: float
+
+
+class Recommendation(NamedTuple):
+    """The players chosen to buy."""
+
+    players: List[Candidate]
+    total_price: float
+    total_points: float
+    budget: float
+
+    def describe(self) -> str:
+        """Summarize the recommendation for a prompt."""
+        if not self.players:
+            return f"No combination of players fits a budget of {self.budget:g}."
+        lines = ["Recommended players (name, team, position, price, expected_points_next_game):"]
+        lines += [f"{p.name}, {p.team}, {p.position}, {p.price:g}, {p.expected_points:g}" for p in self.players]
+        lines.append(
+            f"Total price: {self.total_price:g} of a budget of {self.budget:g}. "
+            f"Total expected points: {self.total_points:g}"
+        )
+        return "\n".join(lines)
+
+
+class Swap(NamedTuple):
+    """A player to buy in place of one of the squad."""
+
+    player_in: Candidate
+    points_gained: float
+    budget_left: float
+
+
+class TransferRecommender:
+    """
+    Recommend the players to buy with a budget, over price-sorted arrays of every player.
+
+    The arrays are built once and shared. The squad, budget and exclusions of the user are
+    given on each call.
+    """
+
+    def __init__(self, players: Iterable[Candidate]):
+        """
+        Build the arrays.
+
+        Args:
+            players (iterable): Every player that can be bought.
+        """
+        players = sorted(players, key=lambda player: (player.price, -player.expected_points))
+        self.players = players
+        self.ids = np.array([player.player_id for player in players], dtype=np.int64)
+        self.positions = np.array([player.position for player in players])
+        self.prices = np.array([player.price for player in players], dtype=np.float64)
+        self.costs = np.rint(self.prices * PRICE_UNITS).astype(np.int64)
+        self.points = np.array([player.expected_points for player in players], dtype=np.float64)
+        self.row_by_id = {player_id: row for row, player_id in enumerate(self.ids.tolist())}
+
+    @classmethod
+    def from_database(cls, db_path: Optional[str] = None) -> "TransferRecommender":
+        """
+        Build the recommender from the players_fantasy table.
+
+        Args:
+            db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+        Returns:
+            TransferRecommender: Recommender over every player.
+        """
+        rows = get_pool(db_path).fetch_all(
+            """SELECT player_id, name, team, position, price, expected_points_next_game
+            FROM players_fantasy"""
+        )
+        return cls(Candidate(*row) for row in rows)
+
+    @classmethod
+    def from_players_csv(cls, csv_path: str) -> "TransferRecommender":
+        """
+        Build the recommender straight from a players.csv export, as used by `create_database.ipynb`.
+
+        Args:
+            csv_path (str): Path to the csv file.
+
+        Returns:
+            TransferRecommender: Recommender over every player of the file.
+        """
+        with open(csv_path, newline="", encoding="utf-8") as file:
+            players = [
+                Candidate(
+                    int(row["id"]),
+                    row["name"],
+                    row["team"],
+                    CSV_POSITIONS[row["position"]],
+                    int(row["now_cost"]) / 10,
+                    float(row["ep_next"] or 0),
+                )
+                for row in csv.DictReader(file)
+            ]
+        return cls(players)
+
+    def _available(self, exclude: Iterable[int], positions: Optional[Sequence[str]], max_cost: int) -> np.ndarray:
+        """Rows of the players that can be bought, in price order."""
+        mask = self.costs <= max_cost
+        if positions:
+            mask &= np.isin(self.positions, list(positions))
+        excluded = [self.row_by_id[player_id] for player_id in exclude if player_id in self.row_by_id]
+        mask[excluded] = False
+        return np.flatnonzero(mask)
+
+    def _prune(self, rows: np.ndarray, needed: int) -> np.ndarray:
+        """
+        Drop the players beaten on price and points by at least `needed` other players.
+
+        The rows are in price order, cheapest first, and equal prices are sorted by points.
+        """
+        kept: List[int] = []
+        # Points of the kept players, sorted, to count the ones at least as good
+        kept_points: List[float] = []
+        for row, points in zip(rows.tolist(), self.points[rows].tolist()):
+            if len(kept_points) - bisect.bisect_left(kept_points, points) < needed:
+                kept.append(row)
+                bisect.insort(kept_points, points)
+        return np.array(kept, dtype=np.int64)
+
+    def _knapsack(self, rows: np.ndarray, needed: int, capacity: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best points of exactly `needed` players among `rows` for every budget up to `capacity`.
+
+        Returns:
+            The best points by budget (minus infinity when impossible) and the table of
+            decisions used to recover the players.
+        """
+        best = np.full((needed + 1, capacity + 1), -np.inf)
+        best[0] = 0.0
+        taken = np.zeros((len(rows), needed + 1, capacity + 1), dtype=bool)
+        for item, row in enumerate(rows.tolist()):
+            cost, points = self.costs[row], self.points[row]
+            if cost > capacity:
+                continue
+            # Going down in count uses each player at most once
+            for count in range(min(needed, item + 1), 0, -1):
+                candidate = best[count - 1, : capacity + 1 - cost] + points
+                improved = candidate > best[count, cost:]
+                best[count, cost:] = np.where(improved, candidate, best[count, cost:])
+                taken[item, count, cost:] = improved
+        return best[needed], taken
+
+    def _recover(self, rows: np.ndarray, taken: np.ndarray, needed: int, capacity: int) -> List[int]:
+        """Follow the decisions of `_knapsack` back to the chosen rows."""
+        chosen = []
+        for item in range(len(rows) - 1, -1, -1):
+            if needed and taken[item, needed, capacity]:
+                chosen.append(int(rows[item]))
+                needed -= 1
+                capacity -= self.costs[rows[item]]
+        return chosen
+
+    def recommend(
+        self,
+        budget: float,
+        count: int = 3,
+        positions: Optional[Sequence[str]] = None,
+        position_counts: Optional[Dict[str, int]] = None,
+        exclude: Iterable[int] = (),
+        max_price: Optional[float] = None,
+    ) -> Recommendation:
+        """
+        Choose the players to buy with the most expected points within the budget.
+
+        Args:
+            budget (float): Money available for every player together.
+            count (int): Number of players to buy, ignored when `position_counts` is given.
+            positions (sequence, optional): Positions the players may have, any if not given.
+            position_counts (dict, optional): Exact number of players of each position.
+            exclude (iterable): Ids of the players that can't be bought, such as the squad.
+            max_price (float, optional): Maximum price of a single player.
+
+        Returns:
+            Recommendation: The best players, empty when no combination fits the budget.
+        """
+        capacity = to_units(budget)
+        max_cost = capacity if max_price is None else min(capacity, to_units(max_price))
+        exclude = list(exclude)
+        groups = (
+            [([position], needed) for position, needed in position_counts.items() if needed > 0]
+            if position_counts
+            else [(positions, count)]
+        )
+
+        # Best points of every group alone, then combined over the budget
+        combined = None
+        solved = []
+        for group_positions, needed in groups:
+            rows = self._prune(self._available(exclude, group_positions, max_cost), needed)
+            group_best, taken = self._knapsack(rows, needed, capacity)
+            splits = np.zeros(capacity + 1, dtype=np.int64)
+            if not solved:
+                # The first group has the whole budget
+                combined = group_best
+                solved.append((rows, taken, needed, splits))
+                continue
+            # totals[c] is the best of spending a on the groups so far and c - a on this one
+            totals = np.full(capacity + 1, -np.inf)
+            # Spending more on the previous groups only helps where their points go up
+            steps = np.flatnonzero(combined > np.concatenate(([-np.inf], combined[:-1])))
+            for spent in steps.tolist():
+                candidate = combined[spent] + group_best[: capacity + 1 - spent]
+                improved = candidate > totals[spent:]
+                totals[spent:] = np.where(improved, candidate, totals[spent:])
+                splits[spent:][improved] = spent
+            combined = totals
+            solved.append((rows, taken, needed, splits))
+
+        if np.isneginf(combined[capacity]):
+            return Recommendation([], 0.0, 0.0, budget)
+
+        chosen, remaining = [], capacity
+        for rows, taken, needed, splits in reversed(solved):
+            spent_before = int(splits[remaining])
+            chosen += self._recover(rows, taken, needed, remaining - spent_before)
+            remaining = spent_before
+
+        players = sorted((self.players[row] for row in chosen), key=lambda player: -player.expected_points)
+        return Recommendation(
+            players,
+            round(sum(player.price for player in players), 2),
+            round(sum(player.expected_points for player in players), 2),
+            budget,
+        )
+
+    def best_swaps(self, player_out_id: int, budget: float, exclude: Iterable[int] = (), k: int = 3) -> List[Swap]:
+        """
+        Find the best players of the same position to buy in place of a squad player.
+
+        Args:
+            player_out_id (int): The player to sell.
+            budget (float): Money available before selling.
+            exclude (iterable): Ids of the players that can't be bought, such as the squad.
+            k (int): Number of options returned.
+
+        Returns:
+            list: The swaps with the most expected points gained, best first.
+        """
+        out = self.players[self.row_by_id[player_out_id]]
+        available_money = budget + out.price
+        rows = self._available(
+            list(exclude) + [player_out_id],
+            [out.position],
+            to_units(available_money),
+        )
+        best = rows[np.argsort(-self.points[rows], kind="stable")[:k]]
+        return [
+            Swap(
+                self.players[row],
+                round(self.points[row] - out.expected_points, 2),
+                round(available_money - self.prices[row], 2),
+            )
+            for row in best.tolist()
+        ]
@@ -0,0 +1,213 @@
+"""
+Atomic execution of transfers.
+
+A transfer sells players out of a user's squad and buys others in. Several transfers made
+together, such as a wildcard, are applied as a single change: either all of them or none.
+
+Each batch is one short BEGIN IMMEDIATE transaction that writes first and checks after,
+on player ids: selling only touches players on the squad, buying only players off it, and
+a single statement then moves the money at the current prices while checking the budget
+and the size of the squad, as kept by the triggers of the squad summary. When a row count
+shows that a rule was broken the transaction is rolled back, and only then is the squad
+read to tell the user why.
+"""
+
+import sqlite3
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from data.connection import get_pool
+from data.migrations import name_key
+from data.squad_summary import read_summary
+
+# Most players a squad can hold
+MAX_SQUAD_SIZE = 15
+# Times a transfer is validated again after losing a race with another one
+MAX_ATTEMPTS = 5
+
+
+class TransferError(Exception):
+    """Raised when a transfer breaks a rule of the game, with a message for the user."""
+
+
+class Transfer(NamedTuple):
+    """One player sold and one bought, either may be missing."""
+
+    player_out_id: Optional[int]
+    player_in_id: Optional[int]
+
+
+class TransferResult(NamedTuple):
+    """Outcome of a batch of transfers."""
+
+    transfers: List[Transfer]
+    budget_before: float
+    budget_after: float
+    squad_size: int
+
+
+class _Refused(Exception):
+    """A check of the write failed, the transaction is rolled back."""
+
+
+def _placeholders(values: Sequence) -> str:
+    return ",".join("?" * len(values))
+
+
+def _squad_names(db: sqlite3.Connection, user_id: int, player_ids: List[int], on_team: bool) -> str:
+    """Names of the given players that are, or are not, on the user's squad."""
+    rows = db.execute(
+        f"""SELECT name FROM players_fantasy
+        WHERE player_id IN ({_placeholders(player_ids)})
+            AND player_id {'' if on_team else 'NOT '}IN (SELECT player_id FROM user_team WHERE user_id = ? AND on_team = 1)""",
+        (*player_ids, user_id),
+    ).fetchall()
+    return "', '".join(row[0] for row in rows)
+
+
+def _validate(db: sqlite3.Connection, user_id: int, outs: List[int], ins: List[int]) -> None:
+    """Find which rule a refused batch of transfers breaks, from the summary of the squad."""
+    summary = read_summary(db, user_id)
+    if summary is None:
+        raise TransferError("Your user does not exist.")
+    ins_found, price_out, price_in = db.execute(
+        f"""
+        SELECT
+            (SELECT COUNT(*) FROM players_fantasy WHERE player_id IN ({_placeholders(ins)})),
+            (SELECT TOTAL(price) FROM players_fantasy WHERE player_id IN ({_placeholders(outs)})),
+            (SELECT TOTAL(price) FROM players_fantasy WHERE player_id IN ({_placeholders(ins)}))
+        """,
+        (*ins, *outs, *ins),
+    ).fetchone()
+    squad = set(summary.squad)
+    budget = summary.budget
+
+    if ins_found < len(ins):
+        raise TransferError("The player you want to bring in does not exist in the fantasy player list.")
+    if not squad.issuperset(outs):
+        names = _squad_names(db, user_id, outs, on_team=False)
+        raise TransferError(f"'{names}' is not currently on your team.")
+    if squad.intersection(ins):
+        names = _squad_names(db, user_id, ins, on_team=True)
+        raise TransferError(f"'{names}' is already on your team.")
+    if summary.squad_size - len(outs) + len(ins) > MAX_SQUAD_SIZE:
+        raise TransferError(f"You can't have more than {MAX_SQUAD_SIZE} players on your team.")
+    if budget + price_out - price_in < 0:
+        raise TransferError(
+            f"Insufficient budget: you have {budget + price_out:.2f} after selling and the players cost {price_in:.2f}."
+        )
+
+
+def _apply(db: sqlite3.Connection, user_id: int, outs: List[int], ins: List[int]) -> Tuple[float, float, int]:
+    """
+    Write a batch of transfers, raising `_Refused` as soon as a check fails.
+
+    Returns:
+        tuple: Budget before and after the batch, and the new squad size.
+    """
+    sold = db.executemany(
+        "UPDATE user_team SET on_team = 0, starting_eleven = 0, captain = 0 WHERE user_id = ? AND player_id = ? AND on_team = 1",
+        [(user_id, player_id) for player_id in outs],
+    ).rowcount
+    # A player sold before keeps his row, buying him back sets it again
+    bought = db.executemany(
+        """INSERT INTO user_team (user_id, player_id, on_team, starting_eleven) VALUES (?, ?, 1, 0)
+        ON CONFLICT(user_id, player_id) DO UPDATE SET on_team = 1, starting_eleven = 0 WHERE on_team = 0""",
+        [(user_id, player_id) for player_id in ins],
+    ).rowcount
+    if sold != len(outs) or bought != len(ins):
+        raise _Refused()
+
+    budget_before = db.execute("SELECT budget FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if budget_before is None:
+        raise _Refused()
+    # Budget, squad size and the existence of the players bought are checked in the statement that moves the money,
+    # the squad summary was already updated by the triggers of the writes above
+    delta = f"""(SELECT TOTAL(price) FROM players_fantasy WHERE player_id IN ({_placeholders(outs)}))
+        - (SELECT TOTAL(price) FROM players_fantasy WHERE player_id IN ({_placeholders(ins)}))"""
+    updated = db.execute(
+        f"""
+        UPDATE users SET budget = ROUND(budget + {delta}, 2)
+        WHERE user_id = ?
+            AND budget + {delta} >= 0
+            AND (SELECT squad_size FROM user_squad_summary WHERE user_id = ?) <= ?
+            AND (SELECT COUNT(*) FROM players_fantasy WHERE player_id IN ({_placeholders(ins)})) = ?
+        """,
+        (*outs, *ins, user_id, *outs, *ins, user_id, MAX_SQUAD_SIZE, *ins, len(ins)),
+    ).rowcount
+    if updated != 1:
+        raise _Refused()
+
+    budget_after, squad_size = db.execute(
+        "SELECT budget, squad_size FROM user_squad_summary WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return budget_before[0], budget_after, squad_size
+
+
+def execute_transfers(user_id: int, transfers: Iterable[Transfer], db_path: Optional[str] = None) -> TransferResult:
+    """
+    Apply a batch of transfers to a user's squad atomically.
+
+    Args:
+        user_id (int): The user making the transfers.
+        transfers (iterable): The transfers, a wildcard is simply many of them.
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        TransferResult: The budget before and after the batch and the new squad size.
+
+    Raises:
+        TransferError: If the batch breaks a rule, in which case nothing is changed.
+    """
+    transfers = list(transfers)
+    outs = [t.player_out_id for t in transfers if t.player_out_id is not None]
+    ins = [t.player_in_id for t in transfers if t.player_in_id is not None]
+    if not ins and not outs:
+        raise TransferError("You always need to state a player to bring to your team.")
+    if len(set(outs)) < len(outs) or len(set(ins)) < len(ins) or set(outs) & set(ins):
+        raise TransferError("Each player can only be moved once in a batch of transfers.")
+
+    pool = get_pool(db_path)
+    for _ in range(MAX_ATTEMPTS):
+        try:
+            budget_before, budget_after, squad_size = pool.run(lambda db: _apply(db, user_id, outs, ins))
+        except _Refused:
+            # Raises the reason, unless another transfer changed the squad since the refusal
+            pool.run(lambda db: _validate(db, user_id, outs, ins), immediate=False)
+            continue
+        except sqlite3.IntegrityError as error:
+            # The users table keeps the budget under its maximum
+            raise TransferError(f"This transfer breaks a rule of your team: {error}") from None
+        return TransferResult(transfers, budget_before, budget_after, squad_size)
+    raise TransferError("Your team changed while the transfer was being made, please try again.")
+
+
+def resolve_player_ids(names: Iterable[str], db_path: Optional[str] = None) -> dict:
+    """
+    Find the player_id of each player name, written exactly or with other case and accents.
+
+    Args:
+        names (iterable): Names of players, e.g. "Martin Ødegaard" or "martin odegaard".
+        db_path (str, optional): Path to the database, defaults to `get_sqlite_database_path()`.
+
+    Returns:
+        dict: player_id of each name found.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    # Names folding to the same key, e.g. "Ødegaard" and "odegaard", share one lookup
+    keys = {name: name_key(name) for name in names}
+    unique_keys = list(dict.fromkeys(keys.values()))
+    # Both lookups use the indexes on name and name_key
+    rows = get_pool(db_path).fetch_all(
+        f"""SELECT name, name_key, player_id FROM players_fantasy
+        WHERE name IN ({_placeholders(names)}) OR name_key IN ({_placeholders(unique_keys)})""",
+        (*names, *unique_keys),
+    )
+    exact = {name: player_id for name, _, player_id in rows}
+    folded = {key: player_id for _, key, player_id in rows}
+    return {
+        name: exact.get(name, folded.get(keys[name]))
+        for name in names
+        if name in exact or keys[name] in folded
+    }
@@ -6,7 +6,7 @@ import re
 import time
 from PIL import Image
 from streamlit_app_not_main_file.users_db import UserDatabase
-from chatbot.bot import MainChatbot  # Import the chatbot class
+from chatbot.registry import get_chatbot  # Shared chatbot factory, builds each bot once per process
 import subprocess
 
 
@@ -343,24 +343,10 @@ def about_us_page():
 def chat_page():
     user_input = st.chat_input("Say something")
 
-    def simulate_streaming(message):
-        buffer = ""
-        for char in message:
-            buffer += char
-            if char == " " or char == "\n":
-                yield buffer
-                buffer = ""
-                if char == "\n":  # To simulate line breaks
-                    time.sleep(0.1)  # Longer pause for newlines (optional)
-                else:
-                    time.sleep(0.05)
-        if buffer:  # Yield any remaining characters
-            yield buffer
-
     st.title("BallIQ Chatbot")
     
-    bot = MainChatbot(st.session_state.user_id, 1)
-    bot.user_login(st.session_state.user_id, 1)
+    # Reruns get the bot already built for this user instead of creating a new one
+    bot = get_chatbot(st.session_state.user_id, 1)
 
     # Initialize chat history
     if "messages" not in st.session_state:
@@ -397,8 +383,8 @@ def chat_page():
     if isinstance(user_input, str):
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
-            response = bot.process_user_input({"customer_input": user_input})
-            st.write_stream(simulate_streaming(response))
+            # The reply is shown as the model writes it, write_stream returns the whole text
+            response = st.write_stream(bot.stream_user_input({"customer_input": user_input}))
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
 
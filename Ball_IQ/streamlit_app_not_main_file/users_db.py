@@ -1,5 +1,5 @@
-from data.loader import *
-import sqlite3
+from data.loader import get_sqlite_database_path
+from data.connection import get_pool
 
 
 class UserDatabase:
@@ -17,17 +17,16 @@ class UserDatabase:
 
     This class provides methods for common operations such as adding,
     removing, and updating users, as well as verifying and retrieving user data.
+
+    Streamlit runs each session in its own thread, so every method borrows a connection
+    from the shared pool instead of keeping one.
     """
 
     def __init__(self):
         """
         Initialize the UserDatabase instance.
-
-        Args:
-            conn (sqlite3.Connection): SQLite database connection object.
         """
-        db_path = get_sqlite_database_path()
-        self.db = sqlite3.connect(db_path)
+        self.pool = get_pool(get_sqlite_database_path())
 
     def check_if_email_exists(self, email):
         """
@@ -39,14 +38,9 @@ class UserDatabase:
         Returns:
             bool: True if the email exists, False otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            cursor.execute(
-                "SELECT email FROM users WHERE email = :email", {"email": email}
-            )
-            return cursor.fetchone() is not None
-        finally:
-            cursor.close()
+        return self.pool.fetch_one(
+            "SELECT email FROM users WHERE email = :email", {"email": email}
+        ) is not None
 
     def add_user(self, username, email, password, team_name):
         """
@@ -61,9 +55,8 @@ class UserDatabase:
         Returns:
             bool: True if the user was added successfully, False otherwise.
         """
-        cursor = self.db.cursor()
         try:
-            cursor.execute(
+            self.pool.run(lambda db: db.execute(
                 """
                 INSERT INTO users (username, email, password, team_name, budget, points)
                 VALUES (:username, :email, :password, :team_name, :budget, :points)
@@ -76,13 +69,10 @@ class UserDatabase:
                     "budget": 100,
                     "points": 0,
                 },
-            )
-            self.db.commit()
+            ))
             return True
         except Exception as e:
             return False
-        finally:
-            cursor.close()
 
     def remove_user(self, email):
         """
@@ -94,13 +84,10 @@ class UserDatabase:
         Returns:
             bool: True if a user was removed, False otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            cursor.execute("DELETE FROM users WHERE email = :email", {"email": email})
-            self.conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            cursor.close()
+        removed = self.pool.run(
+            lambda db: db.execute("DELETE FROM users WHERE email = :email", {"email": email}).rowcount
+        )
+        return removed > 0
 
     def verify_user(self, email, password):
         """
@@ -113,15 +100,10 @@ class UserDatabase:
         Returns:
             bool: True if the user is verified, False otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            cursor.execute(
-                "SELECT user_id FROM users WHERE email = :email AND password = :password",
-                {"email": email, "password": password},
-            )
-            return cursor.fetchone() is not None
-        finally:
-            cursor.close()
+        return self.pool.fetch_one(
+            "SELECT user_id FROM users WHERE email = :email AND password = :password",
+            {"email": email, "password": password},
+        ) is not None
 
     def get_user_id(self, email):
         """
@@ -133,15 +115,10 @@ class UserDatabase:
         Returns:
             int or None: User ID if found, None otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            cursor.execute(
-                "SELECT user_id FROM users WHERE email = :email", {"email": email}
-            )
-            result = cursor.fetchone()
-            return result[0] if result else None
-        finally:
-            cursor.close()
+        result = self.pool.fetch_one(
+            "SELECT user_id FROM users WHERE email = :email", {"email": email}
+        )
+        return result[0] if result else None
 
     def get_user_details(self, email):
         """
@@ -154,16 +131,11 @@ class UserDatabase:
             tuple or None: User details (first_name, last_name, email, phone, address, gender, date_of_birth)
             if found, None otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            cursor.execute(
-                """SELECT username, email, team_name, budget, points
-                FROM users WHERE email = :email""",
-                {"email": email},
-            )
-            return cursor.fetchone()
-        finally:
-            cursor.close()
+        return self.pool.fetch_one(
+            """SELECT username, email, team_name, budget, points
+            FROM users WHERE email = :email""",
+            {"email": email},
+        )
 
     def update_user(self, email, **kwargs):
         """
@@ -176,12 +148,7 @@ class UserDatabase:
         Returns:
             bool: True if a user was updated, False otherwise.
         """
-        cursor = self.db.cursor()
-        try:
-            update_fields = ", ".join([f"{k} = :{k}" for k in kwargs.keys()])
-            query = f"UPDATE users SET {update_fields} WHERE email = :email"
-            cursor.execute(query, {**kwargs, "email": email})
-            self.conn.commit()
-            return cursor.rowcount > 0
-        finally:
-            cursor.close()
\ No newline at end of file
+        update_fields = ", ".join([f"{k} = :{k}" for k in kwargs.keys()])
+        query = f"UPDATE users SET {update_fields} WHERE email = :email"
+        updated = self.pool.run(lambda db: db.execute(query, {**kwargs, "email": email}).rowcount)
+        return updated > 0
\ No newline at end of file